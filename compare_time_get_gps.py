@@ -1,23 +1,56 @@
 import json
 from datetime import datetime
-from dateutil import parser as date_parser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
 import os
 import re
+import time
+
+import numpy as np
+
+from maskcam.config import config
+from maskcam.archive import (
+    open_archived,
+    FILENAME_PATTERNS,
+    KIND_STATISTICS,
+    KIND_GPS_LOG,
+    KIND_MATCHED_GPS,
+)
+from maskcam.catalog import open_catalog
+from maskcam.gps import (
+    INTERPOLATE_METHODS,
+    MATCH_AFTER,
+    MATCH_MODES,
+    NO_MATCH,
+    GpsFixes,
+    benchmark_matching,
+    estimate_log_clock_offset,
+    interpolate_positions,
+    local_to_epoch_ns,
+    match_gps,
+    parse_times,
+    seconds_to_timedelta,
+)
+from maskcam.gps_store import load_gps_fixes
+from maskcam.export import WRITERS, DefectResults, read_columnar, write_results
 
 stats_dir ="/home/lab5/Desktop/inference_statistics"
 gps_dir ="/home/lab5/Desktop/gps_data"
 stats_pattern = re.compile(r"inference_statistics_(\d{4}-\d{2}-\d{2})_(\d{2}-\d{2}-\d{2})\.json")
 gps_pattern = re.compile(r"esp32_data_(\d{4}-\d{2}-\d{2})_(\d{2}-\d{2}-\d{2})\.txt")
 
-# Read species from file
-species_file = "/tmp/fault_type.txt"
-if os.path.exists(species_file):
-    with open(species_file, "r") as f:
-        species = f.read().strip()
-else:
-    species = "fastener"
+# Fault type of each run is in the catalog. This file only has the one
+# asked by the latest maskcam_run.py, for sessions without a catalog run
+fault_type_file = "/tmp/fault_type.txt"
+DEFAULT_FAULT_TYPE = "fastener"
 
 
+def read_fault_type_file():
+    if os.path.exists(fault_type_file):
+        with open(fault_type_file, "r") as f:
+            return f.read().strip() or DEFAULT_FAULT_TYPE
+    return DEFAULT_FAULT_TYPE
+
 
 def find_closest_file(directory, pattern):
     now = datetime.now()
@@ -42,34 +75,6 @@ def find_closest_file(directory, pattern):
     return closest_file
 
 
-def load_gps_data(file_path):
-    gps_data = []
-    with open(file_path, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if '@' not in line:
-                continue  # skip invalid lines
-
-            try:
-                prefix, rest = line.split(':', 1)
-                coords_part, time_part = rest.split('@')
-                lat_str, lon_str = coords_part.strip().split(',')
-                time_str = time_part.strip()
-
-                lat = float(lat_str.strip())
-                lon = float(lon_str.strip())
-                time_obj = datetime.strptime(time_str, "%Y-%m-%dT%H:%M:%S")
-
-                gps_data.append({
-                    'lat': lat,
-                    'lon': lon,
-                    'time': time_obj
-                })
-            except (ValueError, IndexError):
-                continue  # skip lines that don't match the expected format
-    return gps_data
-
-
 def load_defective_tracks(file_path):
     """
     Load tracks from JSON, flattening any level of nested lists.
@@ -78,7 +83,7 @@ def load_defective_tracks(file_path):
       - [ {...}, {...} ]
       - nested lists like [ [ {...} ], [ {...} ] ]
     """
-    with open(file_path, 'r') as f:
+    with open_archived(file_path, 'r') as f:
         data = json.load(f)
 
     # Extract the list under key if present
@@ -99,71 +104,405 @@ def load_defective_tracks(file_path):
 
     return flatten(data_list)
 
-# Find closest GPS entry for a given detection time
-def find_nearest_gps(detection_time, gps_data):
-    min_diff = None
-    nearest_entry = None
-    for entry in gps_data:
-        # Only consider entries with time AFTER detection_time
-        if entry['time'] > detection_time:
-            time_diff = (entry['time'] - detection_time).total_seconds()
-            if (min_diff is None) or (time_diff < min_diff):
-                min_diff = time_diff
-                nearest_entry = entry
-    return nearest_entry
-
-def main():
+def find_run_files(catalog):
+    """
+    Returns (statistics file, [GPS logs], run id, fault type) of the latest run
+    in the catalog, or the files closest to now by filename if there's no
+    catalog (run id None, fault type from fault_type_file).
+    """
+    if catalog is not None:
+        run = catalog.latest_run()
+        if run is not None:
+            stats_files = [
+                artifact['path']
+                for artifact in catalog.run_artifacts(run['id'], KIND_STATISTICS)
+                if os.path.exists(artifact['path'])
+            ]
+            # save_serial restarts create more than one log
+            gps_files = [
+                artifact['path']
+                for artifact in catalog.run_artifacts(run['id'], KIND_GPS_LOG)
+                if os.path.exists(artifact['path'])
+            ]
+            if stats_files:
+                return stats_files[-1], gps_files, run['id'], run['fault_type'] or read_fault_type_file()
+
+    #inference stats file
+    file_name = find_closest_file(stats_dir, stats_pattern)
+    stats_file = os.path.join(stats_dir, file_name) if file_name is not None else None
     # gps data file
     gps_txt_file = find_closest_file(gps_dir, gps_pattern)
+    gps_files = [os.path.join(gps_dir, gps_txt_file)] if gps_txt_file is not None else []
+    return stats_file, gps_files, None, read_fault_type_file()
+
+
+def load_fixes(gps_files, window, margin):
+    # Fixes from all the logs of a run, as one sorted GpsFixes
+    parts = [load_gps_fixes(path, *window, margin=margin) for path in gps_files]
+    if len(parts) == 1:
+        return parts[0]
+    return GpsFixes(
+        np.concatenate([part.times for part in parts]),
+        np.concatenate([part.lat for part in parts]),
+        np.concatenate([part.lon for part in parts]),
+    )
+
+
+def locate_tracks(tracks, gps_files, match_mode, max_gap, interpolate, clock_offset):
+    # Returns (lats, lons, matched, timestamps_ns) arrays, or None on errors
     # check if there is no file
-    if gps_txt_file is None:
+    if not gps_files:
         print(f"Error: No GPS data file found in {gps_dir}")
-        return
-    gps_txt_file_path = os.path.join(gps_dir, gps_txt_file)
+        return None
     
-    #  Check if the GPS file is empty
-    if os.stat(gps_txt_file_path).st_size == 0:
-        print(f"GPS file {gps_txt_file} is empty. Aborting.")
-        return
-    gps_data = load_gps_data(gps_txt_file_path)
+    #  Check if the GPS files are empty
+    gps_files = [path for path in gps_files if os.stat(path).st_size > 0]
+    if not gps_files:
+        print("GPS files are empty. Aborting.")
+        return None
 
-    #inference stats file
-    file_name = find_closest_file(stats_dir, stats_pattern)
-    if file_name is None:
+    detection_times = parse_times([track['detection_time'] for track in tracks])
+    if clock_offset is None:
+        # From the arrival times of the latest log, its fixes are only for logs without them
+        clock_offset = estimate_log_clock_offset(gps_files[-1], load_gps_fixes(gps_files[-1]))
+        print(f"Estimated camera to GPS clock offset: {clock_offset:.3f} s")
+    detection_times = detection_times + seconds_to_timedelta(clock_offset)
+    # With max_gap, only the fixes around the detections are needed
+    # (read from the binary GPS store when there's one)
+    window = (detection_times.min(), detection_times.max()) if len(detection_times) else (None, None)
+    gps_fixes = load_fixes(gps_files, window, margin=max_gap)
+    if len(gps_fixes) == 0:
+        print(f"GPS files {gps_files} have no valid fixes. Aborting.")
+        return None
+
+    # Process all detection times at once (sorted GPS times, binary search)
+    timestamps_ns = np.zeros(len(detection_times), dtype=np.int64)
+    if interpolate is None:
+        matches = match_gps(gps_fixes, detection_times, mode=match_mode, max_gap=max_gap)
+        matched = matches != NO_MATCH
+        lats = np.where(matched, gps_fixes.lat[matches], np.nan)
+        lons = np.where(matched, gps_fixes.lon[matches], np.nan)
+        timestamps_ns[matched] = local_to_epoch_ns(gps_fixes.times[matches[matched]])
+    else:
+        lats, lons, matched = interpolate_positions(
+            gps_fixes, detection_times, method=interpolate, max_gap=max_gap
+        )
+        timestamps_ns[matched] = local_to_epoch_ns(detection_times[matched])
+    return lats, lons, matched, timestamps_ns
+
+
+def match_session(stats_file, gps_files, fault_type, match_mode, max_gap, interpolate, clock_offset):
+    # DefectResults of the located defective tracks of one session, or None on errors
+    defective_tracks = load_defective_tracks(stats_file)
+
+    # Tracks already tagged while running (see maskcam_run.tag_defects_position)
+    # don't need the GPS log
+    n_tracks = len(defective_tracks)
+    lats, lons = np.full(n_tracks, np.nan), np.full(n_tracks, np.nan)
+    matched = np.zeros(n_tracks, dtype=bool)
+    timestamps_ns = np.zeros(n_tracks, dtype=np.int64)
+    tagged = np.array(['lat' in track for track in defective_tracks], dtype=bool)
+    if tagged.any():
+        tagged_tracks = [track for track in defective_tracks if 'lat' in track]
+        lats[tagged] = [track['lat'] for track in tagged_tracks]
+        lons[tagged] = [track['lon'] for track in tagged_tracks]
+        matched[tagged] = True
+        timestamps_ns[tagged] = local_to_epoch_ns(
+            parse_times([track['gps_time'] for track in tagged_tracks])
+        )
+        print(f"{tagged.sum()} of {n_tracks} tracks already have GPS positions")
+    if not tagged.all():
+        untagged_tracks = [track for track in defective_tracks if 'lat' not in track]
+        located = locate_tracks(
+            untagged_tracks, gps_files, match_mode, max_gap, interpolate, clock_offset
+        )
+        if located is None:
+            return None
+        untagged = ~tagged
+        lats[untagged], lons[untagged], matched[untagged], timestamps_ns[untagged] = located
+
+    if not matched.all():
+        print(f"No matching GPS found for {n_tracks - matched.sum()} of {n_tracks} tracks")
+    results = DefectResults(
+        [track['track_id'] for track in defective_tracks],
+        [track.get('confidence', 0) for track in defective_tracks],
+        lats,
+        lons,
+        fault_type,
+        timestamps_ns,
+    )
+    return results[matched]
+
+
+def main(match_mode=MATCH_AFTER, max_gap=None, interpolate=None, clock_offset=0.0, formats=("lp",)):
+    """
+    formats: output formats, see maskcam.export.WRITERS. Line protocol
+      (lp, read by send_data_telegraf.py) is the default.
+    interpolate: None to use the matched fix position, or an interpolation
+      method to compute the position at the detection time between fixes.
+    clock_offset: seconds to add to detection times to get GPS clock times,
+      or None to estimate it from the GPS log.
+    """
+    catalog = open_catalog(config)
+    file_path, gps_files, run_id, fault_type = find_run_files(catalog)
+    if file_path is None:
         print(f"Error: No inference statistics file found in directory: {stats_dir}")
         return
-    file_path = os.path.join(stats_dir, file_name)
-    defective_tracks = load_defective_tracks(file_path)
+    results = match_session(file_path, gps_files, fault_type, match_mode, max_gap, interpolate, clock_offset)
+    if results is None:
+        return
     
-    # prepare output directory and file
+    # prepare output directory and files
     output_dir = "/home/lab5/Desktop/final_data"
     os.makedirs(output_dir, exist_ok=True)
-    output_filename = f"matched_gps_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.txt"
-    output_path = os.path.join(output_dir, output_filename)
-    
-    with open(output_path, 'w') as out_file:
-        for track in defective_tracks:
-            detection_time = date_parser.parse(track['detection_time'])
-            nearest_gps = find_nearest_gps(detection_time, gps_data)
-
-            if nearest_gps:
-                measurement = "inference_result"
-                tag_part = f"track_id={track['track_id']}"
-                field_part = (
-                    f"confidence={track.get('confidence', 0)},"
-                    f"matched_lat={nearest_gps['lat']},"
-                    f"matched_lon={nearest_gps['lon']},"
-                    f"species='{species}'"
-                )
-                timestamp_ns = int(nearest_gps['time'].timestamp() * 1e9)
-
-                output_text = f"{measurement},{tag_part} {field_part} {timestamp_ns}\n"
-                out_file.write(output_text)
-            else:
-                print("No matching GPS found for current track")           
-
-    print(f"File {output_filename} is written to {output_dir} successfully!")
+    output_base = os.path.join(output_dir, f"matched_gps_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}")
+    output_paths = write_results(results, output_base, formats)
+
+    if catalog is not None:
+        if "lp" in formats:
+            lp_path = output_base + WRITERS["lp"].extension
+            catalog.add_artifact(run_id, KIND_MATCHED_GPS, lp_path, ended=datetime.now().timestamp())
+        catalog.close()
+    for output_path in output_paths:
+        print(f"File {os.path.basename(output_path)} is written to {output_dir} successfully!")
+
+
+def find_sessions(root_dir, catalog=None, slack=60):
+    """
+    Statistics files under root_dir, each paired with the GPS logs whose time
+    range overlaps it (filename time to modification time, +-slack seconds).
+    Returns a list of (session id, statistics file, [GPS logs], fault type)
+    sorted by time, the session id being the statistics filename time. The
+    fault type is the one of the catalog run of the statistics file, or None.
+    """
+    found = {KIND_STATISTICS: [], KIND_GPS_LOG: []}
+    for dir_path, _, file_names in os.walk(root_dir):
+        for file_name in file_names:
+            for kind, pattern, time_format in FILENAME_PATTERNS:
+                match = pattern.search(file_name)
+                if match and kind in found:
+                    path = os.path.join(dir_path, file_name)
+                    started = datetime.strptime(match.group(1), time_format).timestamp()
+                    found[kind].append((started, os.path.getmtime(path), path, match.group(1)))
+                    break
+
+    sessions = []
+    gps_logs = sorted(found[KIND_GPS_LOG])
+    for started, ended, stats_file, session_id in sorted(found[KIND_STATISTICS]):
+        gps_files = [
+            path
+            for gps_started, gps_ended, path, _ in gps_logs
+            if gps_started <= ended + slack and gps_ended >= started - slack
+        ]
+        run = catalog.run_of(stats_file) if catalog is not None else None
+        fault_type = run['fault_type'] if run is not None else None
+        sessions.append((session_id, stats_file, gps_files, fault_type))
+    return sessions
+
+
+def inputs_signature(paths):
+    # Changes if any input file is modified, added or removed
+    signature = {}
+    for path in paths:
+        stat = os.stat(path)
+        signature[path] = [stat.st_size, stat.st_mtime_ns]
+    return signature
+
+
+def batch_formats(formats):
+    # The columnar output of each session is also what the merged result is built from
+    return ("columnar",) + tuple(format_name for format_name in formats if format_name != "columnar")
+
+
+def process_session(session_id, stats_file, gps_files, fault_type, output_base, options, formats):
+    # Runs in a worker process of run_batch()
+    t_start = time.perf_counter()
+    results = match_session(stats_file, gps_files, fault_type, **options)
+    if results is not None:
+        write_results(results, output_base, batch_formats(formats))
+    n_rows = len(results) if results is not None else 0
+    return session_id, results is not None, n_rows, time.perf_counter() - t_start
+
+
+def write_manifest(manifest_path, manifest):
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def run_batch(root_dir, output_dir, workers, options, formats=("lp",), force=False):
+    """
+    Match every session found under root_dir in a process pool. Writes the
+    outputs of each session and merged ones into output_dir. Sessions whose
+    inputs and options are unchanged since the last run (manifest.json) are skipped.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, "manifest.json")
+    manifest = {}
+    if os.path.exists(manifest_path) and not force:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+
+    catalog = open_catalog(config)
+    sessions = find_sessions(root_dir, catalog)
+    if catalog is not None:
+        catalog.close()
+    unknown = [session for session in sessions if session[3] is None]
+    if unknown:
+        fallback = read_fault_type_file()
+        print(f"{len(unknown)} sessions have no fault type in the catalog, using '{fallback}'")
+        sessions = [
+            (session_id, stats_file, gps_files, fault_type or fallback)
+            for session_id, stats_file, gps_files, fault_type in sessions
+        ]
+    pending = []
+    for session_id, stats_file, gps_files, fault_type in sessions:
+        signature = inputs_signature([stats_file] + gps_files)
+        output_base = os.path.join(output_dir, f"matched_gps_{session_id}")
+        previous = manifest.get(session_id)
+        if (
+            previous is not None
+            and previous["inputs"] == signature
+            and previous["options"] == options
+            and previous.get("fault_type") == fault_type
+            and all(
+                os.path.exists(output_base + WRITERS[format_name].extension)
+                for format_name in batch_formats(formats)
+            )
+        ):
+            continue
+        pending.append((session_id, stats_file, gps_files, fault_type, output_base, signature))
+    print(f"{len(sessions)} sessions found in {root_dir}, {len(pending)} to process")
+
+    t_start = time.perf_counter()
+    n_done = n_defects = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                process_session, session_id, stats_file, gps_files, fault_type, output_base, options, formats
+            ): (output_base, signature, fault_type)
+            for session_id, stats_file, gps_files, fault_type, output_base, signature in pending
+        }
+        for future in as_completed(futures):
+            output_base, signature, fault_type = futures[future]
+            session_id, ok, session_defects, seconds = future.result()
+            n_done += 1
+            n_defects += session_defects
+            if ok:
+                manifest[session_id] = {
+                    "inputs": signature,
+                    "options": options,
+                    "fault_type": fault_type,
+                    "output": output_base,
+                    "defects": session_defects,
+                }
+                write_manifest(manifest_path, manifest)  # Progress kept if interrupted
+            elapsed = time.perf_counter() - t_start
+            print(
+                f"[{n_done}/{len(pending)}] {session_id}: "
+                f"{session_defects if ok else 'FAILED'} defects in {seconds:.2f} s "
+                f"({n_done / elapsed:.1f} sessions/s, {n_defects / elapsed:.0f} defects/s)"
+            )
+
+    # Merged results, in session order (skipped sessions included)
+    columnar_extension = WRITERS["columnar"].extension
+    merged = DefectResults.concatenate(
+        read_columnar(manifest[session_id]["output"] + columnar_extension)
+        for session_id, _, _, _ in sessions
+        if session_id in manifest and os.path.exists(manifest[session_id]["output"] + columnar_extension)
+    )
+    merged_paths = write_results(merged, os.path.join(output_dir, "matched_gps_merged"), formats)
+    print(f"Merged results: {', '.join(merged_paths)} ({time.perf_counter() - t_start:.2f} s total)")
+
+
+def run_benchmark(n_fixes):
+    print(f"Matching 10000 detections against {n_fixes} synthetic GPS fixes (10 Hz)...")
+    results = benchmark_matching(n_fixes=n_fixes)
+    for mode in MATCH_MODES:
+        print(f"  match mode '{mode}': {results[mode] * 1000:.1f} ms")
+    print(f"  former linear scan (estimated): {results['legacy_estimated']:.1f} s")
+
 
 if __name__ == "__main__":
-    main()
+    arg_parser = argparse.ArgumentParser(description="Match defective tracks with GPS fixes")
+    arg_parser.add_argument(
+        "--match",
+        choices=MATCH_MODES,
+        default=MATCH_AFTER,
+        help="'after': first fix after the detection, 'nearest': closest fix on either side",
+    )
+    arg_parser.add_argument(
+        "--max-gap",
+        type=float,
+        default=None,
+        help="Discard matches further than this (seconds) from the detection, "
+        "or interpolations between fixes further apart than this",
+    )
+    arg_parser.add_argument(
+        "--interpolate",
+        choices=INTERPOLATE_METHODS,
+        default=None,
+        help="Interpolate the position at the detection time between the bracketing fixes",
+    )
+    offset_group = arg_parser.add_mutually_exclusive_group()
+    offset_group.add_argument(
+        "--clock-offset",
+        type=float,
+        default=0.0,
+        help="Seconds to add to detection times to get GPS clock times (camera latency, timezone)",
+    )
+    offset_group.add_argument(
+        "--estimate-offset",
+        action="store_true",
+        help="Estimate the clock offset from the GPS log: median of fix time minus arrival time "
+        "over its lines (save_serial arrival-timestamps), or last fix vs. log modification time "
+        "for logs without arrival times",
+    )
+    arg_parser.add_argument(
+        "--benchmark",
+        type=int,
+        metavar="N_FIXES",
+        nargs="?",
+        const=1_000_000,
+        help="Benchmark matching on a synthetic GPS log instead of processing files",
+    )
+    arg_parser.add_argument(
+        "--batch",
+        metavar="ROOT_DIR",
+        help="Process every session (statistics + overlapping GPS logs) found under this directory",
+    )
+    arg_parser.add_argument(
+        "--output",
+        default="/home/lab5/Desktop/final_data/batch",
+        help="Batch mode: output directory, also keeps the manifest of processed sessions",
+    )
+    arg_parser.add_argument(
+        "--workers", type=int, default=None, help="Batch mode: worker processes (default: CPUs)"
+    )
+    arg_parser.add_argument(
+        "--force", action="store_true", help="Batch mode: process all sessions, even if unchanged"
+    )
+    arg_parser.add_argument(
+        "--format",
+        action="append",
+        choices=list(WRITERS),
+        help="Output format, can be repeated (default: lp, InfluxDB line protocol)",
+    )
+    args = arg_parser.parse_args()
+    match_options = dict(
+        match_mode=args.match,
+        max_gap=args.max_gap,
+        interpolate=args.interpolate,
+        clock_offset=None if args.estimate_offset else args.clock_offset,
+    )
+    formats = tuple(args.format or ["lp"])
+    if args.benchmark:
+        run_benchmark(args.benchmark)
+    elif args.batch:
+        run_batch(
+            args.batch, args.output, args.workers, match_options, formats=formats, force=args.force
+        )
+    else:
+        main(formats=formats, **match_options)
 
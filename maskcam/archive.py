@@ -0,0 +1,39 @@
+import os
+import re
+import gzip
+
+# Files written by maskcam, recognized by their names, and the archives
+# (gzip) retention turns the old ones into. No dependencies, so low-level
+# readers (GPS logs, statistics) can use it without loading the catalog.
+
+KIND_STATISTICS = "statistics"
+KIND_GRASS = "grass"
+KIND_GPS_LOG = "gps-log"
+KIND_VIDEO = "video"
+KIND_MATCHED_GPS = "matched-gps"
+
+# Filenames written by maskcam: (kind, pattern, time format), e.g. for the
+# catalog backfill(). Statistics and logs may have been gzipped by retention
+FILENAME_TIME = r"(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})"
+FILENAME_TIME_FORMAT = "%Y-%m-%d_%H-%M-%S"
+ARCHIVE_EXTENSION = ".gz"
+ARCHIVED = r"(?:\.gz)?"
+FILENAME_PATTERNS = (
+    (KIND_STATISTICS, re.compile(rf"inference_statistics_{FILENAME_TIME}\.json{ARCHIVED}$"), FILENAME_TIME_FORMAT),
+    (KIND_GRASS, re.compile(rf"grass_events_log{FILENAME_TIME}\.json{ARCHIVED}$"), FILENAME_TIME_FORMAT),
+    (KIND_GPS_LOG, re.compile(rf"esp32_data_{FILENAME_TIME}\.txt{ARCHIVED}$"), FILENAME_TIME_FORMAT),
+    (KIND_MATCHED_GPS, re.compile(rf"matched_gps_{FILENAME_TIME}\.txt{ARCHIVED}$"), FILENAME_TIME_FORMAT),
+    (KIND_VIDEO, re.compile(r"(\d{8}_\d{6})_\d+\.mp4$"), "%Y%m%d_%H%M%S"),
+)
+
+
+def open_archived(path, mode="rb"):
+    """Opens a file that retention may have compressed: path itself if it
+    exists (gzip if it ends with .gz), otherwise path + .gz.
+    """
+    if not path.endswith(ARCHIVE_EXTENSION) and not os.path.exists(path):
+        if os.path.exists(path + ARCHIVE_EXTENSION):
+            path += ARCHIVE_EXTENSION
+    if path.endswith(ARCHIVE_EXTENSION):
+        return gzip.open(path, mode if "b" in mode else mode.replace("t", "") + "t")
+    return open(path, mode)
@@ -0,0 +1,271 @@
+import os
+import time
+import socket
+import sqlite3
+from datetime import datetime
+
+from maskcam.archive import (
+    FILENAME_PATTERNS,
+    KIND_GPS_LOG,
+    KIND_GRASS,
+    KIND_MATCHED_GPS,
+    KIND_STATISTICS,
+    KIND_VIDEO,
+)
+
+# Session catalog: which files belong to which run, and the time range each
+# one covers. Written by maskcam_run.py as it creates them, so other scripts
+# don't need to guess from filenames. Times are epoch seconds.
+# Artifact kinds and filenames are in maskcam/archive.py.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    ended REAL,
+    input TEXT,
+    fault_type TEXT,
+    hostname TEXT
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER REFERENCES runs(id),
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL UNIQUE,
+    started REAL NOT NULL,
+    ended REAL,
+    size INTEGER,
+    defects INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS artifacts_kind_started ON artifacts(kind, started);
+CREATE INDEX IF NOT EXISTS artifacts_run ON artifacts(run_id, kind);
+CREATE INDEX IF NOT EXISTS runs_started ON runs(started);
+"""
+
+
+def get_file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+class Catalog:
+    """SQLite catalog of runs and their artifacts.
+    Safe to use from several processes (WAL mode), one connection per process.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=10, isolation_level=None)  # autocommit
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        # Catalogs created before the defects column
+        columns = {row["name"] for row in self.db.execute("PRAGMA table_info(artifacts)")}
+        if "defects" not in columns:
+            self.db.execute("ALTER TABLE artifacts ADD COLUMN defects INTEGER NOT NULL DEFAULT 0")
+
+    def close(self):
+        self.db.close()
+
+    def start_run(self, input_uri=None, fault_type=None, started=None):
+        cursor = self.db.execute(
+            "INSERT INTO runs (started, input, fault_type, hostname) VALUES (?, ?, ?, ?)",
+            (started or time.time(), input_uri, fault_type, socket.gethostname()),
+        )
+        return cursor.lastrowid
+
+    def end_run(self, run_id, ended=None):
+        self.db.execute("UPDATE runs SET ended = ? WHERE id = ?", (ended or time.time(), run_id))
+
+    def add_artifact(self, run_id, kind, path, started=None, ended=None):
+        path = os.path.abspath(path)
+        self.db.execute(
+            "INSERT OR REPLACE INTO artifacts (run_id, kind, path, started, ended, size) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (run_id, kind, path, started or time.time(), ended, get_file_size(path)),
+        )
+
+    def end_artifact(self, path, ended=None, new_path=None):
+        # Close the time range, and update the path if the file was moved.
+        # Files never created (e.g. the serial port failed to open) are dropped
+        path = os.path.abspath(path)
+        new_path = os.path.abspath(new_path) if new_path else path
+        if not os.path.exists(new_path):
+            self.remove_artifact(path)
+            return
+        self.db.execute(
+            "UPDATE artifacts SET ended = ?, path = ?, size = ? WHERE path = ?",
+            (ended or time.time(), new_path, get_file_size(new_path), path),
+        )
+
+    def remove_artifact(self, path):
+        self.db.execute("DELETE FROM artifacts WHERE path = ?", (os.path.abspath(path),))
+
+    def move_artifact(self, path, new_path):
+        # Same artifact under another path (e.g. compressed), time range unchanged
+        new_path = os.path.abspath(new_path)
+        self.db.execute(
+            "UPDATE artifacts SET path = ?, size = ? WHERE path = ?",
+            (new_path, get_file_size(new_path), os.path.abspath(path)),
+        )
+
+    def set_defects(self, path, defects):
+        # Number of defects detected while the artifact (a video clip) was written
+        self.db.execute("UPDATE artifacts SET defects = ? WHERE path = ?", (defects, os.path.abspath(path)))
+
+    def defect_paths(self):
+        return {row["path"] for row in self.db.execute("SELECT path FROM artifacts WHERE defects > 0")}
+
+    def latest_run(self):
+        return self.db.execute("SELECT * FROM runs ORDER BY started DESC LIMIT 1").fetchone()
+
+    def run_artifacts(self, run_id, kind=None):
+        if kind is None:
+            query = "SELECT * FROM artifacts WHERE run_id = ? ORDER BY started"
+            return self.db.execute(query, (run_id,)).fetchall()
+        query = "SELECT * FROM artifacts WHERE run_id = ? AND kind = ? ORDER BY started"
+        return self.db.execute(query, (run_id, kind)).fetchall()
+
+    def active_paths(self):
+        # Artifacts of the latest run still being written, while it hasn't ended
+        run = self.latest_run()
+        if run is None or run["ended"] is not None:
+            return set()
+        return {artifact["path"] for artifact in self.run_artifacts(run["id"]) if artifact["ended"] is None}
+
+    def run_of(self, path):
+        # Run the artifact at path belongs to, None if unknown
+        query = "SELECT runs.* FROM runs JOIN artifacts ON artifacts.run_id = runs.id WHERE artifacts.path = ?"
+        return self.db.execute(query, (os.path.abspath(path),)).fetchone()
+
+    def latest_artifact(self, kind):
+        query = "SELECT * FROM artifacts WHERE kind = ? ORDER BY started DESC LIMIT 1"
+        return self.db.execute(query, (kind,)).fetchone()
+
+    def find_covering(self, kind, timestamp):
+        # Latest artifact of this kind started before timestamp and not ended before it
+        query = (
+            "SELECT * FROM artifacts WHERE kind = ? AND started <= ? "
+            "AND (ended IS NULL OR ended >= ?) ORDER BY started DESC LIMIT 1"
+        )
+        return self.db.execute(query, (kind, timestamp, timestamp)).fetchone()
+
+    def run_at(self, timestamp):
+        # Latest run started at timestamp (1 s tolerance, filenames have 1 s
+        # resolution) and not ended before it
+        return self.db.execute(
+            "SELECT * FROM runs WHERE started <= ? AND (ended IS NULL OR ended >= ?) "
+            "ORDER BY started DESC LIMIT 1",
+            (timestamp + 1, timestamp),
+        ).fetchone()
+
+    def find_overlapping(self, kind, start, end):
+        query = (
+            "SELECT * FROM artifacts WHERE kind = ? AND started <= ? "
+            "AND (ended IS NULL OR ended >= ?) ORDER BY started"
+        )
+        return self.db.execute(query, (kind, end, start)).fetchall()
+
+    def backfill(self, directories):
+        """Add existing files found in directories, using their filename time
+        as start and their modification time as end. Each statistics file is
+        one run, other files go to the run whose time range contains them.
+        Returns the number of artifacts added.
+        """
+        found = []
+        for directory in directories:
+            if not os.path.isdir(directory):
+                continue
+            for entry in os.scandir(directory):
+                for kind, pattern, time_format in FILENAME_PATTERNS:
+                    match = pattern.search(entry.name)
+                    if match:
+                        started = datetime.strptime(match.group(1), time_format).timestamp()
+                        found.append((kind, entry.path, started, entry.stat().st_mtime))
+                        break
+
+        known = {row["path"] for row in self.db.execute("SELECT path FROM artifacts")}
+        found = [item for item in found if os.path.abspath(item[1]) not in known]
+        self.db.execute("BEGIN")
+        try:
+            for kind, path, started, ended in sorted(found, key=lambda item: item[2]):
+                if kind == KIND_STATISTICS:
+                    run_id = self.start_run(started=started)
+                    self.end_run(run_id, ended=ended)
+                    self.add_artifact(run_id, kind, path, started, ended)
+            for kind, path, started, ended in found:
+                if kind == KIND_STATISTICS:
+                    continue
+                run = self.run_at(started)
+                self.add_artifact(run["id"] if run else None, kind, path, started, ended)
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        return len(found)
+
+
+def open_catalog(config):
+    # None if disabled in config (catalog-file empty)
+    path = config["maskcam"]["catalog-file"].strip()
+    return Catalog(path) if path else None
+
+
+if __name__ == "__main__":
+    import sys
+    import argparse
+    from dateutil import parser as date_parser
+    from .config import config
+
+    arg_parser = argparse.ArgumentParser(description="maskcam session catalog")
+    subparsers = arg_parser.add_subparsers(dest="action")
+    backfill_parser = subparsers.add_parser("backfill", help="Add existing files to the catalog")
+    backfill_parser.add_argument(
+        "directories",
+        nargs="*",
+        help="Default: statistics, grass, GPS, videos and final data directories from config",
+    )
+    runs_parser = subparsers.add_parser("runs", help="List runs")
+    show_parser = subparsers.add_parser("show", help="Artifacts of a run (default: latest)")
+    show_parser.add_argument("run_id", type=int, nargs="?")
+    covering_parser = subparsers.add_parser("covering", help="Artifact covering a time")
+    covering_parser.add_argument("kind")
+    covering_parser.add_argument("time", help="ISO time, e.g. 2025-01-01T08:00:00")
+    args = arg_parser.parse_args()
+
+    catalog = open_catalog(config)
+    if catalog is None:
+        print("Catalog disabled (catalog-file is empty in config)")
+        sys.exit(1)
+
+    def fmt(timestamp):
+        return datetime.fromtimestamp(timestamp).isoformat(sep=" ") if timestamp else "-"
+
+    if args.action == "backfill":
+        directories = args.directories or [
+            config["maskcam"]["statistics-directory"],
+            config["grass-detection"]["file-directory"],
+            config["serial"]["output-directory"],
+            config["maskcam"]["fileserver-hdd-dir"],
+            "/home/lab5/Desktop/final_data",
+        ]
+        print(f"Added {catalog.backfill(directories)} artifacts to {catalog.path}")
+    elif args.action == "runs":
+        for run in catalog.db.execute("SELECT * FROM runs ORDER BY started"):
+            print(f"{run['id']:>5}  {fmt(run['started'])}  {fmt(run['ended'])}  {run['input'] or ''}")
+    elif args.action == "show":
+        run = catalog.latest_run() if args.run_id is None else {"id": args.run_id}
+        if run is None:
+            sys.exit(1)
+        for artifact in catalog.run_artifacts(run["id"]):
+            print(f"{artifact['kind']:<12} {fmt(artifact['started'])}  {fmt(artifact['ended'])}  {artifact['path']}")
+    elif args.action == "covering":
+        artifact = catalog.find_covering(args.kind, date_parser.parse(args.time).timestamp())
+        print(artifact["path"] if artifact else "Not found")
+        sys.exit(0 if artifact else 1)
+    else:
+        arg_parser.print_help()
+        sys.exit(1)
@@ -1,6 +1,13 @@
 CODEC_MP4 = "MP4"
 CODEC_H265 = "H265"
 CODEC_H264 = "H264"
+FILESERVER_MODES = ("threads", "asyncio")
+TRANSPORT_UDP = "udp"
+TRANSPORT_SHM = "shm"  # shmsink/shmsrc, see maskcam/outputs.py
+TRANSPORTS = (TRANSPORT_UDP, TRANSPORT_SHM)
+INTERPOLATE_LINEAR = "linear"  # Lat/lon linear in time, fine for fixes ~1 s apart
+INTERPOLATE_GREAT_CIRCLE = "great-circle"  # Spherical interpolation between fixes
+INTERPOLATE_METHODS = (INTERPOLATE_LINEAR, INTERPOLATE_GREAT_CIRCLE)  # See maskcam/gps.py
 USBCAM_PROTOCOL = "v4l2://"  # Invented by us since there's no URI for this
 RASPICAM_PROTOCOL = "argus://"  # Invented by us since there's no URI for this
 CONFIG_FILE = "maskcam_config.txt"  # Also used in nvinfer element
@@ -12,3 +19,4 @@ CMD_STREAMING_STOP = "streaming_stop"
 CMD_INFERENCE_RESTART = "inference_restart"
 CMD_FILESERVER_RESTART = "fileserver_restart"
 CMD_STATUS_REQUEST = "status_request"
+CMD_SHUTDOWN = "shutdown"
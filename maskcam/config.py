@@ -1,14 +1,18 @@
 import os
 import configparser
-from maskcam.common import CONFIG_FILE
-from maskcam.prints import print_common as print
-
-config = configparser.ConfigParser()
-config.read(CONFIG_FILE)
-config.sections()
+from maskcam.common import (
+    CONFIG_FILE,
+    CODEC_MP4,
+    CODEC_H264,
+    CODEC_H265,
+    FILESERVER_MODES,
+    INTERPOLATE_METHODS,
+    TRANSPORTS,
+)
+from maskcam.prints import print_common as print, LOG_LEVELS
 
 
-# This file is used to override the config file values if you want to 
+# This file is used to override the config file values if you want to
 # run maskcam with different parameters. rather than in the config file.
 
 # Environment variables overriding config file values
@@ -41,13 +45,309 @@ ENV_CONFIG_OVERRIDES = (
     ("MASKCAM_FILESERVER_VIDEO_PERIOD", ("maskcam", "fileserver-video-period")),
     ("MASKCAM_FILESERVER_VIDEO_DURATION", ("maskcam", "fileserver-video-duration")),
     ("MASKCAM_FILESERVER_HDD_DIR", ("maskcam", "fileserver-hdd-dir")),
+    ("MASKCAM_STATUS_ENABLED", ("maskcam", "status-enabled")),
+    ("MASKCAM_STATUS_PORT", ("maskcam", "status-port")),
+    ("MASKCAM_RUNTIME_DIR", ("maskcam", "runtime-dir")),
+    ("MASKCAM_CONFIG_WATCH", ("maskcam", "config-watch")),
+    ("MASKCAM_LOG_LEVEL", ("maskcam", "log-level")),
+    ("MASKCAM_LOG_LEVELS", ("maskcam", "log-levels")),
+    ("MASKCAM_LOG_JSON_FILE", ("maskcam", "log-json-file")),
+    ("MASKCAM_GPS_LIVE_TAGGING", ("gps", "live-tagging")),
+    ("MASKCAM_GPS_CLOCK_OFFSET", ("gps", "clock-offset")),
+    ("MASKCAM_SERIAL_PORT", ("serial", "port")),
+    ("MASKCAM_TELEGRAF_URL", ("telegraf", "url")),
+    ("MASKCAM_TELEGRAF_LIVE_EXPORT", ("telegraf", "live-export")),
 )
 
-# Apply overrides
-for env_var, config_param in ENV_CONFIG_OVERRIDES:
-    override_value = os.environ.get(env_var, None)
-    if override_value is not None:
-        config[config_param[0]][config_param[1]] = override_value
+
+class ConfigError(ValueError):
+    pass
+
+
+def int_list(value):
+    return [int(item) for item in value.split(",")]
+
+
+def log_levels(value):
+    # "inference=DEBUG,file-server=WARNING" -> {"inference": "DEBUG", ...}
+    levels = {}
+    for item in filter(None, (item.strip() for item in value.split(","))):
+        name, level = item.split("=")
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def fraction(value):
+    return 0 <= value <= 1
+
+
+def positive(value):
+    return value > 0
+
+
+def non_negative(value):
+    return value >= 0
+
+
+def flag(value):
+    return value in (0, 1)
+
+
+def port(value):
+    return 0 < value < 65536
+
+
+def ports(values):
+    return all(port(value) for value in values)
+
+
+# Values converted and validated when loading the config file
+# Each row is: (config-section, config-param, type, validation or None)
+# Parameters not listed here are kept as strings
+CONFIG_SCHEMA = (
+    ("track-processor", "detection-threshold", float, fraction),
+    ("track-processor", "voting-threshold", float, fraction),
+    ("track-processor", "min-track-size", int, non_negative),
+    ("track-processor", "disable-tracker", int, flag),
+    ("grass-detection", "grass-detection", int, flag),
+    ("grass-detection", "small-grass-detection", int, flag),
+    ("grass-detection", "frame-threshold", int, positive),
+    ("grass-detection", "area-fraction-threshold", float, fraction),
+    ("grass-detection", "min-contour-area", int, non_negative),
+    ("light", "light-processing", int, flag),
+    ("light", "min-duty-cycle", int, lambda value: 0 <= value <= 100),
+    ("maskcam", "alert-min-visible-tracks", int, non_negative),
+    ("maskcam", "alert-max-total-tracks", int, non_negative),
+    ("maskcam", "alert-defective-fraction", float, fraction),
+    ("maskcam", "statistics-period", int, positive),
+    ("maskcam", "statistics-to-json-period", int, positive),
+    ("maskcam", "timeout-inference-restart", int, non_negative),
+    ("maskcam", "inference-log-interval", int, positive),
+    ("maskcam", "log-level", str.upper, lambda value: value in LOG_LEVELS),
+    ("maskcam", "log-levels", log_levels, lambda value: all(level in LOG_LEVELS for level in value.values())),
+    ("maskcam", "output-video-width", int, positive),
+    ("maskcam", "output-video-height", int, positive),
+    ("maskcam", "camera-framerate", int, positive),
+    ("maskcam", "camera-flip-method", int, lambda value: 0 <= value <= 7),
+    ("maskcam", "inference-interval-auto", int, flag),
+    ("maskcam", "inference-max-fps", int, positive),
+    ("maskcam", "udp-port-streaming", int, port),
+    ("maskcam", "udp-ports-filesave", int_list, ports),
+    ("maskcam", "output-on-demand", int, flag),
+    ("maskcam", "transport-streaming", str, lambda value: value in TRANSPORTS),
+    ("maskcam", "transport-filesave", str, lambda value: value in TRANSPORTS),
+    ("maskcam", "shm-size-kb", int, positive),
+    ("maskcam", "shm-queue-packets", int, positive),
+    ("maskcam", "streaming-start-default", int, flag),
+    ("maskcam", "streaming-port", int, port),
+    ("maskcam", "streaming-clock-rate", int, positive),
+    ("maskcam", "codec", str, lambda value: value in (CODEC_MP4, CODEC_H264, CODEC_H265)),
+    ("maskcam", "fileserver-enabled", int, flag),
+    ("maskcam", "fileserver-port", int, port),
+    ("maskcam", "fileserver-workers", int, positive),
+    ("maskcam", "fileserver-mode", str, lambda value: value in FILESERVER_MODES),
+    ("maskcam", "fileserver-max-connections", int, positive),
+    ("maskcam", "fileserver-client-rate", int, non_negative),
+    ("maskcam", "fileserver-total-rate", int, non_negative),
+    ("maskcam", "fileserver-idle-timeout", float, positive),
+    ("maskcam", "preview-enabled", int, flag),
+    ("maskcam", "preview-cache-mb", int, positive),
+    ("maskcam", "fileserver-video-period", int, positive),
+    ("maskcam", "recording-fragment-ms", int, non_negative),
+    ("maskcam", "hls-enabled", int, flag),
+    ("maskcam", "hls-segment-seconds", int, positive),
+    ("maskcam", "hls-playlist-length", int, positive),
+    ("maskcam", "snapshot-enabled", int, flag),
+    ("maskcam", "snapshot-width", int, positive),
+    ("maskcam", "snapshot-max-fps", float, positive),
+    ("maskcam", "snapshot-cache-ms", int, non_negative),
+    ("maskcam", "fileserver-video-duration", int, positive),
+    ("maskcam", "fileserver-force-save", int, flag),
+    ("maskcam", "save_serial", int, flag),
+    ("maskcam", "status-enabled", int, flag),
+    ("maskcam", "status-port", int, port),
+    ("maskcam", "config-watch", int, flag),
+    ("gps", "live-tagging", int, flag),
+    ("gps", "clock-offset", float, None),
+    ("gps", "interpolation", str, lambda value: value in INTERPOLATE_METHODS),
+    ("gps", "max-gap", float, positive),
+    ("serial", "baudrate", int, positive),
+    ("serial", "arrival-timestamps", int, flag),
+    ("serial", "fsync-interval", float, positive),
+    ("serial", "echo-interval", float, non_negative),
+    ("telegraf", "live-export", int, flag),
+    ("telegraf", "batch-lines", int, positive),
+    ("telegraf", "batch-kb", int, positive),
+    ("telegraf", "flush-interval", float, positive),
+    ("telegraf", "gzip", int, flag),
+    ("telegraf", "spool-max-mb", int, positive),
+    ("retention", "enabled", int, flag),
+    ("retention", "check-interval", float, positive),
+    ("retention", "min-free-mb", int, non_negative),
+    ("retention", "compress-after-hours", float, non_negative),
+    ("retention", "videos-quota-mb", int, non_negative),
+    ("retention", "videos-ttl-days", float, non_negative),
+    ("retention", "defect-videos-ttl-days", float, non_negative),
+    ("retention", "statistics-quota-mb", int, non_negative),
+    ("retention", "statistics-ttl-days", float, non_negative),
+    ("retention", "grass-quota-mb", int, non_negative),
+    ("retention", "grass-ttl-days", float, non_negative),
+    ("retention", "gps-quota-mb", int, non_negative),
+    ("retention", "gps-ttl-days", float, non_negative),
+    ("property", "interval", int, non_negative),
+)
+
+# Parameters that can change while running, without restarting inference
+# (see ConfigWatcher and RailTrackProcessor.update_config)
+HOT_RELOAD_PARAMS = (
+    ("track-processor", "detection-threshold"),
+    ("track-processor", "voting-threshold"),
+    ("track-processor", "min-track-size"),
+    ("grass-detection", "grass-detection"),
+    ("grass-detection", "small-grass-detection"),
+    ("grass-detection", "frame-threshold"),
+    ("grass-detection", "area-fraction-threshold"),
+    ("grass-detection", "min-contour-area"),
+    ("light", "light-processing"),
+    ("light", "min-duty-cycle"),
+)
+
+
+class MaskcamConfig:
+    """Typed and validated snapshot of the config file.
+    Values are accessed like configparser: config["maskcam"]["codec"].
+    Only plain dicts inside, so it's pickled as-is to child processes
+    and they don't need to parse the config file again.
+    """
+
+    def __init__(self, sections, path=CONFIG_FILE):
+        self.sections = sections
+        self.path = path
+
+    def __getitem__(self, section):
+        return self.sections[section]
+
+    def __contains__(self, section):
+        return section in self.sections
+
+    def get(self, section, param, fallback=None):
+        return self.sections.get(section, {}).get(param, fallback)
+
+
+def load_config(path=CONFIG_FILE, env_overrides=True):
+    parser = configparser.ConfigParser()
+    if not parser.read(path):
+        raise ConfigError(f"Config file not found: {path}")
+
+    # Apply overrides
+    if env_overrides:
+        for env_var, config_param in ENV_CONFIG_OVERRIDES:
+            override_value = os.environ.get(env_var, None)
+            if override_value is not None:
+                parser[config_param[0]][config_param[1]] = override_value
+
+    sections = {section: dict(parser[section]) for section in parser.sections()}
+
+    # Convert and validate, reporting all the errors at once
+    errors = []
+    for section, param, value_type, validation in CONFIG_SCHEMA:
+        raw_value = sections.get(section, {}).get(param)
+        if raw_value is None:
+            errors.append(f"{section}.{param}: missing")
+            continue
+        try:
+            value = value_type(raw_value.strip())
+        except ValueError:
+            errors.append(f"{section}.{param}={raw_value!r}: expected {value_type.__name__}")
+            continue
+        if validation is not None and not validation(value):
+            errors.append(f"{section}.{param}={raw_value!r}: invalid value")
+            continue
+        sections[section][param] = value
+    if errors:
+        raise ConfigError(f"Invalid config file {path}:\n  " + "\n  ".join(errors))
+    return MaskcamConfig(sections, path=path)
+
+
+_config = None
+
+
+def get_config():
+    # Parse the config file only once per process, and only if needed
+    global _config
+    if _config is None:
+        _config = load_config()
+    return _config
+
+
+class LazyConfig:
+    # Parses the config file on first access. Child processes receive the
+    # orchestrator's MaskcamConfig instead, so they never parse it.
+    def __getitem__(self, section):
+        return get_config()[section]
+
+    def __contains__(self, section):
+        return section in get_config()
+
+    def get(self, section, param, fallback=None):
+        return get_config().get(section, param, fallback)
+
+    @property
+    def path(self):
+        return get_config().path
+
+
+config = LazyConfig()
+
+
+class ConfigWatcher:
+    """Watch the config file (inotify) and report changes in HOT_RELOAD_PARAMS.
+    Integrate fileno() into the event loop and call read_changes() when readable.
+    """
+
+    def __init__(self, config):
+        # Avoid importing inotify (ctypes/libc) unless watching is enabled
+        from maskcam.inotify import Inotify, IN_CLOSE_WRITE, IN_MOVED_TO
+
+        self.config = config
+        self.path = os.path.abspath(config.path)
+        self.inotify = Inotify()
+        # Watch the directory: editors usually replace the file instead of writing it
+        self.inotify.add_watch(os.path.dirname(self.path), IN_CLOSE_WRITE | IN_MOVED_TO)
+
+    def fileno(self):
+        return self.inotify.fileno()
+
+    def read_changes(self):
+        # Returns {(section, param): new_value}, empty if nothing relevant changed
+        events = self.inotify.read_events()
+        if not any(name == os.path.basename(self.path) for _, _, _, name in events):
+            return {}
+        try:
+            new_config = load_config(self.config.path)
+        except ConfigError as e:
+            print(f"Config file changed but it's not valid, ignoring: {e}", error=True)
+            return {}
+
+        changes = {}
+        for section in new_config.sections:
+            for param, value in new_config[section].items():
+                if self.config.get(section, param) == value:
+                    continue
+                if (section, param) in HOT_RELOAD_PARAMS:
+                    changes[(section, param)] = value
+                    self.config[section][param] = value
+                else:
+                    print(
+                        f"Config change {section}.{param} requires a restart, ignoring",
+                        warning=True,
+                    )
+        for (section, param), value in changes.items():
+            print(f"Config reloaded: {section}.{param}={value}")
+        return changes
+
+    def close(self):
+        self.inotify.close()
 
 
 def print_config_overrides():
@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import socket
+import threading
+from concurrent.futures import Future, TimeoutError
+from socketserver import StreamRequestHandler, ThreadingMixIn, UnixStreamServer
+
+from .prints import print_run as print
+
+CONTROL_SOCKET_NAME = "control.sock"
+REPLY_TIMEOUT = 30  # seconds, restarting inference may take a while
+
+
+def get_control_socket_path(config):
+    return os.path.join(config["maskcam"]["runtime-dir"], CONTROL_SOCKET_NAME)
+
+
+class ControlHandler(StreamRequestHandler):
+    # One JSON object per line: {"command": "<name>"}
+    # Reply, also one line: {"ok": bool, "command": "<name>", "result": ..., "error": "..."}
+    def handle(self):
+        for line in self.rfile:
+            command = None
+            try:
+                request = json.loads(line.decode("utf-8"))
+                command = request["command"]
+                reply = Future()
+                if not self.server.submit_command(command, reply):
+                    raise RuntimeError("Command queue is full")
+                response = {"ok": True, "command": command, "result": reply.result(REPLY_TIMEOUT)}
+            except TimeoutError:
+                response = {"ok": False, "command": command, "error": "Timeout waiting reply"}
+            except Exception as e:
+                response = {"ok": False, "command": command, "error": str(e)}
+            self.wfile.write(json.dumps(response, default=str).encode("utf-8") + b"\n")
+
+
+class ControlServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, submit_command):
+        self.submit_command = submit_command
+        super().__init__(socket_path, ControlHandler)
+
+
+def start_control_server(socket_path, submit_command):
+    """Listen for commands on a unix socket, from a background thread.
+    submit_command(command, reply) must queue the command and return False if it
+    can't be accepted. The caller resolves the reply Future once the command is done.
+    """
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+    if os.path.exists(socket_path):
+        if is_server_alive(socket_path):
+            raise RuntimeError(f"Another maskcam instance is listening on {socket_path}")
+        os.remove(socket_path)  # Stale socket from a crashed run
+    server = ControlServer(socket_path, submit_command)
+    os.chmod(socket_path, 0o660)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    print(f"[green]Control socket STARTED[/green] at {socket_path}")
+    return server
+
+
+def stop_control_server(server):
+    server.shutdown()
+    server.server_close()
+    try:
+        os.remove(server.server_address)
+    except OSError:
+        pass
+
+
+def is_server_alive(socket_path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+def send_command(socket_path, command, timeout=REPLY_TIMEOUT + 5):
+    """Client side: send one command and return the reply dict.
+    Raises ConnectionError if maskcam_run.py is not listening.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        try:
+            sock.connect(socket_path)
+        except OSError as e:
+            raise ConnectionError(f"maskcam is not running ({socket_path}): {e}")
+        sock.sendall(json.dumps({"command": command}).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as reply_file:
+            reply = reply_file.readline()
+    if not reply:
+        raise ConnectionError("Connection closed without reply")
+    return json.loads(reply.decode("utf-8"))
+
+
+def wait_server_closed(socket_path, timeout=60, poll_interval=0.2):
+    # The socket is removed only after the orchestrator finished shutting down
+    t_end = time.monotonic() + timeout
+    while os.path.exists(socket_path):
+        if time.monotonic() > t_end:
+            return False
+        time.sleep(poll_interval)
+    return True
+
+
+if __name__ == "__main__":
+    import sys
+    from .config import config
+
+    if len(sys.argv) != 2:
+        print("Usage: python3 -m maskcam.control <command>")
+        sys.exit(1)
+    print(send_command(get_control_socket_path(config), sys.argv[1]))
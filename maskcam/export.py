@@ -0,0 +1,435 @@
+import os
+import sys
+import json
+import time
+import shutil
+
+import numpy as np
+
+# Export of located defects. Results are columnar numpy arrays, and every
+# writer formats a whole chunk of rows at once (one printf-style operation
+# per chunk, escaping done once per distinct value), so large result sets
+# stream to disk without building each row in Python.
+#   lp        InfluxDB line protocol, as sent to Telegraf
+#   csv       one row per defect, with header
+#   geojson   FeatureCollection of points
+#   columnar  directory with one raw little-endian .bin file per column
+#             and schema.json (strings stored as dictionary codes)
+
+MEASUREMENT = "inference_result"
+CHUNK_ROWS = 65536  # Rows formatted and written at once
+SCHEMA_FILE = "schema.json"
+
+
+class DefectResults:
+    """Located defects as columnar arrays of the same length.
+    track_id: int or str, confidence/lat/lon: float64, species: str (a single
+    value is used for all rows), timestamp_ns: int64 epoch ns (UTC).
+    Writers expect finite positions: only pass located defects.
+    """
+
+    COLUMNS = ("track_id", "confidence", "lat", "lon", "species", "timestamp_ns")
+
+    def __init__(self, track_id, confidence, lat, lon, species, timestamp_ns):
+        self.track_id = np.asarray(track_id)
+        if self.track_id.dtype.kind not in "iuU":
+            self.track_id = self.track_id.astype(str)
+        n_rows = len(self.track_id)
+        self.confidence = np.asarray(confidence, dtype=np.float64)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.species = np.broadcast_to(np.asarray(species, dtype=str), (n_rows,))
+        self.timestamp_ns = np.asarray(timestamp_ns, dtype=np.int64)
+        for name in self.COLUMNS:
+            if len(getattr(self, name)) != n_rows:
+                raise ValueError(f"Column {name} has {len(getattr(self, name))} rows, expected {n_rows}")
+
+    def __len__(self):
+        return len(self.track_id)
+
+    def __getitem__(self, index):
+        # Rows by slice or mask, as a new DefectResults
+        return DefectResults(*(getattr(self, name)[index] for name in self.COLUMNS))
+
+    @classmethod
+    def concatenate(cls, parts):
+        parts = list(parts)
+        if not parts:
+            return cls.empty()
+        return cls(*(np.concatenate([getattr(part, name) for part in parts]) for name in cls.COLUMNS))
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros(0, dtype=np.int64), [], [], [], np.zeros(0, dtype=str), [])
+
+
+# Line protocol escaping (https://docs.influxdata.com/influxdb/v1/write_protocols/line_protocol_reference/)
+_MEASUREMENT_ESCAPES = str.maketrans({",": r"\,", " ": r"\ "})
+_TAG_ESCAPES = str.maketrans({",": r"\,", "=": r"\=", " ": r"\ "})
+_FIELD_STRING_ESCAPES = str.maketrans({"\\": "\\\\", '"': '\\"'})
+
+
+def escape_measurement(value):
+    return str(value).translate(_MEASUREMENT_ESCAPES)
+
+
+def escape_tag(value):
+    # Tag keys, tag values and field keys
+    return str(value).translate(_TAG_ESCAPES)
+
+
+def quote_field_string(value):
+    return '"' + str(value).translate(_FIELD_STRING_ESCAPES) + '"'
+
+
+def quote_csv(value):
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def map_distinct(values, function):
+    # function(value) for each element of a string array, called once per distinct value
+    values = np.asarray(values, dtype=str)
+    if len(values) == 0:
+        return values
+    distinct, inverse = np.unique(values, return_inverse=True)
+    return np.array([function(value) for value in distinct.tolist()])[inverse.reshape(-1)]
+
+
+def format_rows(template, columns):
+    """Text of a whole chunk with a single % operation: template (one row,
+    printf-style) repeated per row, applied to the columns interleaved.
+    Floats are printed with fixed decimals, much cheaper than repr().
+    """
+    n_rows = len(columns[0])
+    table = np.empty((n_rows, len(columns)), dtype=object)
+    for idx, column in enumerate(columns):
+        table[:, idx] = column
+    return (template * n_rows) % tuple(table.ravel().tolist())
+
+
+def iso_times(timestamp_ns):
+    return np.datetime_as_string(np.asarray(timestamp_ns, dtype="datetime64[ns]"), unit="ms", timezone="UTC")
+
+
+def _string_column(values, quote):
+    # String columns are escaped/quoted per distinct value, numeric ones used as they are
+    return map_distinct(values, quote) if values.dtype.kind == "U" else values
+
+
+# Fixed decimals in text outputs: 1e-7 degrees is ~1 cm
+COORDINATE_FORMAT = "%.7f"
+CONFIDENCE_FORMAT = "%.6f"
+
+LINE_PROTOCOL_TEMPLATE = (
+    "%s,track_id=%s "
+    f"confidence={CONFIDENCE_FORMAT},matched_lat={COORDINATE_FORMAT},matched_lon={COORDINATE_FORMAT},"
+    "species=%s %d\n"
+)
+
+
+def line_protocol_text(results, measurement=MEASUREMENT):
+    # Line-protocol records of all rows, newline-terminated
+    if len(results) == 0:
+        return ""
+    return format_rows(
+        LINE_PROTOCOL_TEMPLATE,
+        [
+            np.broadcast_to(np.array(escape_measurement(measurement)), (len(results),)),
+            _string_column(results.track_id, escape_tag),
+            results.confidence,
+            results.lat,
+            results.lon,
+            map_distinct(results.species, quote_field_string),
+            results.timestamp_ns,
+        ],
+    )
+
+
+class ResultWriter:
+    """Writes DefectResults in chunks of chunk_rows. Text outputs go to
+    path + ".tmp" and are renamed on close(), so other scripts never pick up
+    a partial file. Use as a context manager, or call close().
+    """
+
+    extension = ""
+
+    def __init__(self, path, chunk_rows=CHUNK_ROWS):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.chunk_rows = chunk_rows
+        self.rows = 0
+        self._open()
+
+    def write(self, results):
+        for start in range(0, len(results), self.chunk_rows):
+            chunk = results[start : start + self.chunk_rows]
+            self._write_chunk(chunk)
+            self.rows += len(chunk)
+
+    def close(self):
+        self._close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self._close()
+        os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    # Implemented by the text writers below
+    def _open(self):
+        self.file = open(self.tmp_path, "w", encoding="utf-8", newline="")
+        self._write_header()
+
+    def _close(self):
+        self._write_footer()
+        self.file.close()
+
+    def _write_header(self):
+        pass
+
+    def _write_footer(self):
+        pass
+
+    def _write_chunk(self, results):
+        if len(results):
+            self.file.write(self._format(results))
+
+
+class LineProtocolWriter(ResultWriter):
+    extension = ".txt"  # Name expected by send_data_telegraf.py
+
+    def _format(self, results):
+        return line_protocol_text(results)
+
+
+class CsvWriter(ResultWriter):
+    extension = ".csv"
+    header = "track_id,confidence,lat,lon,species,timestamp_ns,time"
+    template = f"%s,{CONFIDENCE_FORMAT},{COORDINATE_FORMAT},{COORDINATE_FORMAT},%s,%d,%s\n"
+
+    def _write_header(self):
+        self.file.write(self.header + "\n")
+
+    def _format(self, results):
+        return format_rows(
+            self.template,
+            [
+                _string_column(results.track_id, quote_csv),
+                results.confidence,
+                results.lat,
+                results.lon,
+                map_distinct(results.species, quote_csv),
+                results.timestamp_ns,
+                iso_times(results.timestamp_ns),
+            ],
+        )
+
+
+class GeoJsonWriter(ResultWriter):
+    extension = ".geojson"
+    template = (
+        '{"type": "Feature", "geometry": {"type": "Point", "coordinates": '
+        f"[{COORDINATE_FORMAT}, {COORDINATE_FORMAT}]}}, "
+        f'"properties": {{"track_id": %s, "confidence": {CONFIDENCE_FORMAT}, "species": %s, "time": "%s"}}}},\n'
+    )
+
+    def _write_header(self):
+        self.file.write('{"type": "FeatureCollection", "features": [\n')
+
+    def _write_footer(self):
+        self.file.write("\n]}\n" if self.rows else "]}\n")
+
+    def _write_chunk(self, results):
+        if len(results):
+            separator = ",\n" if self.rows else ""
+            self.file.write(separator + self._format(results)[: -len(",\n")])
+
+    def _format(self, results):
+        return format_rows(
+            self.template,
+            [
+                results.lon,
+                results.lat,
+                _string_column(results.track_id, json.dumps),
+                results.confidence,
+                map_distinct(results.species, json.dumps),
+                iso_times(results.timestamp_ns),
+            ],
+        )
+
+
+class ColumnarWriter(ResultWriter):
+    """Directory with <column>.bin files, readable with read_columnar() or
+    np.fromfile(). String columns are stored as uint32 codes into the
+    dictionary kept in schema.json.
+    """
+
+    extension = ".columns"
+
+    def _open(self):
+        if os.path.exists(self.tmp_path):
+            shutil.rmtree(self.tmp_path)
+        os.makedirs(self.tmp_path)
+        self.files = {}
+        self.columns = {}
+        self.dictionaries = {}
+
+    def _write_chunk(self, results):
+        for name in DefectResults.COLUMNS:
+            values = getattr(results, name)
+            if values.dtype.kind == "U":
+                dictionary = self.dictionaries.setdefault(name, {})
+                distinct, inverse = np.unique(values, return_inverse=True)
+                codes = np.array(
+                    [dictionary.setdefault(value, len(dictionary)) for value in distinct.tolist()],
+                    dtype=np.uint32,
+                )
+                values = codes[inverse.reshape(-1)] if len(values) else values.astype(np.uint32)
+            values = values.astype(values.dtype.newbyteorder("<"), copy=False)
+            if name not in self.files:
+                self.files[name] = open(os.path.join(self.tmp_path, name + ".bin"), "wb")
+                self.columns[name] = values.dtype.str
+            self.files[name].write(values.tobytes())
+
+    def _close(self):
+        for file in self.files.values():
+            file.close()
+        schema = {"rows": self.rows, "columns": []}
+        for name in DefectResults.COLUMNS:
+            column = {"name": name, "dtype": self.columns.get(name), "file": name + ".bin"}
+            if name in self.dictionaries:
+                column["dictionary"] = sorted(self.dictionaries[name], key=self.dictionaries[name].get)
+            schema["columns"].append(column)
+        with open(os.path.join(self.tmp_path, SCHEMA_FILE), "w") as f:
+            json.dump(schema, f, indent=2)
+
+    def close(self):
+        self._close()
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        for file in self.files.values():
+            file.close()
+        shutil.rmtree(self.tmp_path)
+
+
+def read_columnar(path, mmap=True):
+    # DefectResults from a ColumnarWriter directory
+    with open(os.path.join(path, SCHEMA_FILE), "r") as f:
+        schema = json.load(f)
+    columns = {}
+    for column in schema["columns"]:
+        if schema["rows"] == 0 or column["dtype"] is None:
+            values = np.zeros(0, dtype=column["dtype"] or "<f8")
+        elif mmap:
+            values = np.memmap(os.path.join(path, column["file"]), dtype=column["dtype"], mode="r")
+        else:
+            values = np.fromfile(os.path.join(path, column["file"]), dtype=column["dtype"])
+        if "dictionary" in column:
+            values = np.array(column["dictionary"], dtype=str)[values] if len(values) else values.astype(str)
+        columns[column["name"]] = values
+    return DefectResults(**columns)
+
+
+WRITERS = {
+    "lp": LineProtocolWriter,
+    "csv": CsvWriter,
+    "geojson": GeoJsonWriter,
+    "columnar": ColumnarWriter,
+}
+
+
+def get_writer(format_name, base_path, chunk_rows=CHUNK_ROWS):
+    # Writer for base_path plus the format's extension
+    writer_class = WRITERS[format_name]
+    return writer_class(base_path + writer_class.extension, chunk_rows=chunk_rows)
+
+
+def write_results(results, base_path, formats=("lp",), chunk_rows=CHUNK_ROWS):
+    # Write results in each format, returns the paths written
+    paths = []
+    for format_name in formats:
+        with get_writer(format_name, base_path, chunk_rows) as writer:
+            writer.write(results)
+        paths.append(writer.path)
+    return paths
+
+
+def synthetic_results(n_rows, species="fastener"):
+    rng = np.random.RandomState(0)
+    return DefectResults(
+        np.arange(n_rows),
+        rng.uniform(0.5, 1, n_rows),
+        6.9 + rng.uniform(0, 0.1, n_rows),
+        79.86 + rng.uniform(0, 0.1, n_rows),
+        species,
+        1_700_000_000_000_000_000 + np.arange(n_rows, dtype=np.int64) * 100_000_000,
+    )
+
+
+def run_benchmark(n_rows, output_dir):
+    # Per-row f-string loop (former output) vs. each writer
+    results = synthetic_results(n_rows)
+    os.makedirs(output_dir, exist_ok=True)
+
+    t_start = time.perf_counter()
+    with open(os.path.join(output_dir, "legacy.txt"), "w") as f:
+        for idx in range(n_rows):
+            f.write(
+                f"{MEASUREMENT},track_id={results.track_id[idx]} confidence={results.confidence[idx]},"
+                f"matched_lat={results.lat[idx]},matched_lon={results.lon[idx]},"
+                f"species='{results.species[idx]}' {results.timestamp_ns[idx]}\n"
+            )
+    legacy_seconds = time.perf_counter() - t_start
+    print(f"{'f-string loop':<14} {n_rows / legacy_seconds:>12,.0f} rows/s")
+
+    for format_name in WRITERS:
+        t_start = time.perf_counter()
+        path = write_results(results, os.path.join(output_dir, "bench"), [format_name])[0]
+        seconds = time.perf_counter() - t_start
+        if os.path.isdir(path):
+            size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+        else:
+            size = os.path.getsize(path)
+        print(f"{format_name:<14} {n_rows / seconds:>12,.0f} rows/s  {size / n_rows:6.1f} bytes/row")
+
+    # Round trips of the formats that can be read back here
+    assert np.array_equal(read_columnar(os.path.join(output_dir, "bench.columns")).lat, results.lat)
+    with open(os.path.join(output_dir, "bench.geojson"), "r") as f:
+        features = json.load(f)["features"]
+    assert np.allclose(features[-1]["geometry"]["coordinates"], [results.lon[-1], results.lat[-1]])
+
+
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+
+    arg_parser = argparse.ArgumentParser(description="Defect results export")
+    subparsers = arg_parser.add_subparsers(dest="action")
+    convert_parser = subparsers.add_parser("convert", help="Write a columnar export in other formats")
+    convert_parser.add_argument("columnar", help="Directory written by the columnar writer")
+    convert_parser.add_argument("--format", action="append", choices=list(WRITERS), required=True)
+    benchmark_parser = subparsers.add_parser("benchmark", help="Writer throughput")
+    benchmark_parser.add_argument("--rows", type=int, default=1_000_000)
+    args = arg_parser.parse_args()
+
+    if args.action == "convert":
+        base_path = os.path.splitext(args.columnar.rstrip("/"))[0]
+        for path in write_results(read_columnar(args.columnar), base_path, args.format):
+            print(f"Written {path}")
+    elif args.action == "benchmark":
+        with tempfile.TemporaryDirectory() as output_dir:
+            run_benchmark(args.rows, output_dir)
+    else:
+        arg_parser.print_help()
+        sys.exit(1)
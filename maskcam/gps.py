@@ -0,0 +1,443 @@
+import os
+import re
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+from dateutil import parser as date_parser
+
+from maskcam.archive import open_archived
+from maskcam.common import INTERPOLATE_GREAT_CIRCLE, INTERPOLATE_LINEAR, INTERPOLATE_METHODS
+
+GPS_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+# Log lines look like: <prefix>: <lat>, <lon> @ <YYYY-mm-ddTHH:MM:SS>
+# optionally after the arrival time and a tab, added by save_serial.
+# Other lines (ESP32 status messages, truncated writes) are skipped
+GPS_LINE_PATTERN = re.compile(
+    rb"^(?:[^\t\n]*\t)?[^:\t\n]*:[ \t]*([-+]?\d+(?:\.\d*)?)[ \t]*,[ \t]*([-+]?\d+(?:\.\d*)?)[ \t]*@"
+    rb"[ \t]*(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)[ \t\r]*$",
+    re.MULTILINE,
+)
+# Fix lines with the arrival time added by save_serial (arrival-timestamps=1)
+ARRIVAL_LINE_PATTERN = re.compile(
+    rb"^(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d(?:\.\d+)?)\t[^:\t\n]*:[ \t]*[-+]?\d+(?:\.\d*)?[ \t]*,"
+    rb"[ \t]*[-+]?\d+(?:\.\d*)?[ \t]*@[ \t]*(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)[ \t\r]*$",
+    re.MULTILINE,
+)
+PARSE_CHUNK_SIZE = 16 * 1024 * 1024  # bytes, bounds the parser memory besides the fixes
+
+# Matching modes for match_gps()
+MATCH_AFTER = "after"  # First fix after the detection (original behavior)
+MATCH_NEAREST = "nearest"  # Closest fix, before or after the detection
+MATCH_MODES = (MATCH_AFTER, MATCH_NEAREST)
+
+NO_MATCH = -1
+
+# Interpolation methods for interpolate_positions(): INTERPOLATE_METHODS in
+# maskcam/common.py, validated by the config without loading this module
+
+
+class GpsFixes:
+    """GPS fixes as numpy arrays sorted by time.
+    times: datetime64[ns] (naive, same clock as the GPS log), lat/lon: float64
+    """
+
+    def __init__(self, times, lat, lon):
+        times = np.asarray(times, dtype="datetime64[ns]")
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        if len(times) > 1 and (np.diff(times) < np.timedelta64(0)).any():
+            order = np.argsort(times, kind="mergesort")  # stable: keep log order on ties
+            times, lat, lon = times[order], lat[order], lon[order]
+        self.times = times
+        self.lat = lat
+        self.lon = lon
+
+    def __len__(self):
+        return len(self.times)
+
+
+class ParseStats:
+    # Counters filled by iter_gps_chunks()
+    def __init__(self):
+        self.lines = 0
+        self.fixes = 0
+        self.skipped = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    @property
+    def lines_per_second(self):
+        return self.lines / self.seconds if self.seconds > 0 else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.lines} lines ({self.fixes} fixes, {self.skipped} skipped) "
+            f"in {self.seconds:.2f} s: {self.lines_per_second:,.0f} lines/s, "
+            f"{self.bytes / max(self.seconds, 1e-9) / 1e6:.1f} MB/s"
+        )
+
+
+def _bytes_to_times(time_strings):
+    # Bulk conversion, one by one only if the chunk has invalid dates
+    try:
+        return np.array(time_strings).astype("datetime64[ns]"), None
+    except ValueError:
+        times = np.empty(len(time_strings), dtype="datetime64[ns]")
+        valid = np.ones(len(time_strings), dtype=bool)
+        for idx, time_string in enumerate(time_strings):
+            try:
+                times[idx] = np.datetime64(time_string.decode("ascii"), "ns")
+            except ValueError:
+                valid[idx] = False
+        return times, valid
+
+
+def parse_gps_chunk(data, stats=None):
+    # Complete lines (bytes) -> (times, lat, lon) arrays, in log order
+    fields = GPS_LINE_PATTERN.findall(data)
+    if fields:
+        lat_strings, lon_strings, time_strings = zip(*fields)
+        times, valid = _bytes_to_times(time_strings)
+        lat = np.array(lat_strings).astype(np.float64)
+        lon = np.array(lon_strings).astype(np.float64)
+        if valid is not None:
+            times, lat, lon = times[valid], lat[valid], lon[valid]
+    else:
+        times = np.empty(0, dtype="datetime64[ns]")
+        lat = lon = np.empty(0, dtype=np.float64)
+    if stats is not None:
+        n_lines = data.count(b"\n") + (0 if not data or data.endswith(b"\n") else 1)
+        stats.lines += n_lines
+        stats.fixes += len(times)
+        stats.skipped += n_lines - len(times)
+        stats.bytes += len(data)
+    return times, lat, lon
+
+
+def iter_gps_chunks(file_path, chunk_size=PARSE_CHUNK_SIZE, stats=None):
+    """Parse a GPS log in chunks of complete lines, yielding (times, lat, lon)
+    numpy arrays per chunk. Memory is bounded by chunk_size, regardless of
+    the log size. Malformed lines are skipped and counted in stats.
+    """
+    t_start = time.perf_counter()
+    with open_archived(file_path, "rb") as f:
+        remainder = b""
+        while True:
+            block = f.read(chunk_size)
+            if not block:
+                break
+            data = remainder + block
+            last_newline = data.rfind(b"\n")
+            if last_newline < 0:
+                remainder = data  # Line longer than a chunk, keep reading
+                continue
+            remainder = data[last_newline + 1 :]
+            yield parse_gps_chunk(data[: last_newline + 1], stats)
+            if stats is not None:
+                stats.seconds = time.perf_counter() - t_start
+        if remainder:
+            yield parse_gps_chunk(remainder, stats)  # Last line without newline
+    if stats is not None:
+        stats.seconds = time.perf_counter() - t_start
+
+
+def parse_gps_line(line):
+    # One raw log line (bytes) -> (time_ns, lat, lon), or None if it's not a fix
+    match = GPS_LINE_PATTERN.match(line.strip())
+    if match is None:
+        return None
+    lat_string, lon_string, time_string = match.groups()
+    try:
+        time_ns = np.datetime64(time_string.decode("ascii"), "ns").astype(np.int64)
+    except ValueError:
+        return None
+    return int(time_ns), float(lat_string), float(lon_string)
+
+
+def load_gps_data(file_path, stats=None):
+    # Whole log as GpsFixes, pass a ParseStats to get counts and throughput
+    chunks = list(iter_gps_chunks(file_path, stats=stats))
+    if not chunks:
+        return GpsFixes([], [], [])
+    times, lat, lon = (np.concatenate(column) for column in zip(*chunks))
+    return GpsFixes(times, lat, lon)
+
+
+def parse_times(time_strings):
+    # ISO strings -> datetime64[ns] array, in bulk when possible
+    try:
+        return np.array(time_strings, dtype="datetime64[ns]")
+    except ValueError:
+        # Not plain ISO (e.g: timezone suffix), parse one by one
+        return np.array(
+            [date_parser.parse(t).replace(tzinfo=None) for t in time_strings],
+            dtype="datetime64[ns]",
+        )
+
+
+def match_gps(fixes, times, mode=MATCH_AFTER, max_gap=None):
+    """Index of the matching fix for each time in `times` (datetime64 array),
+    or NO_MATCH. All times are matched at once with a binary search.
+      - MATCH_AFTER: first fix strictly after the time
+      - MATCH_NEAREST: closest fix on either side (earlier one on ties)
+    max_gap: seconds, matches further than this from the time are discarded
+    """
+    times = np.asarray(times, dtype="datetime64[ns]")
+    n_fixes = len(fixes)
+    if n_fixes == 0:
+        return np.full(len(times), NO_MATCH, dtype=np.int64)
+
+    if mode == MATCH_AFTER:
+        idx = np.searchsorted(fixes.times, times, side="right")
+        idx[idx == n_fixes] = NO_MATCH
+    elif mode == MATCH_NEAREST:
+        right = np.searchsorted(fixes.times, times, side="left")
+        left = np.clip(right - 1, 0, n_fixes - 1)
+        right_clipped = np.clip(right, 0, n_fixes - 1)
+        gap_left = np.abs(times - fixes.times[left])
+        gap_right = np.abs(fixes.times[right_clipped] - times)
+        idx = np.where(gap_right < gap_left, right_clipped, left)
+    else:
+        raise ValueError(f"Unknown GPS match mode: {mode} (valid: {MATCH_MODES})")
+
+    if max_gap is not None:
+        matched = idx != NO_MATCH
+        gaps = np.abs(fixes.times[idx[matched]] - times[matched])
+        too_far = gaps > np.timedelta64(int(max_gap * 1e9), "ns")
+        idx[np.flatnonzero(matched)[too_far]] = NO_MATCH
+    return idx
+
+
+def seconds_to_timedelta(seconds):
+    return np.timedelta64(int(round(seconds * 1e9)), "ns")
+
+
+def interpolate_positions(fixes, times, method=INTERPOLATE_LINEAR, max_gap=None):
+    """Position at each time in `times` (datetime64 array, GPS clock), interpolated
+    between the two fixes that bracket it. All times are processed at once.
+    Returns (lat, lon, valid), times outside the log or with a bracket longer
+    than max_gap (seconds) are not valid and have NaN positions.
+    """
+    times = np.asarray(times, dtype="datetime64[ns]")
+    n_fixes = len(fixes)
+    lat = np.full(len(times), np.nan)
+    lon = np.full(len(times), np.nan)
+    if n_fixes == 0:
+        return lat, lon, np.zeros(len(times), dtype=bool)
+
+    # Bracketing fixes: left <= time <= right (same fix if the time is exact)
+    right = np.searchsorted(fixes.times, times, side="left")
+    right_clipped = np.clip(right, 0, n_fixes - 1)
+    exact = (right < n_fixes) & (fixes.times[right_clipped] == times)
+    left = np.where(exact, right_clipped, right - 1)
+    right = np.where(exact, right_clipped, right)
+    valid = (left >= 0) & (right < n_fixes)
+    if max_gap is not None:
+        span = fixes.times[right[valid]] - fixes.times[left[valid]]
+        valid[valid] = span <= seconds_to_timedelta(max_gap)
+
+    left, right, t = left[valid], right[valid], times[valid]
+    span = (fixes.times[right] - fixes.times[left]).astype(np.float64)
+    elapsed = (t - fixes.times[left]).astype(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        frac = np.where(span > 0, elapsed / span, 0.0)
+
+    lat0, lon0 = fixes.lat[left], fixes.lon[left]
+    lat1, lon1 = fixes.lat[right], fixes.lon[right]
+    if method == INTERPOLATE_LINEAR:
+        # NOTE: doesn't handle crossing the antimeridian (lon +-180)
+        lat[valid] = lat0 + frac * (lat1 - lat0)
+        lon[valid] = lon0 + frac * (lon1 - lon0)
+    elif method == INTERPOLATE_GREAT_CIRCLE:
+        lat[valid], lon[valid] = slerp(lat0, lon0, lat1, lon1, frac)
+    else:
+        raise ValueError(f"Unknown interpolation: {method} (valid: {INTERPOLATE_METHODS})")
+    return lat, lon, valid
+
+
+def locate_positions(fixes, times, method=INTERPOLATE_LINEAR, max_gap=None):
+    """Interpolated position for times between two fixes, or the nearest fix
+    within max_gap for the others (e.g. the next fix hasn't arrived yet).
+    Returns (lat, lon, interpolated, located) arrays.
+    """
+    lat, lon, interpolated = interpolate_positions(fixes, times, method=method, max_gap=max_gap)
+    nearest = match_gps(fixes, times, mode=MATCH_NEAREST, max_gap=max_gap)
+    use_nearest = ~interpolated & (nearest != NO_MATCH)
+    lat[use_nearest] = fixes.lat[nearest[use_nearest]]
+    lon[use_nearest] = fixes.lon[nearest[use_nearest]]
+    return lat, lon, interpolated, interpolated | use_nearest
+
+
+def slerp(lat0, lon0, lat1, lon1, frac):
+    # Spherical linear interpolation between two arrays of positions (degrees)
+    def to_vectors(lat, lon):
+        phi, lam = np.radians(lat), np.radians(lon)
+        return np.stack((np.cos(phi) * np.cos(lam), np.cos(phi) * np.sin(lam), np.sin(phi)))
+
+    v0, v1 = to_vectors(lat0, lon0), to_vectors(lat1, lon1)
+    omega = np.arccos(np.clip((v0 * v1).sum(axis=0), -1.0, 1.0))
+    sin_omega = np.sin(omega)
+    close = sin_omega < 1e-12  # Same or very close positions: plain linear weights
+    with np.errstate(divide="ignore", invalid="ignore"):
+        w0 = np.where(close, 1 - frac, np.sin((1 - frac) * omega) / sin_omega)
+        w1 = np.where(close, frac, np.sin(frac * omega) / sin_omega)
+    x, y, z = w0 * v0 + w1 * v1
+    return np.degrees(np.arctan2(z, np.hypot(x, y))), np.degrees(np.arctan2(y, x))
+
+
+def estimate_clock_offset(fix_times, reference_times):
+    """Offset (seconds) to add to local clock times to get GPS clock times,
+    from fixes and the local time they were received (median, robust to outliers).
+    """
+    fix_times = np.asarray(fix_times, dtype="datetime64[ns]")
+    reference_times = np.asarray(reference_times, dtype="datetime64[ns]")
+    return float(np.median((fix_times - reference_times).astype(np.float64))) / 1e9
+
+
+def read_arrival_times(file_path, chunk_size=PARSE_CHUNK_SIZE):
+    # (fix times, local arrival times) of the fix lines with an arrival time
+    fix_chunks, arrival_chunks = [], []
+    with open_archived(file_path, "rb") as f:
+        remainder = b""
+        while True:
+            block = f.read(chunk_size)
+            if block:
+                data = remainder + block
+                last_newline = data.rfind(b"\n")
+                if last_newline < 0:
+                    remainder = data  # Line longer than a chunk, keep reading
+                    continue
+                remainder = data[last_newline + 1 :]
+                data = data[: last_newline + 1]
+            else:
+                data = remainder  # Last line without newline
+            fields = ARRIVAL_LINE_PATTERN.findall(data)
+            if fields:
+                arrival_strings, time_strings = zip(*fields)
+                arrival_times, valid_arrival = _bytes_to_times(arrival_strings)
+                fix_times, valid_fix = _bytes_to_times(time_strings)
+                valid = np.ones(len(fields), dtype=bool)
+                for valid_field in (valid_arrival, valid_fix):
+                    if valid_field is not None:
+                        valid &= valid_field
+                fix_chunks.append(fix_times[valid])
+                arrival_chunks.append(arrival_times[valid])
+            if not block:
+                break
+    if not fix_chunks:
+        empty = np.empty(0, dtype="datetime64[ns]")
+        return empty, empty
+    return np.concatenate(fix_chunks), np.concatenate(arrival_chunks)
+
+
+def estimate_log_clock_offset(file_path, fixes):
+    """Offset (seconds) from the local clock to the GPS clock of a log,
+    including any timezone difference: median over its lines of fix time minus
+    arrival time (save_serial arrival-timestamps). Logs without arrival times
+    fall back to the last fix against the file modification time, which is
+    only right if the log was flushed after every line.
+    """
+    fix_times, arrival_times = read_arrival_times(file_path)
+    if len(fix_times):
+        return estimate_clock_offset(fix_times, arrival_times)
+    if len(fixes) == 0:
+        return 0.0
+    mtime = np.datetime64(datetime.fromtimestamp(os.stat(file_path).st_mtime), "ns")
+    return estimate_clock_offset(fixes.times[-1:], [mtime])
+
+
+def local_to_epoch_ns(times):
+    # Naive local datetime64 -> epoch nanoseconds, like datetime.timestamp()
+    times = np.asarray(times, dtype="datetime64[ns]")
+    if len(times) == 0:
+        return times.astype(np.int64)
+
+    def utc_offset_ns(t):
+        naive = t.astype("datetime64[us]").item()
+        utc = datetime.fromtimestamp(naive.timestamp(), timezone.utc).replace(tzinfo=None)
+        return int(round((naive - utc).total_seconds() * 1e9))
+
+    offset_first, offset_last = utc_offset_ns(times.min()), utc_offset_ns(times.max())
+    if offset_first == offset_last:
+        return times.astype(np.int64) - offset_first
+    # Timezone change (DST) in the range, use per-time offsets
+    return np.array([t.astype(np.int64) - utc_offset_ns(t) for t in times], dtype=np.int64)
+
+
+def synthetic_fixes(n_fixes, rate_hz=10, start="2025-01-01T08:00:00"):
+    # Straight-ish track at ~60 km/h, for benchmarks
+    step = np.timedelta64(int(1e9 / rate_hz), "ns")
+    times = np.datetime64(start, "ns") + np.arange(n_fixes) * step
+    distance = np.arange(n_fixes) * (16.7 / rate_hz)  # meters
+    lat = 6.9 + distance / 111_320
+    lon = 79.86 + 0.3 * distance / 111_320
+    return GpsFixes(times, lat, lon)
+
+
+def write_synthetic_log(file_path, n_fixes, rate_hz=1):
+    # ESP32-like log for parser benchmarks, with some status lines in between
+    fixes = synthetic_fixes(n_fixes, rate_hz=rate_hz)
+    time_strings = np.datetime_as_string(fixes.times, unit="s")
+    with open(file_path, "w") as f:
+        for idx in range(n_fixes):
+            if idx % 100 == 0:
+                f.write("ESP32 status: satellites=9\n")
+            f.write(f"GPS: {fixes.lat[idx]:.6f}, {fixes.lon[idx]:.6f} @ {time_strings[idx]}\n")
+
+
+def benchmark_matching(n_fixes=1_000_000, n_detections=10_000, n_legacy=20):
+    # Vectorized match_gps vs. the former per-track linear scan over all fixes
+    fixes = synthetic_fixes(n_fixes)
+    rng = np.random.RandomState(0)
+    span = (fixes.times[-1] - fixes.times[0]).astype(np.int64)
+    offsets = rng.randint(0, span, n_detections, dtype=np.int64)
+    times = np.sort(fixes.times[0] + offsets.astype("timedelta64[ns]"))
+
+    results = {}
+    for mode in MATCH_MODES:
+        t_start = time.perf_counter()
+        match_gps(fixes, times, mode=mode)
+        results[mode] = time.perf_counter() - t_start
+
+    gps_data = [
+        {"time": t, "lat": la, "lon": lo}
+        for t, la, lo in zip(fixes.times.astype("datetime64[us]").tolist(), fixes.lat, fixes.lon)
+    ]
+    legacy_times = times[:n_legacy].astype("datetime64[us]").tolist()
+    t_start = time.perf_counter()
+    for detection_time in legacy_times:
+        min_diff = None
+        for entry in gps_data:
+            if entry["time"] > detection_time:
+                time_diff = (entry["time"] - detection_time).total_seconds()
+                if (min_diff is None) or (time_diff < min_diff):
+                    min_diff = time_diff
+    legacy_per_track = (time.perf_counter() - t_start) / n_legacy
+    results["legacy_estimated"] = legacy_per_track * n_detections
+    return results
+
+
+if __name__ == "__main__":
+    # Parse a log and report throughput: python3 -m maskcam.gps <log> [--generate N_FIXES]
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description="Parse an ESP32 GPS log")
+    arg_parser.add_argument("log_file")
+    arg_parser.add_argument(
+        "--generate",
+        type=int,
+        metavar="N_FIXES",
+        help="Write a synthetic log with this many fixes to log_file first",
+    )
+    args = arg_parser.parse_args()
+    if args.generate:
+        write_synthetic_log(args.log_file, args.generate)
+    parse_stats = ParseStats()
+    gps_fixes = load_gps_data(args.log_file, stats=parse_stats)
+    print(f"Parsed {args.log_file}: {parse_stats}")
+    if len(gps_fixes):
+        print(f"Time range: {gps_fixes.times[0]} - {gps_fixes.times[-1]}")
+    sys.exit(0 if len(gps_fixes) else 1)
@@ -0,0 +1,47 @@
+import multiprocessing as mp
+
+import numpy as np
+
+from maskcam.gps import GpsFixes
+
+GPS_RING_SIZE = 256  # Last fixes kept, enough to interpolate any recent detection
+
+
+class GpsRing:
+    """Latest GPS fixes in shared memory, written by save_serial and read by
+    the orchestrator to tag defects while running.
+    A lock covers each publish and each copy: without memory barriers, a
+    reader on another core (the Jetson is aarch64) could see the sequence
+    counter before the slot it was written after. Both hold it for a few
+    microseconds, at the GPS rate and once per defect report.
+    """
+
+    def __init__(self, size=GPS_RING_SIZE):
+        self.size = size
+        self._times = mp.RawArray("q", size)  # ns, same clock as the GPS log
+        self._lat = mp.RawArray("d", size)
+        self._lon = mp.RawArray("d", size)
+        self._seq = mp.RawValue("Q", 0)  # Total fixes written
+        self._lock = mp.Lock()
+
+    def publish(self, time_ns, lat, lon):
+        with self._lock:
+            seq = self._seq.value
+            slot = seq % self.size
+            self._times[slot] = time_ns
+            self._lat[slot] = lat
+            self._lon[slot] = lon
+            self._seq.value = seq + 1
+
+    def __len__(self):
+        return min(self._seq.value, self.size)
+
+    def snapshot(self):
+        # Copy of the fixes in the ring, as GpsFixes sorted by time
+        with self._lock:
+            seq = self._seq.value
+            times = np.frombuffer(self._times, dtype=np.int64).copy()
+            lat = np.frombuffer(self._lat, dtype=np.float64).copy()
+            lon = np.frombuffer(self._lon, dtype=np.float64).copy()
+        slots = np.arange(max(seq - self.size, 0), seq) % self.size
+        return GpsFixes(times[slots].astype("datetime64[ns]"), lat[slots], lon[slots])
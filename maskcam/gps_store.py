@@ -0,0 +1,298 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+from maskcam.archive import ARCHIVE_EXTENSION
+from maskcam.gps import GpsFixes, iter_gps_chunks, load_gps_data, seconds_to_timedelta
+
+# Binary store of parsed GPS fixes, written next to the text log:
+#   esp32_data_<timestamp>.gpsbin      header + fixed-size columnar chunks
+#   esp32_data_<timestamp>.gpsbin.idx  one (first_time, last_time, count) row per chunk
+# Each chunk holds CHUNK_RECORDS slots per column: times (int64 ns, same clock
+# as the text log), lat, lon (float64) and flags (uint32). Times are
+# non-decreasing across the whole store, so any time window is found with a
+# binary search over the index, then one inside the chunk.
+
+STORE_EXTENSION = ".gpsbin"
+INDEX_EXTENSION = ".idx"
+STORE_MAGIC = b"MASKCAM-GPS\x00"
+STORE_VERSION = 1
+HEADER_SIZE = 64
+CHUNK_RECORDS = 4096
+FLUSH_PERIOD = 5  # seconds, max. data lost if the capture is killed
+
+# Record flags
+FLAG_BACKFILLED = 0x1  # Converted from a text log, not written at capture time
+FLAG_REPEATED_TIME = 0x2  # Same timestamp as the previous fix
+
+INDEX_DTYPE = np.dtype([("first", "<i8"), ("last", "<i8"), ("count", "<i8")])
+
+
+def chunk_dtype(chunk_records):
+    return np.dtype(
+        [
+            ("times", "<i8", (chunk_records,)),
+            ("lat", "<f8", (chunk_records,)),
+            ("lon", "<f8", (chunk_records,)),
+            ("flags", "<u4", (chunk_records,)),
+        ]
+    )
+
+
+def get_store_path(log_path):
+    # Same store for a log and its compressed copy (see maskcam/retention.py)
+    if log_path.endswith(ARCHIVE_EXTENSION):
+        log_path = log_path[: -len(ARCHIVE_EXTENSION)]
+    return os.path.splitext(log_path)[0] + STORE_EXTENSION
+
+
+def _header(chunk_records):
+    header = STORE_MAGIC + np.array([STORE_VERSION, chunk_records], dtype="<u4").tobytes()
+    return header.ljust(HEADER_SIZE, b"\0")
+
+
+class GpsStoreWriter:
+    """Append fixes to a store. Fixes older than the last one written are
+    dropped (counted in self.dropped) so that the store remains sorted.
+    The open chunk is rewritten in place on flush(), readers see it right away.
+    """
+
+    def __init__(self, path, chunk_records=CHUNK_RECORDS):
+        self.path = path
+        self.chunk_records = chunk_records
+        self.chunk_size = chunk_dtype(chunk_records).itemsize
+        self.data_file = open(path, "wb")
+        self.data_file.write(_header(chunk_records))
+        self.index_file = open(path + INDEX_EXTENSION, "wb")
+        self.chunk = np.zeros(1, dtype=chunk_dtype(chunk_records))[0]
+        self.n_chunk = 0  # Records in the open chunk
+        self.n_chunks_done = 0
+        self.last_time = None
+        self.count = 0
+        self.dropped = 0
+        self.dirty = False
+        self.t_last_flush = time.monotonic()
+
+    def append(self, time_ns, lat, lon, flags=0):
+        # Returns False if the fix was dropped (older than the previous one)
+        time_ns = int(time_ns)
+        if self.last_time is not None:
+            if time_ns < self.last_time:
+                self.dropped += 1
+                return False
+            if time_ns == self.last_time:
+                flags |= FLAG_REPEATED_TIME
+        idx = self.n_chunk
+        self.chunk["times"][idx] = time_ns
+        self.chunk["lat"][idx] = lat
+        self.chunk["lon"][idx] = lon
+        self.chunk["flags"][idx] = flags
+        self._added(1, time_ns)
+        return True
+
+    def append_many(self, times, lat, lon, flags=0):
+        # Bulk version of append(), for arrays in log order
+        times = np.asarray(times, dtype="datetime64[ns]").astype(np.int64)
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        flags = np.broadcast_to(np.asarray(flags, dtype=np.uint32), times.shape).copy()
+        if len(times) == 0:
+            return 0
+        # Keep only fixes not older than any previous one
+        previous_max = np.maximum.accumulate(times)
+        if self.last_time is not None:
+            previous_max = np.maximum(previous_max, self.last_time)
+        keep = times >= previous_max
+        self.dropped += len(times) - int(keep.sum())
+        times, lat, lon, flags = times[keep], lat[keep], lon[keep], flags[keep]
+        if len(times) == 0:
+            return 0
+        previous = np.concatenate(([times[0] - 1 if self.last_time is None else self.last_time], times[:-1]))
+        flags[times == previous] |= FLAG_REPEATED_TIME
+
+        written = 0
+        while written < len(times):
+            n = min(self.chunk_records - self.n_chunk, len(times) - written)
+            dst = slice(self.n_chunk, self.n_chunk + n)
+            src = slice(written, written + n)
+            self.chunk["times"][dst] = times[src]
+            self.chunk["lat"][dst] = lat[src]
+            self.chunk["lon"][dst] = lon[src]
+            self.chunk["flags"][dst] = flags[src]
+            written += n
+            self._added(n, int(times[written - 1]))
+        return written
+
+    def _added(self, n, last_time):
+        self.n_chunk += n
+        self.count += n
+        self.last_time = last_time
+        self.dirty = True
+        if self.n_chunk == self.chunk_records:
+            self._write_chunk()
+            self.n_chunks_done += 1
+            self.n_chunk = 0
+            self.chunk["times"][:] = 0
+            self.dirty = False
+
+    def _write_chunk(self):
+        # Data first, index last: readers never see records not yet written
+        self.data_file.seek(HEADER_SIZE + self.n_chunks_done * self.chunk_size)
+        self.data_file.write(self.chunk.tobytes())
+        self.data_file.flush()
+        entry = np.array(
+            [(self.chunk["times"][0], self.chunk["times"][self.n_chunk - 1], self.n_chunk)],
+            dtype=INDEX_DTYPE,
+        )
+        self.index_file.seek(self.n_chunks_done * INDEX_DTYPE.itemsize)
+        self.index_file.write(entry.tobytes())
+        self.index_file.flush()
+        self.t_last_flush = time.monotonic()
+
+    def flush(self):
+        if self.dirty and self.n_chunk:
+            self._write_chunk()
+            self.dirty = False
+        self.t_last_flush = time.monotonic()
+
+    def flush_if_due(self, period=FLUSH_PERIOD):
+        if time.monotonic() - self.t_last_flush >= period:
+            self.flush()
+
+    def close(self):
+        self.flush()
+        self.data_file.close()
+        self.index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class GpsStore:
+    """Memory-mapped reader. Call refresh() to see fixes appended
+    after opening (e.g. while the capture is still running).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            header = f.read(HEADER_SIZE)
+        if not header.startswith(STORE_MAGIC):
+            raise ValueError(f"Not a GPS store: {path}")
+        version, chunk_records = np.frombuffer(header, dtype="<u4", count=2, offset=len(STORE_MAGIC))
+        if version != STORE_VERSION:
+            raise ValueError(f"Unsupported GPS store version {version}: {path}")
+        self.chunk_records = int(chunk_records)
+        self.dtype = chunk_dtype(self.chunk_records)
+        self.refresh()
+
+    def refresh(self):
+        index_path = self.path + INDEX_EXTENSION
+        n_chunks = os.path.getsize(index_path) // INDEX_DTYPE.itemsize
+        if n_chunks == 0:
+            self.index = np.zeros(0, dtype=INDEX_DTYPE)
+            self.chunks = np.zeros(0, dtype=self.dtype)
+            return
+        self.index = np.fromfile(index_path, dtype=INDEX_DTYPE, count=n_chunks)
+        self.chunks = np.memmap(self.path, dtype=self.dtype, mode="r", offset=HEADER_SIZE, shape=(n_chunks,))
+
+    def __len__(self):
+        # All chunks are full except the last one
+        if len(self.index) == 0:
+            return 0
+        return (len(self.index) - 1) * self.chunk_records + int(self.index["count"][-1])
+
+    def _locate(self, time_ns, side):
+        # Global record position of time_ns, as np.searchsorted over all times
+        chunk_idx = int(np.searchsorted(self.index["last"], time_ns, side=side))
+        if chunk_idx == len(self.index):
+            return len(self)
+        count = self.index["count"][chunk_idx]
+        inner = np.searchsorted(self.chunks["times"][chunk_idx, :count], time_ns, side=side)
+        return chunk_idx * self.chunk_records + int(inner)
+
+    def _read(self, start, end):
+        # Records [start, end) as GpsFixes, touching only the chunks involved
+        times, lat, lon = [], [], []
+        for chunk_idx in range(start // self.chunk_records, -(-end // self.chunk_records)):
+            offset = chunk_idx * self.chunk_records
+            lo, hi = max(start - offset, 0), min(end - offset, self.chunk_records)
+            if lo < hi:
+                chunk = self.chunks[chunk_idx]
+                times.append(chunk["times"][lo:hi])
+                lat.append(chunk["lat"][lo:hi])
+                lon.append(chunk["lon"][lo:hi])
+        if not times:
+            return GpsFixes([], [], [])
+        return GpsFixes(
+            np.concatenate(times).astype("datetime64[ns]"), np.concatenate(lat), np.concatenate(lon)
+        )
+
+    def window(self, start=None, end=None):
+        # Fixes with start <= time <= end (datetime64), None for an open end
+        first = 0 if start is None else self._locate(np.datetime64(start, "ns").astype(np.int64), "left")
+        last = len(self) if end is None else self._locate(np.datetime64(end, "ns").astype(np.int64), "right")
+        return self._read(first, last)
+
+    def fixes(self):
+        return self._read(0, len(self))
+
+
+def load_gps_fixes(log_path, start=None, end=None, margin=None):
+    """Fixes for a text log, from its binary store if there's one.
+    start/end (datetime64) with margin (seconds) restrict the time window,
+    which only avoids reading the whole store, text logs are always parsed.
+    """
+    store_path = get_store_path(log_path)
+    if not os.path.exists(store_path):
+        return load_gps_data(log_path)
+    store = GpsStore(store_path)
+    if start is None or end is None or margin is None:
+        return store.fixes()
+    delta = seconds_to_timedelta(margin)
+    return store.window(np.datetime64(start, "ns") - delta, np.datetime64(end, "ns") + delta)
+
+
+def convert_log(log_path, store_path=None):
+    # Backfill a store from an existing text log
+    store_path = store_path or get_store_path(log_path)
+    with GpsStoreWriter(store_path) as writer:
+        for times, lat, lon in iter_gps_chunks(log_path):
+            writer.append_many(times, lat, lon, flags=FLAG_BACKFILLED)
+    return writer
+
+
+if __name__ == "__main__":
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description="Binary GPS store tools")
+    subparsers = arg_parser.add_subparsers(dest="action")
+    convert_parser = subparsers.add_parser("convert", help="Create stores from text logs")
+    convert_parser.add_argument("logs", nargs="+")
+    info_parser = subparsers.add_parser("info", help="Show a store's contents")
+    info_parser.add_argument("store")
+    args = arg_parser.parse_args()
+
+    if args.action == "convert":
+        for log_path in args.logs:
+            t_start = time.perf_counter()
+            writer = convert_log(log_path)
+            print(
+                f"{log_path} -> {writer.path}: {writer.count} fixes "
+                f"({writer.dropped} out of order dropped) in {time.perf_counter() - t_start:.2f} s"
+            )
+    elif args.action == "info":
+        store = GpsStore(args.store)
+        print(f"{args.store}: {len(store)} fixes in {len(store.index)} chunks")
+        if len(store):
+            first = np.datetime64(int(store.index["first"][0]), "ns")
+            last = np.datetime64(int(store.index["last"][-1]), "ns")
+            print(f"Time range: {first} - {last}")
+    else:
+        arg_parser.print_help()
+        sys.exit(1)
@@ -16,9 +16,10 @@ gi.require_version("GstBase", "1.0")
 gi.require_version("GstRtspServer", "1.0")
 from gi.repository import GLib, Gst, GstRtspServer, GstBase
 
-from .prints import print_filesave as print
+from .prints import print_filesave as print, configure_logging
 from .common import CODEC_MP4, CODEC_H264, CODEC_H265, CONFIG_FILE
-from .utils import glib_cb_restart
+from .utils import glib_watch_interrupt
+from .outputs import is_shm, get_shm_socket_path
 from .config import config, print_config_overrides
 
 e_interrupt = None
@@ -44,6 +45,28 @@ def sigint_handler(sig, frame):
     e_interrupt.set()
 
 
+def cb_bus_message(bus, message, cb_args):
+    g_loop, output_filename = cb_args
+    t = message.type
+    if t == Gst.MessageType.EOS:
+        print(f"File saved: [yellow]{output_filename}[/yellow]")
+        g_loop.quit()
+    elif t == Gst.MessageType.WARNING:
+        err, debug = message.parse_warning()
+        print("%s: %s" % (err, debug), warning=True)
+    elif t == Gst.MessageType.ERROR:
+        err, debug = message.parse_error()
+        print("%s: %s" % (err, debug), error=True)
+        g_loop.quit()
+    return True
+
+
+def cb_interrupt(container):
+    print("Interruption received. Sending EOS to generate video file.")
+    # This will allow the filesink to create a readable mp4 file
+    container.send_event(Gst.Event.new_eos())
+
+
 def main(
     config: dict,
     output_filename: str,
@@ -51,9 +74,10 @@ def main(
     e_external_interrupt: mp.Event = None,
 ):
     global e_interrupt
+    configure_logging(config)
 
     codec = config["maskcam"]["codec"]
-    streaming_clock_rate = int(config["maskcam"]["streaming-clock-rate"])
+    streaming_clock_rate = config["maskcam"]["streaming-clock-rate"]
 
     udp_capabilities = f"application/x-rtp,media=video,encoding-name=(string){codec},clock-rate={streaming_clock_rate}"
 
@@ -72,9 +96,20 @@ def main(
     if not pipeline:
         print("Unable to create Pipeline", error=True)
 
-    udpsrc = make_elm_or_print_err("udpsrc", "udpsrc", "UDP Source")
-    udpsrc.set_property("port", udp_port)
-    udpsrc.set_property("buffer-size", 524288)
+    if is_shm(config, udp_port):
+        # Same RTP packets, from the inference shmsink (see transport-filesave)
+        shmsrc = make_elm_or_print_err("shmsrc", "shmsrc", "Shared memory Source")
+        shmsrc.set_property("socket-path", get_shm_socket_path(config, udp_port))
+        shmsrc.set_property("is-live", True)
+        shmsrc.set_property("do-timestamp", True)
+        pipeline.add(shmsrc)
+        # Linked as the RTP source below, same caps as udpsrc
+        udpsrc = make_elm_or_print_err("capsfilter", "caps_shm", "Shared memory RTP capabilities")
+    else:
+        shmsrc = None
+        udpsrc = make_elm_or_print_err("udpsrc", "udpsrc", "UDP Source")
+        udpsrc.set_property("port", udp_port)
+        udpsrc.set_property("buffer-size", 524288)
     udpsrc.set_property("caps", Gst.Caps.from_string(udp_capabilities))
     rtpjitterbuffer = make_elm_or_print_err(
         "rtpjitterbuffer", "rtpjitterbuffer", "RTP Jitter Buffer"
@@ -102,6 +137,10 @@ def main(
     GstBase.BaseParse.set_pts_interpolation(codeparser, True)
 
     container = make_elm_or_print_err("qtmux", "qtmux", "Container")
+    # Fragmented MP4: playable while written, nothing but the last fragment is lost if killed
+    fragment_ms = config["maskcam"]["recording-fragment-ms"]
+    if fragment_ms:
+        container.set_property("fragment-duration", fragment_ms)
     filesink = make_elm_or_print_err("filesink", "filesink", "File Sink")
     filesink.set_property("location", output_filename)
     # filesink.set_property("sync", False)
@@ -116,6 +155,8 @@ def main(
     pipeline.add(filesink)
 
     # Pipeline Links
+    if shmsrc is not None:
+        shmsrc.link(udpsrc)
     udpsrc.link(rtpjitterbuffer)
     rtpjitterbuffer.link(rtpdepay)
     # caps_udp.link(rtpdepay)
@@ -125,10 +166,11 @@ def main(
 
     # GLib loop required for RTSP server
     g_loop = GLib.MainLoop()
-    g_context = g_loop.get_context()
 
     # GStreamer message bus
     bus = pipeline.get_bus()
+    bus.add_signal_watch()
+    bus.connect("message", cb_bus_message, (g_loop, output_filename))
 
     if e_external_interrupt is None:
         # Use threading instead of mp.Event() for sigint_handler, see:
@@ -137,41 +179,20 @@ def main(
         signal.signal(signal.SIGINT, sigint_handler)
         print("[green bold]Press Ctrl+C to save video and exit[/green bold]")
     else:
-        # If there's an external interrupt, don't capture SIGINT
+        # If there's an external interrupt, let the orchestrator handle SIGINT
         e_interrupt = e_external_interrupt
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
 
-    # Periodic gloop interrupt (see utils.glib_cb_restart)
-    t_check = 50
-    GLib.timeout_add(t_check, glib_cb_restart, t_check)
-
-    # Custom event loop, allows saving file on Ctrl+C press
-    running = True
+    # Send EOS on interrupt, saving the file on Ctrl+C press (see utils.glib_watch_interrupt)
+    close_interrupt_watch = glib_watch_interrupt(e_interrupt, cb_interrupt, container)
 
     # start play back and listen to events
     pipeline.set_state(Gst.State.PLAYING)
     print("[green]Playing:[/green] file-saving pipeline UDP->File\n")
 
-    while running:
-        g_context.iteration(may_block=True)
-        message = bus.pop()
-        if message is not None:
-            t = message.type
-
-            if t == Gst.MessageType.EOS:
-                print(f"File saved: [yellow]{output_filename}[/yellow]")
-                running = False
-            elif t == Gst.MessageType.WARNING:
-                err, debug = message.parse_warning()
-                print("%s: %s" % (err, debug), warning=True)
-            elif t == Gst.MessageType.ERROR:
-                err, debug = message.parse_error()
-                print("%s: %s" % (err, debug), error=True)
-                running = False
-        if e_interrupt.is_set():
-            print("Interruption received. Sending EOS to generate video file.")
-            # This will allow the filesink to create a readable mp4 file
-            container.send_event(Gst.Event.new_eos())
-            e_interrupt.clear()
+    # Sleeps until a bus message or the interrupt arrives, ends on EOS or error
+    g_loop.run()
+    close_interrupt_watch()
 
     print("File-saver main loop ending.")
     # cleanup
@@ -194,7 +215,7 @@ if __name__ == "__main__":
         output_dir = config["maskcam"]["fileserver-hdd-dir"]
         output_filename = f"{output_dir}/{datetime.today().strftime('%Y%m%d_%H%M%S')}.mp4"
     if not udp_port:  # Use first listed in config
-        udp_port = int(config["maskcam"]["udp-ports-filesave"].split(",")[0])
+        udp_port = config["maskcam"]["udp-ports-filesave"][0]
     print(f"Output file: {output_filename}")
 
     sys.exit(main(config=config, output_filename=output_filename, udp_port=udp_port))
@@ -1,53 +1,1118 @@
 #!/usr/bin/env python3
 
+import io
 import os
 import sys
+import html
+import json
 import time
+import queue
 import socket
+import asyncio
+import selectors
 import threading
+import mimetypes
+import posixpath
+import http.client
 import multiprocessing as mp
-from datetime import datetime
-from http.server import SimpleHTTPRequestHandler
-from socketserver import TCPServer, ThreadingTCPServer
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlsplit
 
 from .config import config, print_config_overrides
 from .utils import get_ip_address
-from .prints import print_fileserver as print
+from .recordings import RecordingsIndex, parse_query
+from .previews import PREVIEW_KINDS, PreviewCache, PreviewWorker, is_video
+from .outputs import HLS_PLAYLIST, HLS_SEGMENT_EXTENSION
+from .snapshot import SnapshotEncoder
+from .prints import print_fileserver as print, configure_logging
 
+# Static file server for the recorded videos. File bodies are sent with
+# sendfile (zero-copy), with Range and conditional requests so browsers can
+# seek in a clip without downloading it all.
+# Two modes (fileserver-mode), sharing the same responses (build_response):
+#  - threads: requests are handled by a fixed pool of worker threads. Kept
+#    alive connections wait for their next request in a selector
+#    (IdleConnections), without a worker. A worker is still held while it
+#    sends a response: slow clients belong in the asyncio mode.
+#  - asyncio: all connections in one event loop thread, non-blocking
+#    sendfile, with a connection limit, idle timeouts and bandwidth caps.
+#    For many slow clients (e.g. downloads over cellular links).
+# /api/recordings lists the recordings as JSON, from an in-memory index
+# (see maskcam/recordings.py). /previews/ serves the clips thumbnails and
+# contact sheets (see maskcam/previews.py), linked from the listings.
+# /live/ serves the recordings still being written in the RAM dir, when
+# they're fragmented MP4 (playable at any point, see recording-fragment-ms).
+# /hls/ serves the HLS stream written by inference (hls-enabled), with a
+# player page. The playlist is cacheable for 1 s and segments forever, so
+# proxies can share them between viewers. The page plays HLS natively where
+# browsers can, otherwise with hls.js: served from /hls/ when
+# maskcam/static/hls.min.js exists (fetched by the Dockerfile), else loaded
+# from the jsDelivr CDN, which needs internet access on the viewer's side.
+# /snapshot.jpg is the latest inference output frame (see maskcam/snapshot.py).
 
-class Handler(SimpleHTTPRequestHandler):
-    # Needed to set extensions_map
+KEEPALIVE_TIMEOUT = 15  # seconds, idle keep-alive connections are closed after this
+MAX_QUEUED_CONNECTIONS = 64  # Waiting for a worker, more are rejected with 503
+BUSY_LOG_INTERVAL = 10  # seconds, between warnings about requests waiting for a worker
+MAX_RANGES = 16  # Requests with more ranges are served whole
+MULTIPART_BOUNDARY = "MASKCAM_BYTERANGES"
+RECORDINGS_API_PATH = "/api/recordings"
+PREVIEWS_PATH = "/previews/"
+PREVIEW_CACHE_CONTROL = "public, max-age=31536000, immutable"  # Content-addressed, never change
+LIVE_PATH = "/live/"
+LIVE_CACHE_CONTROL = "no-cache"  # Still growing
+SNAPSHOT_PATH = "/snapshot.jpg"
+HLS_PATH = "/hls/"
+HLS_PLAYLIST_CACHE_CONTROL = "public, max-age=1"  # Less than a segment
+HLS_SEGMENT_CACHE_CONTROL = "public, max-age=31536000, immutable"  # Names unique per run
+HLS_SCRIPT = "hls.min.js"
+HLS_SCRIPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", HLS_SCRIPT)
+HLS_SCRIPT_CDN = "https://cdn.jsdelivr.net/npm/hls.js@1"
+HLS_SCRIPT_CACHE_CONTROL = "public, max-age=86400"
+HLS_PAGE = """<!DOCTYPE html><html><head><meta charset='utf-8'><title>maskcam live</title>
+<script src="%(script)s"></script></head>
+<body><video id="video" controls autoplay muted playsinline width="100%%"></video><script>
+var video = document.getElementById("video");
+if (video.canPlayType("application/vnd.apple.mpegurl")) {
+  video.src = "%(playlist)s";  // Native HLS (Safari, Android)
+} else if (window.Hls && Hls.isSupported()) {
+  var hls = new Hls(); hls.loadSource("%(playlist)s"); hls.attachMedia(video);
+}
+</script></body></html>
+"""
+INDEX_READY_TIMEOUT = 10  # seconds, max. wait for the initial scan
+SERVER_VERSION = "maskcam-fileserver"
+
+# Not in every system's mime.types (.ts can be a Qt translation file)
+mimetypes.add_type("application/vnd.apple.mpegurl", ".m3u8")
+mimetypes.add_type("video/mp2t", HLS_SEGMENT_EXTENSION)
+
+# asyncio mode
+MAX_HEADER_SIZE = 65536  # Request line + headers, larger requests get 431
+RECV_SIZE = 16384
+SEND_CHUNK = 256 * 1024  # Max. bytes per send/sendfile call
+BURST_SECONDS = 0.1  # Bandwidth caps allow bursts of this many seconds of data
+MIN_BURST = 16384
+SERVICE_UNAVAILABLE_RESPONSE = (
+    b"HTTP/1.1 503 Service Unavailable\r\nRetry-After: 1\r\n"
+    b"Content-Length: 0\r\nConnection: close\r\n\r\n"
+)
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_ranges(header, size):
+    """Byte ranges of a Range header as [(start, end_inclusive)], or None to
+    ignore the header (invalid, or too many ranges). Raises RangeNotSatisfiable
+    if no range overlaps the file.
+    """
+    unit, _, range_set = header.partition("=")
+    if unit.strip().lower() != "bytes" or not range_set:
+        return None
+    ranges = []
+    for spec in range_set.split(","):
+        first, sep, last = spec.strip().partition("-")
+        if not sep:
+            return None
+        try:
+            if first:
+                start = int(first)
+                end = int(last) if last else size - 1
+                if last and end < start:
+                    return None
+            else:
+                suffix = int(last)  # Last N bytes
+                if suffix == 0:
+                    continue
+                start, end = max(size - suffix, 0), size - 1
+        except ValueError:
+            return None
+        if start < size:
+            ranges.append((start, min(end, size - 1)))
+    if not ranges:
+        raise RangeNotSatisfiable()
+    if len(ranges) > MAX_RANGES:
+        return None
+    return ranges
+
+
+def get_etag(stat_result):
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def etag_matches(header, etag):
+    # If-None-Match / If-Range comparison (weak, as allowed for GET)
+    if header.strip() == "*":
+        return True
+    return etag in (tag.strip().replace("W/", "", 1) for tag in header.split(","))
+
+
+def http_date(timestamp):
+    return formatdate(timestamp, usegmt=True)
+
+
+def parse_http_date(value):
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if parsed is None:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+class Response:
+    """Status, headers and body of a response, independent of the server mode.
+    The body is either bytes, or parts of an open file sent with sendfile:
+    [(start, end_inclusive, multipart head)] followed by closing.
+    """
+
+    def __init__(self, status, headers=(), body=b"", file=None, parts=(), closing=b""):
+        self.status = status
+        self.headers = list(headers)
+        self.body = body
+        self.file = file
+        self.parts = parts
+        self.closing = closing
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def error_response(status, message=None):
+    status = HTTPStatus(status)
+    body = (
+        BaseHTTPRequestHandler.error_message_format
+        % {
+            "code": status.value,
+            "message": html.escape(message or status.phrase, quote=False),
+            "explain": html.escape(status.description, quote=False),
+        }
+    ).encode("utf-8", "replace")
+    return Response(
+        status,
+        [
+            ("Content-Type", BaseHTTPRequestHandler.error_content_type),
+            ("Content-Length", str(len(body))),
+        ],
+        body,
+    )
+
+
+def translate_path(root, target):
+    # Filesystem path under the server root ("..", "." dropped) and the split URL
+    url = urlsplit(target)
+    path = posixpath.normpath(unquote(url.path))
+    parts = [part for part in path.split("/") if part and part not in (".", "..")]
+    return os.path.join(root, *parts), url
+
+
+def build_response(root, index, target, headers, previews=None, live_dir=None, hls_dir=None, snapshot=None):
+    """Response to a GET/HEAD of target (the request path) with the request
+    headers (a Message, as parsed by http.client). Does blocking file system
+    calls, and waits for the recordings index to be ready.
+    previews: PreviewCache to serve and link clip previews from (optional).
+    live_dir: directory of the recordings in progress, served at LIVE_PATH (optional).
+    hls_dir: directory of the HLS playlist and segments, served at HLS_PATH (optional).
+    snapshot: SnapshotEncoder, served at SNAPSHOT_PATH (optional).
+    """
+    path, url = translate_path(root, target)
+    if url.path.rstrip("/") == RECORDINGS_API_PATH and index is not None:
+        return recordings_response(index, url, headers, previews)
+    if url.path.startswith(PREVIEWS_PATH) and previews is not None:
+        return preview_response(previews, url, headers)
+    if url.path.startswith(LIVE_PATH) and live_dir is not None:
+        return live_response(live_dir, url, headers)
+    if url.path.startswith(HLS_PATH) and hls_dir is not None:
+        return hls_response(hls_dir, url, headers)
+    if url.path == SNAPSHOT_PATH and snapshot is not None:
+        return snapshot_response(snapshot)
+    if os.path.isdir(path):
+        if not url.path.endswith("/"):
+            return Response(
+                HTTPStatus.MOVED_PERMANENTLY, [("Location", url.path + "/"), ("Content-Length", "0")]
+            )
+        return listing_response(path, url.path, previews)
+    try:
+        f = open(path, "rb")
+    except OSError:
+        return error_response(HTTPStatus.NOT_FOUND, "File not found")
+    try:
+        return file_response(f, url, headers)
+    except Exception:
+        f.close()
+        raise
+
+
+def file_response(f, url, headers):
+    # Takes ownership of f, closed with the response (or now, if there's no body)
+    stat_result = os.fstat(f.fileno())
+    size = stat_result.st_size
+    etag = get_etag(stat_result)
+    last_modified = http_date(stat_result.st_mtime)
+
+    if not_modified(headers, etag, stat_result.st_mtime):
+        f.close()
+        return Response(HTTPStatus.NOT_MODIFIED, [("ETag", etag), ("Last-Modified", last_modified)])
+
+    ranges = None
+    range_header = headers.get("Range")
+    if range_header and range_applies(headers, etag, stat_result.st_mtime):
+        try:
+            ranges = parse_ranges(range_header, size)
+        except RangeNotSatisfiable:
+            f.close()
+            return Response(
+                HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE,
+                [("Content-Range", f"bytes */{size}"), ("Content-Length", "0")],
+            )
+
+    content_type = mimetypes.guess_type(f.name)[0] or "application/octet-stream"
+    closing = b""
+    if ranges is None:
+        status = HTTPStatus.OK
+        parts = [(0, size - 1, b"")]
+        response_headers = [("Content-Type", content_type), ("Content-Length", str(size))]
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        status = HTTPStatus.PARTIAL_CONTENT
+        parts = [(start, end, b"")]
+        response_headers = [
+            ("Content-Type", content_type),
+            ("Content-Range", f"bytes {start}-{end}/{size}"),
+            ("Content-Length", str(end - start + 1)),
+        ]
+    else:
+        status = HTTPStatus.PARTIAL_CONTENT
+        parts = [
+            (
+                start,
+                end,
+                (
+                    f"\r\n--{MULTIPART_BOUNDARY}\r\nContent-Type: {content_type}\r\n"
+                    f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+                ).encode(),
+            )
+            for start, end in ranges
+        ]
+        closing = f"\r\n--{MULTIPART_BOUNDARY}--\r\n".encode()
+        length = sum(len(head) + end - start + 1 for start, end, head in parts) + len(closing)
+        response_headers = [
+            ("Content-Type", f"multipart/byteranges; boundary={MULTIPART_BOUNDARY}"),
+            ("Content-Length", str(length)),
+        ]
+    response_headers += [("Accept-Ranges", "bytes"), ("ETag", etag), ("Last-Modified", last_modified)]
+    if "download" in url.query:
+        response_headers.append(("Content-Disposition", "attachment"))
+    return Response(status, response_headers, file=f, parts=parts, closing=closing)
+
+
+def preview_response(previews, url, headers):
+    # /previews/<key>-<kind>.jpg
+    name = url.path[len(PREVIEWS_PATH) :]
+    key, _, kind = name.partition("-")
+    kind, _, extension = kind.partition(".")
+    path = None
+    if key.isalnum() and kind in PREVIEW_KINDS and extension == "jpg":
+        path = previews.get(key, kind)
+    try:
+        f = open(path, "rb") if path is not None else None
+    except OSError:
+        f = None  # Evicted meanwhile
+    if f is None:
+        return error_response(HTTPStatus.NOT_FOUND, "Preview not found")
+    response = file_response(f, url, headers)
+    response.headers.append(("Cache-Control", PREVIEW_CACHE_CONTROL))
+    return response
+
+
+def live_response(live_dir, url, headers):
+    # /live/<name>: a recording being written, its size and ETag change on every fragment
+    name = unquote(url.path[len(LIVE_PATH) :])
+    if not name:
+        return listing_response(live_dir, url.path, include=is_video)
+    if "/" in name or name.startswith(".") or not is_video(name):
+        return error_response(HTTPStatus.NOT_FOUND, "File not found")
+    try:
+        f = open(os.path.join(live_dir, name), "rb")
+    except OSError:
+        return error_response(HTTPStatus.NOT_FOUND, "Recording not found (finished meanwhile?)")
+    try:
+        response = file_response(f, url, headers)
+    except Exception:
+        f.close()
+        raise
+    response.headers.append(("Cache-Control", LIVE_CACHE_CONTROL))
+    return response
+
+
+def hls_response(hls_dir, url, headers):
+    # /hls/: player page, /hls/live.m3u8: playlist, /hls/<run>-<n>.ts: segments
+    name = unquote(url.path[len(HLS_PATH) :])
+    if not name:
+        script = HLS_SCRIPT if os.path.exists(HLS_SCRIPT_PATH) else HLS_SCRIPT_CDN
+        body = (HLS_PAGE % {"playlist": HLS_PLAYLIST, "script": script}).encode("utf-8")
+        return Response(
+            HTTPStatus.OK,
+            [("Content-Type", "text/html; charset=utf-8"), ("Content-Length", str(len(body)))],
+            body,
+        )
+    if name == HLS_SCRIPT:
+        try:
+            f = open(HLS_SCRIPT_PATH, "rb")
+        except OSError:
+            return error_response(HTTPStatus.NOT_FOUND, "hls.js not installed, see maskcam/static")
+        response = file_response(f, url, headers)
+        response.headers.append(("Cache-Control", HLS_SCRIPT_CACHE_CONTROL))
+        return response
+    if name == HLS_PLAYLIST:
+        cache_control = HLS_PLAYLIST_CACHE_CONTROL
+    elif name.endswith(HLS_SEGMENT_EXTENSION) and "/" not in name and not name.startswith("."):
+        cache_control = HLS_SEGMENT_CACHE_CONTROL
+    else:
+        return error_response(HTTPStatus.NOT_FOUND, "File not found")
+    try:
+        f = open(os.path.join(hls_dir, name), "rb")
+    except OSError:
+        return error_response(HTTPStatus.NOT_FOUND, "HLS not started or segment expired")
+    try:
+        response = file_response(f, url, headers)
+    except Exception:
+        f.close()
+        raise
+    response.headers.append(("Cache-Control", cache_control))
+    return response
+
+
+def snapshot_response(snapshot):
+    jpeg, frame_time = snapshot.get()
+    if jpeg is None:
+        return error_response(HTTPStatus.SERVICE_UNAVAILABLE, "No frame from inference")
+    return Response(
+        HTTPStatus.OK,
+        [
+            ("Content-Type", "image/jpeg"),
+            ("Content-Length", str(len(jpeg))),
+            ("Cache-Control", "no-cache"),
+            ("Last-Modified", http_date(frame_time)),
+        ],
+        jpeg,
+    )
+
+
+def preview_urls(previews, path):
+    # {kind: URL} of the previews of a recording, empty if there are none yet
+    key = previews.key_for(path) if previews is not None else None
+    if key is None:
+        return {}
+    return {kind: f"{PREVIEWS_PATH}{key}-{kind}.jpg" for kind in PREVIEW_KINDS}
+
+
+def not_modified(headers, etag, mtime):
+    if_none_match = headers.get("If-None-Match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    if_modified_since = headers.get("If-Modified-Since")
+    if if_modified_since is not None:
+        since = parse_http_date(if_modified_since)
+        return since is not None and int(mtime) <= since
+    return False
+
+
+def range_applies(headers, etag, mtime):
+    # If-Range: the range only applies if the file didn't change
+    if_range = headers.get("If-Range")
+    if if_range is None:
+        return True
+    if if_range.strip().startswith(("\"", "W/")):
+        return if_range.strip() == etag
+    since = parse_http_date(if_range)
+    return since is not None and int(mtime) <= since
+
+
+def recordings_response(index, url, headers, previews=None):
+    # ?sort=[-]start|end|size|name&from=<time>&to=<time>&offset=<n>&limit=<n>
+    if not index.ready.wait(INDEX_READY_TIMEOUT):
+        return error_response(HTTPStatus.SERVICE_UNAVAILABLE, "Recordings index not ready")
+    try:
+        query = parse_query(parse_qs(url.query))
+    except (ValueError, OverflowError) as e:
+        return error_response(HTTPStatus.BAD_REQUEST, f"Invalid query: {e}")
+    total, page, version = index.query(**query)
+    # Same URL and index version: same content
+    etag = f'"recordings-{version}"'
+    if_none_match = headers.get("If-None-Match")
+    if if_none_match is not None and etag_matches(if_none_match, etag):
+        return Response(HTTPStatus.NOT_MODIFIED, [("ETag", etag)])
+    recordings = []
+    for recording in page:
+        item = recording.to_json()
+        item["url"] = "/" + quote(recording.name)
+        item.update(preview_urls(previews, os.path.join(index.root, recording.name)))
+        recordings.append(item)
+    body = json.dumps(
+        {"total": total, "offset": query["offset"], "count": len(recordings), "recordings": recordings}
+    ).encode("utf-8")
+    return Response(
+        HTTPStatus.OK,
+        [
+            ("Content-Type", "application/json"),
+            ("Content-Length", str(len(body))),
+            ("Cache-Control", "no-cache"),
+            ("ETag", etag),
+        ],
+        body,
+    )
+
+
+def listing_response(path, url_path, previews=None, include=None):
+    # include: only list the names for which include(name) is true (optional)
+    try:
+        entries = sorted(os.scandir(path), key=lambda entry: entry.name)
+    except OSError:
+        return error_response(HTTPStatus.NOT_FOUND, "Directory not found")
+    rows = []
+    for entry in entries:
+        if include is not None and not include(entry.name):
+            continue
+        try:
+            stat_result = entry.stat()
+        except OSError:
+            continue  # Removed meanwhile
+        name = entry.name + ("/" if entry.is_dir() else "")
+        modified = datetime.fromtimestamp(stat_result.st_mtime).strftime("%Y-%m-%d %H:%M:%S")
+        size = "-" if entry.is_dir() else f"{stat_result.st_size / 1e6:.1f} MB"
+        urls = preview_urls(previews, entry.path)
+        preview = ""
+        if urls:
+            preview = f'<a href="{urls["sheet"]}"><img src="{urls["thumb"]}" width="160" loading="lazy"></a>'
+        rows.append(
+            f'<tr><td><a href="{quote(name)}">{html.escape(name)}</a></td>'
+            f"<td>{size}</td><td>{modified}</td><td>{preview}</td></tr>"
+        )
+    title = html.escape(unquote(url_path))
+    body = (
+        f"<!DOCTYPE html><html><head><meta charset='utf-8'><title>{title}</title></head>"
+        f"<body><h1>{title}</h1><table>{''.join(rows)}</table></body></html>\n"
+    ).encode("utf-8")
+    return Response(
+        HTTPStatus.OK,
+        [
+            ("Content-Type", "text/html; charset=utf-8"),
+            ("Content-Length", str(len(body))),
+            ("Cache-Control", "no-cache"),
+        ],
+        body,
+    )
+
+
+class FileRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive
+    timeout = KEEPALIVE_TIMEOUT
+    server_version = SERVER_VERSION
+
+    def setup(self):
+        super().setup()
+        # Headers and body are separate sends, don't let Nagle delay the body
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        # One request per dispatch: a kept alive connection then goes back to
+        # the server (IdleConnections), unless the next request was already
+        # read into rfile (pipelining), which a new handler wouldn't see
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection and self.request_buffered():
+            self.handle_one_request()
+
+    def request_buffered(self):
+        self.connection.setblocking(False)  # peek() returns b"" instead of waiting
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def do_GET(self):
+        self.handle_file(send_body=True)
+
+    def do_HEAD(self):
+        self.handle_file(send_body=False)
+
+    def log_message(self, format, *args):
+        pass  # One line per request is too much for the console
+
+    def handle_file(self, send_body):
+        with build_response(
+            self.server.root,
+            self.server.index,
+            self.path,
+            self.headers,
+            self.server.previews,
+            self.server.live_dir,
+            self.server.hls_dir,
+            self.server.snapshot,
+        ) as response:
+            self.send_response(response.status)
+            for name, value in response.headers:
+                self.send_header(name, value)
+            self.end_headers()
+            if not send_body:
+                return
+            if response.body:
+                self.wfile.write(response.body)
+            for start, end, head in response.parts:
+                if head:
+                    self.wfile.write(head)
+                if end >= start:
+                    # os.sendfile() underneath, waiting on the socket timeout if it's full
+                    self.connection.sendfile(response.file, offset=start, count=end - start + 1)
+            if response.closing:
+                self.wfile.write(response.closing)
+
+
+class IdleConnections:
+    """Kept alive connections between two requests, watched by one selector
+    thread instead of each holding a worker. A connection is dispatched
+    (back to the worker queue) once its next request arrives, and closed
+    after KEEPALIVE_TIMEOUT without one.
+    """
+
+    def __init__(self, dispatch, close):
+        self.dispatch = dispatch
+        self.close = close
+        self.selector = selectors.DefaultSelector()
+        self.parked = queue.Queue()  # From the workers
+        self.deadlines = {}  # socket -> (client address, deadline), selector thread only
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self.thread = threading.Thread(target=self._run, name="fileserver-idle", daemon=True)
+        self.thread.start()
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def park(self, request, client_address):
+        self.parked.put((request, client_address))
+        self._wake()
+
+    def stop(self):
+        self.parked.put(None)
+        self._wake()
+        self.thread.join(timeout=1)
+
+    def _wake(self):
+        try:
+            os.write(self._wake_w, b"\0")
+        except BlockingIOError:
+            pass  # Already woken up
+
+    def _run(self):
+        self.selector.register(self._wake_r, selectors.EVENT_READ)
+        try:
+            while True:
+                timeout = None  # Sleeps until a request, a new connection or the next deadline
+                if self.deadlines:
+                    timeout = max(0, min(deadline for _, deadline in self.deadlines.values()) - time.monotonic())
+                for key, _ in self.selector.select(timeout):
+                    if key.fileobj == self._wake_r:
+                        try:
+                            while os.read(self._wake_r, 4096):
+                                pass
+                        except BlockingIOError:
+                            pass
+                        continue
+                    self.selector.unregister(key.fileobj)
+                    client_address, _ = self.deadlines.pop(key.fileobj)
+                    self.dispatch(key.fileobj, client_address)
+                while True:
+                    try:
+                        item = self.parked.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        return
+                    request, client_address = item
+                    self.selector.register(request, selectors.EVENT_READ)
+                    self.deadlines[request] = (client_address, time.monotonic() + KEEPALIVE_TIMEOUT)
+                now = time.monotonic()
+                for request, (_, deadline) in list(self.deadlines.items()):
+                    if deadline <= now:
+                        self.selector.unregister(request)
+                        del self.deadlines[request]
+                        self.close(request)
+        finally:
+            for request in list(self.deadlines):
+                self.close(request)
+            self.deadlines = {}
+            self.selector.close()
+            os.close(self._wake_r)
+            os.close(self._wake_w)
+
+
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer with a fixed number of worker threads, each handling one
+    request at a time. Connections with a request wait in a bounded queue;
+    when it's full they get a 503 right away. Between requests, kept alive
+    connections wait in IdleConnections.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address,
+        handler_class,
+        root,
+        workers,
+        index=None,
+        previews=None,
+        live_dir=None,
+        hls_dir=None,
+        snapshot=None,
+    ):
+        self.root = os.path.abspath(root)
+        self.index = index
+        self.previews = previews
+        self.live_dir = live_dir
+        self.hls_dir = hls_dir
+        self.snapshot = snapshot
+        self.connections = queue.Queue(MAX_QUEUED_CONNECTIONS)
+        super().__init__(address, handler_class)
+        self.idle_connections = IdleConnections(self.process_request, self.shutdown_request)
+        self.busy_workers = 0
+        self.busy_lock = threading.Lock()
+        self.workers = [
+            threading.Thread(target=self.worker, name=f"fileserver-worker-{idx}", daemon=True)
+            for idx in range(workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def process_request(self, request, client_address):
+        # Also called by IdleConnections when a kept alive connection sends a request
+        waiting = self.connections.qsize()
+        if waiting and self.busy_workers == len(self.workers):
+            print(
+                f"Static file server: all {len(self.workers)} workers busy, {waiting} requests waiting",
+                warning=True,
+                every=BUSY_LOG_INTERVAL,
+            )
+        try:
+            self.connections.put_nowait((request, client_address))
+        except queue.Full:
+            try:
+                request.sendall(SERVICE_UNAVAILABLE_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+
+    def worker(self):
+        while True:
+            item = self.connections.get()
+            if item is None:
+                break
+            request, client_address = item
+            keep_alive = False
+            with self.busy_lock:
+                self.busy_workers += 1
+            try:
+                handler = self.finish_request(request, client_address)
+                keep_alive = not handler.close_connection
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                with self.busy_lock:
+                    self.busy_workers -= 1
+                if keep_alive:
+                    self.idle_connections.park(request, client_address)
+                else:
+                    self.shutdown_request(request)
+
+    def finish_request(self, request, client_address):
+        return self.RequestHandlerClass(request, client_address, self)
+
+    def handle_error(self, request, client_address):
+        # Not important, happens very often but nothing actually fails
+        print(f"Static file server: File request interrupted [client: {client_address}]")
+
+    def server_close(self):
+        super().server_close()
+        self.idle_connections.stop()
+        for _ in self.workers:
+            self.connections.put(None)
+        for worker in self.workers:
+            worker.join(timeout=1)
+
+
+class TokenBucket:
+    """Bandwidth cap in bytes/s. consume() takes the bytes just sent and
+    returns how long to wait before sending more (the bucket can go into
+    debt, so a shared bucket queues its users in order).
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.capacity = max(rate * BURST_SECONDS, MIN_BURST)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+
+    def consume(self, n_bytes):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        self.tokens -= n_bytes
+        return -self.tokens / self.rate if self.tokens < 0 else 0
+
+
+class IdleTimeout(Exception):
     pass
 
 
+class AsyncFileServer:
+    """Serves all connections from one asyncio event loop. Sockets are
+    non-blocking and file bodies are sent with os.sendfile() when the socket
+    is writable, so a slow client only costs its socket buffers and a task.
+    Responses are built (open, stat, listing) in a small thread pool.
+    max_connections: more connections get a 503 right away.
+    client_rate, total_rate: bandwidth caps in bytes/s (0: unlimited), per
+      connection and for all of them together.
+    idle_timeout: seconds without reading a request or being able to send.
+    """
+
+    def __init__(
+        self,
+        address,
+        root,
+        index=None,
+        max_connections=200,
+        client_rate=0,
+        total_rate=0,
+        idle_timeout=30,
+        workers=4,
+        previews=None,
+        live_dir=None,
+        hls_dir=None,
+        snapshot=None,
+    ):
+        self.root = os.path.abspath(root)
+        self.index = index
+        self.previews = previews
+        self.live_dir = live_dir
+        self.hls_dir = hls_dir
+        self.snapshot = snapshot
+        self.max_connections = max_connections
+        self.client_rate = client_rate
+        self.total_bucket = TokenBucket(total_rate) if total_rate else None
+        self.idle_timeout = idle_timeout
+        self.executor = ThreadPoolExecutor(workers)
+        self.connections = set()  # Tasks
+        self.rejected = 0
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(address)
+        self.listener.listen(128)
+        self.listener.setblocking(False)
+        self.server_address = self.listener.getsockname()
+        self.loop = asyncio.new_event_loop()
+        self.stop_requested = False
+        self.stopped = None  # asyncio.Event, created in the loop
+
+    def serve_forever(self):
+        # Runs the event loop in the calling thread until shutdown()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.serve())
+        finally:
+            self.loop.close()
+
+    def shutdown(self):
+        # From any thread
+        self.stop_requested = True
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._stop)
+
+    def _stop(self):
+        if self.stopped is not None:
+            self.stopped.set()
+
+    def server_close(self):
+        self.listener.close()
+        self.executor.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server_close()
+
+    async def serve(self):
+        self.stopped = asyncio.Event()
+        if self.stop_requested:
+            return
+        accept_task = asyncio.ensure_future(self.accept_loop())
+        await self.stopped.wait()
+        accept_task.cancel()
+        for task in list(self.connections):
+            task.cancel()
+        await asyncio.gather(accept_task, *self.connections, return_exceptions=True)
+
+    async def accept_loop(self):
+        while True:
+            conn, client_address = await self.loop.sock_accept(self.listener)
+            if len(self.connections) >= self.max_connections:
+                self.rejected += 1
+                try:
+                    conn.send(SERVICE_UNAVAILABLE_RESPONSE)
+                except OSError:
+                    pass
+                conn.close()
+                continue
+            conn.setblocking(False)
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            task = asyncio.ensure_future(self.handle_connection(conn, client_address))
+            self.connections.add(task)
+            task.add_done_callback(self.connections.discard)
+
+    async def handle_connection(self, conn, client_address):
+        buckets = [TokenBucket(self.client_rate)] if self.client_rate else []
+        if self.total_bucket is not None:
+            buckets.append(self.total_bucket)
+        data = b""
+        try:
+            while True:
+                request, data = await self.read_request(conn, data)
+                if request is None:
+                    break
+                method, target, version, headers = request
+                if method not in ("GET", "HEAD"):
+                    response = error_response(HTTPStatus.NOT_IMPLEMENTED, f"Unsupported method ({method})")
+                    keep_alive = False
+                else:
+                    response = await self.loop.run_in_executor(
+                        self.executor,
+                        build_response,
+                        self.root,
+                        self.index,
+                        target,
+                        headers,
+                        self.previews,
+                        self.live_dir,
+                        self.hls_dir,
+                        self.snapshot,
+                    )
+                    connection = headers.get("Connection", "").lower()
+                    keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+                with response:
+                    await self.send_response(conn, response, method != "HEAD", keep_alive, buckets)
+                if not keep_alive:
+                    break
+        except IdleTimeout:
+            pass
+        except Exception:
+            # Not important, happens very often but nothing actually fails
+            print(f"Static file server: File request interrupted [client: {client_address}]")
+        finally:
+            conn.close()
+
+    async def read_request(self, conn, data):
+        """Next request on the connection as (method, target, version, headers),
+        and the data already received after it. (None, b"") when the client
+        closes the connection or is idle for idle_timeout.
+        """
+        while b"\r\n\r\n" not in data:
+            if len(data) > MAX_HEADER_SIZE:
+                await self.send_bytes(conn, self.error_head(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE), [])
+                return None, b""
+            try:
+                chunk = await asyncio.wait_for(self.loop.sock_recv(conn, RECV_SIZE), self.idle_timeout)
+            except asyncio.TimeoutError:
+                return None, b""
+            if not chunk:
+                return None, b""
+            data += chunk
+        head, _, data = data.partition(b"\r\n\r\n")
+        request_line, _, header_lines = head.partition(b"\r\n")
+        words = request_line.decode("iso-8859-1").split()
+        if len(words) != 3 or not words[2].startswith("HTTP/"):
+            await self.send_bytes(conn, self.error_head(HTTPStatus.BAD_REQUEST), [])
+            return None, b""
+        try:
+            headers = http.client.parse_headers(io.BytesIO(header_lines + b"\r\n\r\n"))
+        except http.client.HTTPException:
+            await self.send_bytes(conn, self.error_head(HTTPStatus.BAD_REQUEST), [])
+            return None, b""
+        # GET/HEAD have no body, others are answered with 501 and closed
+        return (words[0], words[1], words[2], headers), data
+
+    def error_head(self, status):
+        response = error_response(status)
+        return self.response_head(response, keep_alive=False) + response.body
+
+    def response_head(self, response, keep_alive):
+        status = HTTPStatus(response.status)
+        lines = [
+            f"HTTP/1.1 {status.value} {status.phrase}",
+            f"Server: {SERVER_VERSION}",
+            f"Date: {http_date(time.time())}",
+        ]
+        lines += [f"{name}: {value}" for name, value in response.headers]
+        lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("iso-8859-1")
+
+    async def send_response(self, conn, response, send_body, keep_alive, buckets):
+        head = self.response_head(response, keep_alive)
+        if not send_body:
+            await self.send_bytes(conn, head, buckets)
+            return
+        await self.send_bytes(conn, head + response.body, buckets)
+        for start, end, part_head in response.parts:
+            if part_head:
+                await self.send_bytes(conn, part_head, buckets)
+            if end >= start:
+                await self.send_file(conn, response.file.fileno(), start, end - start + 1, buckets)
+        if response.closing:
+            await self.send_bytes(conn, response.closing, buckets)
+
+    async def send_bytes(self, conn, data, buckets):
+        view = memoryview(data)
+        await self.send(lambda sent, size: conn.send(view[sent : sent + size]), conn, len(data), buckets)
+
+    async def send_file(self, conn, fd, offset, count, buckets):
+        out_fd = conn.fileno()
+        await self.send(lambda sent, size: os.sendfile(out_fd, fd, offset + sent, size), conn, count, buckets)
+
+    async def send(self, send_chunk, conn, count, buckets):
+        # send_chunk(sent, size) does one non-blocking send, returning the bytes sent
+        sent = 0
+        while sent < count:
+            size = min(count - sent, SEND_CHUNK, *(bucket.capacity for bucket in buckets))
+            try:
+                n_bytes = send_chunk(sent, int(size))
+            except (BlockingIOError, InterruptedError):
+                await self.writable(conn)
+                continue
+            if n_bytes == 0:
+                raise ConnectionError("File truncated while sending")
+            sent += n_bytes
+            delay = max((bucket.consume(n_bytes) for bucket in buckets), default=0)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def writable(self, conn):
+        waiter = self.loop.create_future()
+        fd = conn.fileno()
+
+        def wake():
+            if not waiter.done():
+                waiter.set_result(None)
+
+        self.loop.add_writer(fd, wake)
+        try:
+            await asyncio.wait_for(waiter, self.idle_timeout)
+        except asyncio.TimeoutError:
+            raise IdleTimeout()
+        finally:
+            self.loop.remove_writer(fd)
+
+
 def start_server(httpd_server):
     httpd_server.serve_forever(poll_interval=0.5)
 
 
-def cb_handle_error(request, client_address):
-    # Not important, happens very often but nothing actually fails
-    print(f"Static file server: File request interrupted [client: {client_address}]")
+def make_server(config, directory, index, previews=None, live_dir=None, hls_dir=None, snapshot=None):
+    port = config["maskcam"]["fileserver-port"]
+    workers = config["maskcam"]["fileserver-workers"]
+    if config["maskcam"]["fileserver-mode"] == "asyncio":
+        return AsyncFileServer(
+            ("", port),
+            directory,
+            index,
+            max_connections=config["maskcam"]["fileserver-max-connections"],
+            client_rate=config["maskcam"]["fileserver-client-rate"] * 1000,
+            total_rate=config["maskcam"]["fileserver-total-rate"] * 1000,
+            idle_timeout=config["maskcam"]["fileserver-idle-timeout"],
+            workers=workers,
+            previews=previews,
+            live_dir=live_dir,
+            hls_dir=hls_dir,
+            snapshot=snapshot,
+        )
+    return PooledHTTPServer(
+        ("", port), FileRequestHandler, directory, workers, index, previews, live_dir, hls_dir, snapshot
+    )
 
 
-def main(config, directory=None, e_external_interrupt: mp.Event = None):
+def main(config, directory=None, e_external_interrupt: mp.Event = None, shared_frame=None):
+    configure_logging(config)
     if directory is None:
         directory = config["maskcam"]["fileserver-hdd-dir"]
     directory = os.fspath(directory)
     print(f"Serving static files from directory: [yellow]{directory}[/yellow]")
 
-    port = int(config["maskcam"]["fileserver-port"])
+    port = config["maskcam"]["fileserver-port"]
+    mode = config["maskcam"]["fileserver-mode"]
 
     # Create dir if doesn't exist
-    os.system(f"mkdir -p {directory}")
-    os.chdir(directory)  # easiest way
+    os.makedirs(directory, exist_ok=True)
 
-    # Force download mp4 files
-    Handler.extensions_map[".mp4"] = "application/octet-stream"
+    # Thumbnails and contact sheets, made when each recording is indexed
+    previews = preview_worker = None
+    if config["maskcam"]["preview-enabled"]:
+        previews = PreviewCache(
+            config["maskcam"]["preview-cache-dir"], config["maskcam"]["preview-cache-mb"] * 1000000
+        )
+        preview_worker = PreviewWorker(previews)
+        preview_worker.start()
 
-    print(f"[green]Static server STARTED[/green] at http://{get_ip_address()}:{port}")
-    with ThreadingTCPServer(("", port), Handler) as httpd:
-        httpd.handle_error = cb_handle_error
-        s = threading.Thread(target=start_server, args=(httpd,))
+    # In-memory listing for /api/recordings, kept current with inotify (runs from the catalog)
+    index = RecordingsIndex(
+        directory,
+        config["maskcam"]["catalog-file"].strip() or None,
+        listeners=[preview_worker] if preview_worker is not None else [],
+    )
+    index.start()
+
+    # Recordings in progress, only playable while written if fragmented
+    live_dir = None
+    if config["maskcam"]["recording-fragment-ms"]:
+        live_dir = config["maskcam"]["fileserver-ram-dir"]
+        print(f"Serving recordings in progress from [yellow]{live_dir}[/yellow] at {LIVE_PATH}")
+
+    # HLS stream written by inference, served as is
+    hls_dir = None
+    if config["maskcam"]["hls-enabled"]:
+        hls_dir = config["maskcam"]["hls-dir"]
+        print(f"Serving HLS from [yellow]{hls_dir}[/yellow] at http://{get_ip_address(config)}:{port}{HLS_PATH}")
+
+    # Latest frame from inference, only if launched by the orchestrator
+    snapshot = None
+    if shared_frame is not None:
+        snapshot = SnapshotEncoder(shared_frame, config["maskcam"]["snapshot-cache-ms"] / 1000)
+        print(f"Serving snapshots at http://{get_ip_address(config)}:{port}{SNAPSHOT_PATH}")
+
+    print(f"[green]Static server STARTED[/green] ({mode}) at http://{get_ip_address(config)}:{port}")
+    with make_server(config, directory, index, previews, live_dir, hls_dir, snapshot) as httpd:
+        if mode == "asyncio":
+            s = threading.Thread(target=httpd.serve_forever)
+        else:
+            s = threading.Thread(target=start_server, args=(httpd,))
         s.start()
         try:
             if e_external_interrupt is not None:
@@ -58,13 +1123,15 @@ def main(config, directory=None, e_external_interrupt: mp.Event = None):
             print("Ctrl+C pressed")
         print("Shutting down static file server")
         httpd.shutdown()
-        httpd.server_close()
         s.join(timeout=1)
+        httpd.server_close()
+        index.stop()
+        if preview_worker is not None:
+            preview_worker.stop()
         if s.is_alive():
             print("Server thread did not stop", warning=True)
         else:
             print("Server shut down correctly")
-    print(f"Server alive threads: {threading.enumerate()}")
 
 
 if __name__ == "__main__":
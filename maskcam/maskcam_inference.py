@@ -11,6 +11,7 @@ import platform
 import threading
 import numpy as np
 import multiprocessing as mp
+from queue import Full
 from rich.console import Console
 from datetime import datetime, timezone
 import json
@@ -33,13 +34,15 @@ atexit.register(GPIO.cleanup)
 
 gi.require_version("Gst", "1.0")
 gi.require_version("GstRtspServer", "1.0")
-from gi.repository import GLib, Gst, GstRtspServer
+gi.require_version("GstVideo", "1.0")
+from gi.repository import GLib, Gst, GstRtspServer, GstVideo
 
 from norfair.tracker import Tracker, Detection
 
-from .config import config, print_config_overrides
-from .prints import print_inference as print
+from .config import config, print_config_overrides, ConfigWatcher
+from .prints import print_inference as print, configure_logging
 from .common import (
+    TRANSPORT_SHM,
     CODEC_MP4,
     CODEC_H264,
     CODEC_H265,
@@ -47,15 +50,18 @@ from .common import (
     RASPICAM_PROTOCOL,
     CONFIG_FILE,
 )
-from .utils import glib_cb_restart, load_udp_ports_filesaving
+from .utils import glib_watch_interrupt
+from .metrics import RateMeter, LatencyMeter
+from .snapshot import SnapshotPublisher
+from .outputs import HLS_PLAYLIST, get_transports, get_shm_socket_path, prepare_hls_dir
 
 LABEL_DEFECTIVE = "Defective"
 LABEL_NON_DEFECTIVE = "Non-Defective"
 LABEL_GRASS = "grass"
-FRAMES_LOG_INTERVAL = int(config["maskcam"]["inference-log-interval"])
-SMALL_GRASS_DETECTOR = int(config["grass-detection"]["small-grass-detection"])
+SHM_DROPS_LOG_INTERVAL = 10  # seconds, between warnings about shared memory output drops
 
 # Global vars
+frames_log_interval = None
 frame_number = 0
 start_time = None
 end_time = None
@@ -66,7 +72,8 @@ class RailTrackProcessor:
     def __init__(
         self, th_detection=0, th_vote=0, min_track_size=0, tracker_period=1,
         disable_tracker=False, grass_detector=1, small_grass_detector = 0,
-        enable_light = 1, grass_frame_threshold=100
+        enable_light = 1, grass_frame_threshold=100, grass_area_fraction=0.30,
+        grass_min_contour_area=1000, light_min_duty_cycle=60
     ):
         self.track_votes = {}
         self.current_tracks = set()
@@ -77,11 +84,14 @@ class RailTrackProcessor:
         self.grass_consecutive_frames = 0
         self.grass_detected_previously = False
         self.grass_frame_threshold = grass_frame_threshold
+        self.grass_area_fraction = grass_area_fraction
+        self.grass_min_contour_area = grass_min_contour_area
         # To store if grass was detected in the current frame by OpenCV
         self.grass_detected_in_current_frame = False
         self.grass_detection = grass_detector
         self.small_grass_detection_enabled = small_grass_detector
         self.enable_light = enable_light
+        self.light_min_duty_cycle = light_min_duty_cycle
         # New list to store grass detection times
 
         self.th_detection = th_detection
@@ -112,6 +122,21 @@ class RailTrackProcessor:
                 hit_inertia_max=45,
             )
 
+    def update_config(self, config):
+        # Apply hot-reloadable thresholds (see config.HOT_RELOAD_PARAMS)
+        self.th_detection = config["track-processor"]["detection-threshold"]
+        self.th_vote = config["track-processor"]["voting-threshold"]
+        self.min_track_size = config["track-processor"]["min-track-size"]
+        self.grass_detection = config["grass-detection"]["grass-detection"]
+        self.small_grass_detection_enabled = config["grass-detection"]["small-grass-detection"]
+        self.grass_frame_threshold = config["grass-detection"]["frame-threshold"]
+        self.grass_area_fraction = config["grass-detection"]["area-fraction-threshold"]
+        self.grass_min_contour_area = config["grass-detection"]["min-contour-area"]
+        self.enable_light = config["light"]["light-processing"]
+        self.light_min_duty_cycle = config["light"]["min-duty-cycle"]
+        if self.tracker is not None:
+            self.tracker.detection_threshold = self.th_detection
+
     def keypoints_distance(self, detected_pose, tracked_pose):
         detected_points = detected_pose.points
         estimated_pose = tracked_pose.estimate
@@ -174,7 +199,7 @@ class RailTrackProcessor:
         #     label = "Non-Defective" if track_votes > 0 else "Defective"  # Changed to match model output
         # else:
         #     color = self.color_unknown
-        #     if SMALL_GRASS_DETECTOR:
+        #     if self.small_grass_detection_enabled:
         #         label = "Grass"
         #     else:
         #         label = "Not visible"
@@ -222,7 +247,7 @@ class RailTrackProcessor:
 
 
 def cb_add_statistics(cb_args): # this function runs independently on a timer -5 seconds
-    stats_period, stats_queue, track_processor = cb_args
+    stats_period, stats_queue, track_processor, metrics = cb_args
 
     defective_tracks_info = track_processor.get_instant_statistics(
         refresh=True
@@ -241,12 +266,152 @@ def cb_add_statistics(cb_args): # this function runs independently on a timer -5
     # if [] -> dont add to stats_queue
     if newly_reported_defects:
         # It's better to put a list of dictionaries, not a list containing a list of dictionaries
-        stats_queue.put_nowait(newly_reported_defects)    
+        try:
+            stats_queue.put_nowait(newly_reported_defects)
+        except Full:
+            print("Statistics queue is full, dropping report", warning=True)
+            if metrics is not None:
+                metrics.inc("stats_queue_drops")
 
     # Next report timeout
     GLib.timeout_add_seconds(stats_period, cb_add_statistics, cb_args)
 
 
+def cb_config_changed(fd, condition, cb_args):
+    # Called from the GLib loop when the config file directory changes (see ConfigWatcher)
+    config_watcher, track_processor = cb_args
+    if config_watcher.read_changes():
+        track_processor.update_config(config_watcher.config)
+    return True  # Keep watching
+
+
+class OutputBranches:
+    """Enables each output branch only while something consumes it.
+    output_valve (before the OSD): closed when nothing always encodes (file
+      or HLS output) and no port is read, so the OSD, encoder and payloader
+      get no buffers.
+    rtp_valve (before the payloader): closed when no port is read.
+    udp_ports: multiudpsink clients, shm_valves: {port: valve} before each
+      shmsink (see transport-streaming, transport-filesave).
+    consumers: OutputConsumers (see maskcam/outputs.py), read by update()
+      when they signal a change, None to always send to all ports.
+    """
+
+    def __init__(
+        self, output_valve, rtp_valve, encoder, multiudpsink, udp_ports, shm_valves, consumers, always_encode, metrics
+    ):
+        self.output_valve = output_valve
+        self.rtp_valve = rtp_valve
+        self.encoder = encoder
+        self.multiudpsink = multiudpsink
+        self.udp_ports = set(udp_ports)
+        self.shm_valves = shm_valves
+        self.consumers = consumers
+        self.always_encode = always_encode
+        self.metrics = metrics
+        self.ports = set()  # Ports being sent to
+        self.encoding = None
+        self.shm_drops = {port: 0 for port in shm_valves}  # Packets dropped by each shm queue
+        self.shm_drops_logged = 0
+        self.t_drops_logged = 0
+        self.stopped = False
+
+    def update(self):
+        # Called from the GLib loop, returns True to keep watching
+        if self.stopped:
+            return False
+        all_ports = self.udp_ports | set(self.shm_valves)
+        if self.consumers is None:
+            ports = all_ports
+        else:
+            ports = self.consumers.active_ports() & all_ports
+        added = ports - self.ports
+        for port in sorted(added & self.udp_ports):
+            self.multiudpsink.emit("add", "127.0.0.1", port)
+        for port in sorted((self.ports - ports) & self.udp_ports):
+            self.multiudpsink.emit("remove", "127.0.0.1", port)
+        for port, valve in self.shm_valves.items():
+            valve.set_property("drop", port not in ports)
+        self.rtp_valve.set_property("drop", not ports)
+
+        encoding = self.always_encode or bool(ports)
+        if encoding != self.encoding:
+            self.output_valve.set_property("drop", not encoding)
+            state = "[green]enabled[/green]" if encoding else "[yellow]disabled (no consumers)[/yellow]"
+            print(f"Output OSD and encoder {state}")
+        if added and self.encoding is not None:
+            self.request_keyframe()
+        if ports != self.ports:
+            print(f"Sending video to ports: {', '.join(map(str, sorted(ports))) or 'none'}")
+        self.ports = set(ports)
+        self.encoding = encoding
+        self.check_drops()
+
+        if self.metrics is not None:
+            self.metrics.set("output_encoding", int(encoding))
+            self.metrics.set("output_ports", len(ports))
+        return True
+
+    def open_for_eos(self):
+        # A closed valve drops the EOS too: open them all for the pipeline to
+        # end, and stop following the consumers
+        self.stopped = True
+        self.output_valve.set_property("drop", False)
+        self.rtp_valve.set_property("drop", False)
+        for valve in self.shm_valves.values():
+            valve.set_property("drop", False)
+
+    def request_keyframe(self):
+        # New consumers can't decode until the next IDR frame (carries SPS/PPS, see insert-sps-pps)
+        event = GstVideo.video_event_new_upstream_force_key_unit(Gst.CLOCK_TIME_NONE, True, 0)
+        self.encoder.get_static_pad("src").send_event(event)
+
+    def cb_consumers_changed(self, fd, condition):
+        # Changes signalled by the streaming process or the orchestrator
+        self.consumers.clear_changed()
+        return self.update()
+
+    def cb_shm_overrun(self, queue, port):
+        # Streaming thread: the shm queue is full (slow reader) and leaks its oldest packet
+        self.shm_drops[port] += 1
+        self.check_drops()  # Rate limited, no timer needed to report them
+
+    def check_drops(self):
+        total = sum(self.shm_drops.values())
+        if self.metrics is not None:
+            self.metrics.set("shm_drops", total)
+        now = time.monotonic()
+        if total > self.shm_drops_logged and now - self.t_drops_logged >= SHM_DROPS_LOG_INTERVAL:
+            drops = ", ".join(f"{port}: {count}" for port, count in sorted(self.shm_drops.items()) if count)
+            print(f"Shared memory outputs dropped {total - self.shm_drops_logged} packets (total {drops})", warning=True)
+            self.shm_drops_logged = total
+            self.t_drops_logged = now
+
+
+def cb_bus_message(bus, message, g_loop):
+    t = message.type
+    if t == Gst.MessageType.EOS:
+        print("End-of-stream\n")
+        g_loop.quit()
+    elif t == Gst.MessageType.WARNING:
+        err, debug = message.parse_warning()
+        print(f"{err}: {debug}", warning=True)
+    elif t == Gst.MessageType.ERROR:
+        err, debug = message.parse_error()
+        print(f"{err}: {debug}", error=True)
+        show_troubleshooting()
+        g_loop.quit()
+    return True
+
+
+def cb_interrupt(eos_elements, output_branches):
+    # Send EOS to container to generate a valid mp4 file
+    print("Interruption received. Sending EOS to the pipeline")
+    output_branches.open_for_eos()
+    for element in eos_elements:
+        element.send_event(Gst.Event.new_eos())
+
+
 def sigint_handler(sig, frame):
     # This function is not used if e_external_interrupt is provided
     print("[red]Ctrl+C pressed. Collecting statistics before exit...[/red]")
@@ -263,8 +428,7 @@ def is_aarch64():
 
 
 def draw_detection(display_meta, n_draw, box_points, detection_label, color):
-    # print(f"Drawing {n_draw} | {detection_label}")
-    # print(box_points)
+    print("Drawing", fields={"n": n_draw, "label": detection_label, "box": box_points}, debug=True)
     rect = display_meta.rect_params[n_draw]
 
     ((x1, y1), (x2, y2)) = box_points
@@ -306,7 +470,8 @@ def cb_buffer_probe(pad, info, cb_args):
     global frame_number
     global start_time
 
-    track_processor, e_ready, grass_stats_queue_local = cb_args # Unpack grass_stats_queue
+    track_processor, e_ready, grass_stats_queue_local, frame_meter, latency_meter = cb_args
+    t_probe_start = time.perf_counter()
     gst_buffer = info.get_buffer()
     if not gst_buffer:
         print("Unable to get GstBuffer", error=True)
@@ -378,15 +543,17 @@ def cb_buffer_probe(pad, info, cb_args):
             pyds.nvds_remove_obj_meta_from_frame(frame_meta, obj_meta)
         obj_meta_list = None
 
-        # ------------------ Light Intensity Processing ------------------
-        if not track_processor.enable_light:
-            pass
-        else:
+        # Frame copy, only needed by light and grass processing
+        if track_processor.enable_light or track_processor.grass_detection:
             n_frame = pyds.get_nvds_buf_surface(hash(gst_buffer), frame_meta.batch_id)
-            
+
             # Convert to BGR for OpenCV processing
             frame = np.array(n_frame, copy=True, order='C')
 
+        # ------------------ Light Intensity Processing ------------------
+        if not track_processor.enable_light:
+            pass
+        else:
             # Convert to grayscale
             gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
 
@@ -394,7 +561,7 @@ def cb_buffer_probe(pad, info, cb_args):
             mean_value = np.mean(gray_frame)
             x = max(0, min(100, (mean_value / 255) * 100))
             x = 100 - x
-            if x < 60:
+            if x < track_processor.light_min_duty_cycle:
                 x = 0
 
             # x=0 -> no light
@@ -437,13 +604,13 @@ def cb_buffer_probe(pad, info, cb_args):
 
             grass_detections_opencv = []
             total_grass_area_current_frame = 0
-            TOTAL_GRASS_AREA_THRESHOLD = 0.30 * total_frame_pixels
+            TOTAL_GRASS_AREA_THRESHOLD = track_processor.grass_area_fraction * total_frame_pixels
 
             # if grasses of small shape with bbox is needed
             if track_processor.small_grass_detection_enabled:
                 for contour in contours:
                     area = cv2.contourArea(contour)
-                    if area > 1000:
+                    if area > track_processor.grass_min_contour_area:
                         total_grass_area_current_frame += area
 
                         x, y, w, h = cv2.boundingRect(contour)
@@ -461,7 +628,7 @@ def cb_buffer_probe(pad, info, cb_args):
             else:
                 for contour in contours:
                     area = cv2.contourArea(contour)
-                    if area > 1000:
+                    if area > track_processor.grass_min_contour_area:
                         total_grass_area_current_frame += area
                     # Now, check the total aggregated grass area for the current frame
                     if total_grass_area_current_frame > TOTAL_GRASS_AREA_THRESHOLD:
@@ -486,7 +653,7 @@ def cb_buffer_probe(pad, info, cb_args):
 
             if track_processor.grass_consecutive_frames >= track_processor.grass_frame_threshold:
                 grass_founded_time = datetime.now()
-                print(f"Grass Detected! at {grass_founded_time}")
+                print("Grass Detected!", fields={"time": grass_founded_time})
                 track_processor.grass_detected_previously = True
                 track_processor.grass_consecutive_frames = track_processor.grass_frame_threshold # cap at threshold
                 
@@ -499,13 +666,15 @@ def cb_buffer_probe(pad, info, cb_args):
                     try:
                         grass_stats_queue_local.put_nowait(grass_event_data)
                     except Exception as e:
-                        print(f"Error putting grass event to queue: {e}", error=True)
+                        print(f"Error putting grass event to queue: {e}", error=True, every=10)
+                        if frame_meter is not None:
+                            frame_meter.metrics.inc("grass_queue_drops")
             
             # Check if grass is no longer detected (after being previously detected)
                 elif track_processor.grass_consecutive_frames <= -(track_processor.grass_frame_threshold) and track_processor.grass_detected_previously:
                  # Condition to reset: if count drops significantly below threshold or to 0 after being positive
                     grass_missed_time = datetime.now()
-                    print(f"Grass presence dropped below threshold at {grass_missed_time}")
+                    print("Grass presence dropped below threshold", fields={"time": grass_missed_time})
                     track_processor.grass_detected_previously = False
                     # track_processor.grass_consecutive_frames = 0 # Reset counter
 
@@ -517,7 +686,9 @@ def cb_buffer_probe(pad, info, cb_args):
                         try:
                             grass_stats_queue_local.put_nowait(grass_event_data)
                         except Exception as e:
-                            print(f"Error putting grass event to queue: {e}", error=True)
+                            print(f"Error putting grass event to queue: {e}", error=True, every=10)
+                            if frame_meter is not None:
+                                frame_meter.metrics.inc("grass_queue_drops")
 
         # Each meta object carries max 16 rects/labels/etc.
         max_drawings_per_meta = 16  # This is hardcoded, not documented
@@ -590,8 +761,11 @@ def cb_buffer_probe(pad, info, cb_args):
 
 
 
-        if not frame_number % FRAMES_LOG_INTERVAL:
-            print(f"Processed {frame_number} frames...")
+        if not frame_number % frames_log_interval:
+            print("Processed frames", fields={"frames": frame_number})
+
+        if frame_meter is not None:
+            frame_meter.tick()
 
         try:
             l_frame = l_frame.next
@@ -600,6 +774,18 @@ def cb_buffer_probe(pad, info, cb_args):
     # Start timer at the end of first frame processing
     if start_time is None:
         start_time = time.time()
+    if latency_meter is not None:
+        latency_meter.add(time.perf_counter() - t_probe_start)
+    return Gst.PadProbeReturn.OK
+
+
+def cb_snapshot_probe(pad, info, cb_args):
+    # Publishes a downscaled frame for /snapshot.jpg, only while requested (see maskcam/snapshot.py)
+    publisher, overlay = cb_args
+    if publisher.due(overlay):
+        gst_buffer = info.get_buffer()
+        if gst_buffer:
+            publisher.publish(pyds.get_nvds_buf_surface(hash(gst_buffer), 0))  # batch-size=1
     return Gst.PadProbeReturn.OK
 
 
@@ -720,24 +906,31 @@ def main(
     stats_queue: mp.Queue = None,
     grass_stats_queue: mp.Queue = None, # Add grass_stats_queue parameter
     e_ready: mp.Event = None,
+    metrics=None,
+    consumers=None,
+    shared_frame=None,
 ):
     global frame_number
     global start_time
     global end_time
     global e_interrupt
+    global frames_log_interval
+    configure_logging(config)
 
-    # Load all udp ports to output video
-    udp_ports = {int(config["maskcam"]["udp-port-streaming"])}
-    load_udp_ports_filesaving(config, udp_ports)
+    # Output ports (consumers) by transport: loopback UDP or shared memory
+    transports = get_transports(config)
+    shm_ports = sorted(port for port, transport in transports.items() if transport == TRANSPORT_SHM)
+    udp_ports = set(transports) - set(shm_ports)
 
     codec = config["maskcam"]["codec"]
-    stats_period = int(config["maskcam"]["statistics-period"]) #15 sec
+    stats_period = config["maskcam"]["statistics-period"] #15 sec
+    frames_log_interval = config["maskcam"]["inference-log-interval"]
 
 
     # Original: 1920x1080, bdti_resized: 1024x576, yolo-input: 1024x608
     # Nice for h264@1024x576: 4000000
-    output_width = int(config["maskcam"]["output-video-width"])
-    output_height = int(config["maskcam"]["output-video-height"])
+    output_width = config["maskcam"]["output-video-width"]
+    output_height = config["maskcam"]["output-video-height"]
     output_bitrate = 1000000 # 1Mbps
 
     # Two types of camera supported: USB or Raspi
@@ -745,38 +938,33 @@ def main(
     raspicam_input = RASPICAM_PROTOCOL in input_filename
     camera_input = usbcam_input or raspicam_input
     if camera_input:
-        camera_framerate = int(config["maskcam"]["camera-framerate"])
-        camera_flip_method = int(config["maskcam"]["camera-flip-method"])
+        camera_framerate = config["maskcam"]["camera-framerate"]
+        camera_flip_method = config["maskcam"]["camera-flip-method"]
 
     # Set nvinfer.interval (number of frames to skip inference and use tracker instead)
-    if camera_input and int(config["maskcam"]["inference-interval-auto"]):
-        max_fps = int(config["maskcam"]["inference-max-fps"])
+    if camera_input and config["maskcam"]["inference-interval-auto"]:
+        max_fps = config["maskcam"]["inference-max-fps"]
         skip_inference = camera_framerate // max_fps
         print(f"Auto calculated frames to skip inference: {skip_inference}")
     else:
-        skip_inference = int(config["property"]["interval"])
+        skip_inference = config["property"]["interval"]
         print(f"Configured frames to skip inference: {skip_inference}")
 
     # RailTrack initialization
     track_tracker_period = skip_inference + 1  # tracker_period=skipped + inference frame(1)
-    track_detection_threshold = float(config["track-processor"]["detection-threshold"])
-    track_voting_threshold = float(config["track-processor"]["voting-threshold"])
-    track_min_track_size = int(config["track-processor"]["min-track-size"])
-    track_disable_tracker = int(config["track-processor"]["disable-tracker"])
-    small_grass_detector = int(config["grass-detection"]["small-grass-detection"])
-    grass_detector = int(config["grass-detection"]["grass-detection"])
-    grass_frame_threshold = int(config["grass-detection"]["frame-threshold"])
-    enable_light = int(config["light"]["light-processing"])
     track_processor = RailTrackProcessor(
-        th_detection=track_detection_threshold,
-        th_vote=track_voting_threshold,
-        min_track_size=track_min_track_size,
+        th_detection=config["track-processor"]["detection-threshold"],
+        th_vote=config["track-processor"]["voting-threshold"],
+        min_track_size=config["track-processor"]["min-track-size"],
         tracker_period=track_tracker_period,
-        disable_tracker=track_disable_tracker,
-        grass_detector=grass_detector,
-        small_grass_detector=small_grass_detector,
-        enable_light = enable_light,
-        grass_frame_threshold = grass_frame_threshold
+        disable_tracker=config["track-processor"]["disable-tracker"],
+        grass_detector=config["grass-detection"]["grass-detection"],
+        small_grass_detector=config["grass-detection"]["small-grass-detection"],
+        enable_light=config["light"]["light-processing"],
+        grass_frame_threshold=config["grass-detection"]["frame-threshold"],
+        grass_area_fraction=config["grass-detection"]["area-fraction-threshold"],
+        grass_min_contour_area=config["grass-detection"]["min-contour-area"],
+        light_min_duty_cycle=config["light"]["min-duty-cycle"],
     )
 
     # Standard GStreamer initialization
@@ -857,6 +1045,9 @@ def main(
     nvosd.set_property("display-clock", False)
     nvosd.set_property("display-text", True)  # Needed for any text
 
+    # Drops frames after analytics when nobody consumes the output (see OutputBranches)
+    output_valve = make_elm_or_print_err("valve", "output_valve", "Output valve")
+
     # Finally encode and save the osd output
     queue = make_elm_or_print_err("queue", "queue", "Queue")
     convert_post_osd = make_elm_or_print_err(
@@ -899,25 +1090,63 @@ def main(
 
     # UDP streaming
     queue_udp = make_elm_or_print_err("queue", "queue_udp", "UDP queue")
+    rtp_valve = make_elm_or_print_err("valve", "rtp_valve", "RTP valve")
+    splitter_rtp = make_elm_or_print_err("tee", "tee_rtp", "Splitter UDP/shared memory")
     multiudpsink = make_elm_or_print_err("multiudpsink", "multi udpsink", "Multi UDP Sink")
     # udpsink.set_property("host", "127.0.0.1")
     # udpsink.set_property("port", udp_port)
 
-    # Comma separated list of clients, don't add spaces :S
-    client_list = [f"127.0.0.1:{udp_port}" for udp_port in udp_ports]
-    multiudpsink.set_property("clients", ",".join(client_list))
-
+    # Clients (udp_ports being read) are added and removed by OutputBranches
     multiudpsink.set_property("async", False)
     multiudpsink.set_property("sync", True)
 
+    # Shared memory outputs: a bounded queue, leaking the oldest packets when
+    # the reader is slow (shmsink blocks while its area is full)
+    shm_branches = {}
+    for port in shm_ports:
+        socket_path = get_shm_socket_path(config, port)
+        os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+        queue_shm = make_elm_or_print_err("queue", f"queue_shm_{port}", f"Shared memory queue {port}")
+        queue_shm.set_property("leaky", 2)  # Downstream: drop the oldest
+        queue_shm.set_property("max-size-buffers", config["maskcam"]["shm-queue-packets"])
+        queue_shm.set_property("max-size-bytes", 0)
+        queue_shm.set_property("max-size-time", 0)
+        valve_shm = make_elm_or_print_err("valve", f"valve_shm_{port}", f"Shared memory valve {port}")
+        shmsink = make_elm_or_print_err("shmsink", f"shmsink_{port}", f"Shared memory sink {port}")
+        shmsink.set_property("socket-path", socket_path)
+        shmsink.set_property("shm-size", config["maskcam"]["shm-size-kb"] * 1024)
+        shmsink.set_property("wait-for-connection", False)
+        shmsink.set_property("async", False)
+        shmsink.set_property("sync", True)
+        shm_branches[port] = (queue_shm, valve_shm, shmsink)
+
     if output_filename is not None:
         queue_file = make_elm_or_print_err("queue", "queue_file", "File save queue")
         # codeparser already created above depending on codec
         container = make_elm_or_print_err("qtmux", "qtmux", "Container")
+        if config["maskcam"]["recording-fragment-ms"]:  # Fragmented MP4, see maskcam_filesave
+            container.set_property("fragment-duration", config["maskcam"]["recording-fragment-ms"])
         filesink = make_elm_or_print_err("filesink", "filesink", "File Sink")
         filesink.set_property("location", output_filename)
     else:  # Fake sink, no save
         fakesink = make_elm_or_print_err("fakesink", "fakesink", "Fake Sink")
+        fakesink.set_property("async", False)  # Gets no buffers while the output is disabled
+
+    # HLS for browsers, from the same encoded stream (segments and playlist in RAM)
+    hls_enabled = config["maskcam"]["hls-enabled"]
+    if hls_enabled:
+        hls_dir = config["maskcam"]["hls-dir"]
+        queue_hls = make_elm_or_print_err("queue", "queue_hls", "HLS queue")
+        queue_hls.set_property("leaky", 2)  # Never stall the other outputs
+        hls_parser = make_elm_or_print_err(codeparser.get_factory().get_name(), "hls-parser", "HLS Code Parser")
+        hlssink = make_elm_or_print_err("hlssink2", "hlssink", "HLS Sink")
+        hlssink.set_property("location", prepare_hls_dir(hls_dir))
+        hlssink.set_property("playlist-location", os.path.join(hls_dir, HLS_PLAYLIST))
+        hlssink.set_property("target-duration", config["maskcam"]["hls-segment-seconds"])
+        hlssink.set_property("playlist-length", config["maskcam"]["hls-playlist-length"])
+        # Older segments are deleted, keep a few more than listed for slow clients
+        hlssink.set_property("max-files", config["maskcam"]["hls-playlist-length"] + 2)
+        print(f"HLS output to: [green]{hls_dir}[/green]")
 
     # Add elements to the pipeline
     if camera_input:
@@ -932,6 +1161,7 @@ def main(
     pipeline.add(pgie)
 
     pipeline.add(convert_pre_osd)
+    pipeline.add(output_valve)
     pipeline.add(nvosd)
     pipeline.add(queue)
     pipeline.add(convert_post_osd)
@@ -947,10 +1177,20 @@ def main(
     else:
         pipeline.add(fakesink)
 
+    if hls_enabled:
+        pipeline.add(queue_hls)
+        pipeline.add(hls_parser)
+        pipeline.add(hlssink)
+
     # Output to UDP
     pipeline.add(queue_udp)
+    pipeline.add(rtp_valve)
     pipeline.add(rtppay)
+    pipeline.add(splitter_rtp)
     pipeline.add(multiudpsink)
+    for elements in shm_branches.values():
+        for element in elements:
+            pipeline.add(element)
 
     print("Linking elements in the Pipeline \n")
 
@@ -969,7 +1209,8 @@ def main(
     srcpad.link(sinkpad)
     streammux.link(pgie)
     pgie.link(convert_pre_osd)
-    convert_pre_osd.link(nvosd)
+    convert_pre_osd.link(output_valve)
+    output_valve.link(nvosd)
     nvosd.link(queue)
     queue.link(convert_post_osd)
     convert_post_osd.link(capsfilter)
@@ -989,27 +1230,70 @@ def main(
     else:
         tee_file.link(fakesink.get_static_pad("sink"))
 
+    # Output to HLS (hlssink2 muxes into MPEG-TS segments, split at keyframes)
+    if hls_enabled:
+        splitter_file_udp.get_request_pad("src_%u").link(queue_hls.get_static_pad("sink"))
+        queue_hls.link(hls_parser)
+        hls_parser.link(hlssink)
+
     # Output to UDP
     tee_udp.link(queue_udp.get_static_pad("sink"))
-    queue_udp.link(rtppay)
-    rtppay.link(multiudpsink)
+    queue_udp.link(rtp_valve)
+    rtp_valve.link(rtppay)
+    rtppay.link(splitter_rtp)
+    splitter_rtp.get_request_pad("src_%u").link(multiudpsink.get_static_pad("sink"))
+    for queue_shm, valve_shm, shmsink in shm_branches.values():
+        splitter_rtp.get_request_pad("src_%u").link(queue_shm.get_static_pad("sink"))
+        queue_shm.link(valve_shm)
+        valve_shm.link(shmsink)
 
     # Lets add probe to get informed of the meta data generated, we add probe to
-    # the sink pad of the osd element, since by that time, the buffer would have
-    # had got all the metadata.
-    osdsinkpad = nvosd.get_static_pad("sink")
+    # the sink pad of the output valve (RGBA, right before the osd), since by that
+    # time the buffer would have had got all the metadata. Before the valve, so
+    # analytics run even when the output is disabled.
+    osdsinkpad = output_valve.get_static_pad("sink")
     if not osdsinkpad:
-        print("Unable to get sink pad of nvosd", error=True)
+        print("Unable to get sink pad of the output valve", error=True)
+
+    # Shared metrics (see maskcam/metrics.py), only if launched by the orchestrator
+    frame_meter = None
+    latency_meter = None
+    if metrics is not None:
+        frame_meter = RateMeter(metrics, "frames", "fps")
+        latency_meter = LatencyMeter(metrics, "probe_latency")
 
-    cb_args = (track_processor, e_ready, grass_stats_queue) # Pass grass_stats_queue to cb_args
+    cb_args = (track_processor, e_ready, grass_stats_queue, frame_meter, latency_meter)
     osdsinkpad.add_probe(Gst.PadProbeType.BUFFER, cb_buffer_probe, cb_args)
 
+    # Snapshots: RGBA frames with the overlay after the osd, or before it while the output is disabled
+    if shared_frame is not None:
+        publisher = SnapshotPublisher(shared_frame, config["maskcam"]["snapshot-max-fps"])
+        nvosd.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, cb_snapshot_probe, (publisher, True))
+        osdsinkpad.add_probe(Gst.PadProbeType.BUFFER, cb_snapshot_probe, (publisher, False))
+
+    # Output valves and UDP clients, set before playing
+    output_branches = OutputBranches(
+        output_valve,
+        rtp_valve,
+        encoder,
+        multiudpsink,
+        udp_ports,
+        {port: valve_shm for port, (_, valve_shm, _) in shm_branches.items()},
+        consumers,
+        always_encode=output_filename is not None or hls_enabled,
+        metrics=metrics,
+    )
+    for port, (queue_shm, _, _) in shm_branches.items():
+        queue_shm.connect("overrun", output_branches.cb_shm_overrun, port)
+    output_branches.update()
+
     # GLib loop required for RTSP server
     g_loop = GLib.MainLoop()
-    g_context = g_loop.get_context()
 
     # GStreamer message bus
     bus = pipeline.get_bus()
+    bus.add_signal_watch()
+    bus.connect("message", cb_bus_message, g_loop)
 
     if e_external_interrupt is None:
         # Use threading instead of mp.Event() for sigint_handler, see:
@@ -1018,8 +1302,9 @@ def main(
         signal.signal(signal.SIGINT, sigint_handler)
         print("[green bold]Press Ctrl+C to stop pipeline[/green bold]")
     else:
-        # If there's an external interrupt, don't capture SIGINT
+        # If there's an external interrupt, let the orchestrator handle SIGINT
         e_interrupt = e_external_interrupt
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
 
     # start play back and listen to events
     pipeline.set_state(Gst.State.PLAYING)
@@ -1030,44 +1315,47 @@ def main(
 
         # Timer to add statistics to queue
         if stats_queue is not None:
-            cb_args = stats_period, stats_queue, track_processor
+            cb_args = stats_period, stats_queue, track_processor, metrics
             GLib.timeout_add_seconds(stats_period, cb_add_statistics, cb_args)
 
-        # Periodic gloop interrupt (see utils.glib_cb_restart)
-        t_check = 100
-        GLib.timeout_add(t_check, glib_cb_restart, t_check)
-
-        # Custom event loop
-        running = True
-        while running:
-            g_context.iteration(may_block=True)
-
-            message = bus.pop()
-            if message is not None:
-                t = message.type
-
-                if t == Gst.MessageType.EOS:
-                    print("End-of-stream\n")
-                    running = False
-                elif t == Gst.MessageType.WARNING:
-                    err, debug = message.parse_warning()
-                    print(f"{err}: {debug}", warning=True)
-                elif t == Gst.MessageType.ERROR:
-                    err, debug = message.parse_error()
-                    print(f"{err}: {debug}", error=True)
-                    show_troubleshooting()
-                    running = False
-            if e_interrupt.is_set():
-                # Send EOS to container to generate a valid mp4 file
-                if output_filename is not None:
-                    container.send_event(Gst.Event.new_eos())
-                    multiudpsink.send_event(Gst.Event.new_eos())
-                else:
-                    pipeline.send_event(Gst.Event.new_eos())  # fakesink EOS won't work
+        # Follow RTSP clients and file-save segments (see maskcam/outputs.py), woken up by changes only
+        if consumers is not None:
+            GLib.io_add_watch(
+                consumers.fileno(), GLib.PRIORITY_DEFAULT, GLib.IOCondition.IN, output_branches.cb_consumers_changed
+            )
+
+        # Apply threshold changes in the config file without restarting
+        config_watcher = None
+        if config["maskcam"]["config-watch"]:
+            config_watcher = ConfigWatcher(config)
+            GLib.io_add_watch(
+                config_watcher.fileno(),
+                GLib.PRIORITY_DEFAULT,
+                GLib.IOCondition.IN,
+                cb_config_changed,
+                (config_watcher, track_processor),
+            )
+
+        # Send EOS on interrupt (see utils.glib_watch_interrupt)
+        if output_filename is not None:
+            # Also the branches that don't go through the container (pushed downstream by the element)
+            eos_elements = [container, multiudpsink]
+            eos_elements += [valve_shm for _, valve_shm, _ in shm_branches.values()]
+            if hls_enabled:
+                eos_elements.append(queue_hls)
+        else:
+            eos_elements = [pipeline]  # fakesink EOS won't work
+        close_interrupt_watch = glib_watch_interrupt(e_interrupt, cb_interrupt, eos_elements, output_branches)
+
+        # Sleeps until a bus message, timer, config change or the interrupt arrives
+        g_loop.run()
+        close_interrupt_watch()
 
         end_time = time.time()
         print("Inference main loop ending.")
         pipeline.set_state(Gst.State.NULL)
+        if config_watcher is not None:
+            config_watcher.close()
 
         # Profiling display
         if start_time is not None and end_time is not None:
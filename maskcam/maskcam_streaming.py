@@ -15,9 +15,10 @@ gi.require_version("GstRtspServer", "1.0")
 from gi.repository import GLib, Gst, GstRtspServer
 
 from .config import config, print_config_overrides
-from .prints import print_streaming as print
-from .utils import get_ip_address, glib_cb_restart, get_streaming_address
+from .prints import print_streaming as print, configure_logging
+from .utils import get_ip_address, glib_watch_interrupt, get_streaming_address
 from .common import CODEC_MP4, CODEC_H264, CODEC_H265, CONFIG_FILE
+from .outputs import is_shm, get_shm_socket_path
 
 e_interrupt = None
 
@@ -28,14 +29,29 @@ def sigint_handler(sig, frame):
     e_interrupt.set()
 
 
-def main(config, e_external_interrupt: mp.Event = None):
+def cb_client_connected(server, client, cb_args):
+    # RTSP client attached: the inference process starts sending to udp_port
+    consumers, udp_port = cb_args
+    consumers.add(udp_port)
+    print(f"RTSP client connected ({consumers.get(udp_port)} attached)")
+    client.connect("closed", cb_client_closed, cb_args)
+
+
+def cb_client_closed(client, cb_args):
+    consumers, udp_port = cb_args
+    consumers.add(udp_port, -1)
+    print(f"RTSP client closed ({consumers.get(udp_port)} attached)")
+
+
+def main(config, e_external_interrupt: mp.Event = None, consumers=None):
     global e_interrupt
-    udp_port = int(config["maskcam"]["udp-port-streaming"])
+    configure_logging(config)
+    udp_port = config["maskcam"]["udp-port-streaming"]
     codec = config["maskcam"]["codec"]
     # Streaming address: rtsp://<jetson-ip>:<rtsp-port>/<rtsp-address>
-    rtsp_port = int(config["maskcam"]["streaming-port"])
+    rtsp_port = config["maskcam"]["streaming-port"]
     rtsp_address = config["maskcam"]["streaming-path"]
-    streaming_clock_rate = int(config["maskcam"]["streaming-clock-rate"])
+    streaming_clock_rate = config["maskcam"]["streaming-clock-rate"]
 
     # udp_capabilities = f"application/x-rtp,media=video,encoding-name={codec},payload=96"
 
@@ -49,21 +65,33 @@ def main(config, e_external_interrupt: mp.Event = None):
     server.props.service = str(rtsp_port)
     server.attach(None)
 
+    # Count the RTSP clients, so inference only streams while they're attached
+    if consumers is not None:
+        consumers.set(udp_port, 0)
+        server.connect("client-connected", cb_client_connected, (consumers, udp_port))
+
     factory = GstRtspServer.RTSPMediaFactory.new()
-    factory.set_launch(
-        f"( udpsrc name=pay0 port={udp_port} buffer-size=524288"
-        f' caps="application/x-rtp, media=video, clock-rate={streaming_clock_rate},'
-        f' encoding-name=(string){codec}, payload=96 " )'
+    rtp_caps = (
+        f"application/x-rtp, media=video, clock-rate={streaming_clock_rate},"
+        f" encoding-name=(string){codec}, payload=96 "
     )
+    if is_shm(config, udp_port):
+        # Same RTP packets, from the inference shmsink (see transport-streaming)
+        print("Transport from inference: [green]shared memory[/green]")
+        factory.set_launch(
+            f"( shmsrc socket-path={get_shm_socket_path(config, udp_port)} is-live=true do-timestamp=true"
+            f' ! capsfilter name=pay0 caps="{rtp_caps}" )'
+        )
+    else:
+        factory.set_launch(f'( udpsrc name=pay0 port={udp_port} buffer-size=524288 caps="{rtp_caps}" )')
     factory.set_shared(True)
     server.get_mount_points().add_factory(rtsp_address, factory)
 
-    streaming_address = get_streaming_address(get_ip_address(), rtsp_port, rtsp_address)
+    streaming_address = get_streaming_address(get_ip_address(config), rtsp_port, rtsp_address)
     print(f"\n\n[green bold]Streaming[/green bold] at {streaming_address}\n\n")
 
     # GLib loop required for RTSP server
     g_loop = GLib.MainLoop()
-    g_context = g_loop.get_context()
 
     if e_external_interrupt is None:
         # Use threading instead of mp.Event() for sigint_handler, see:
@@ -72,16 +100,17 @@ def main(config, e_external_interrupt: mp.Event = None):
         signal.signal(signal.SIGINT, sigint_handler)
         print("[green bold]Press Ctrl+C to stop pipeline[/green bold]")
     else:
-        # If there's an external interrupt, don't capture SIGINT
+        # If there's an external interrupt, let the orchestrator handle SIGINT
         e_interrupt = e_external_interrupt
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
 
-    # Periodic gloop interrupt (see utils.glib_cb_restart)
-    t_check = 100
-    GLib.timeout_add(t_check, glib_cb_restart, t_check)
-
-    while not e_interrupt.is_set():
-        g_context.iteration(may_block=True)
+    # Sleeps serving RTSP clients until interrupted (see utils.glib_watch_interrupt)
+    close_interrupt_watch = glib_watch_interrupt(e_interrupt, g_loop.quit)
+    g_loop.run()
+    close_interrupt_watch()
 
+    if consumers is not None:
+        consumers.set(udp_port, 0)
     print("Ending streaming")
 
 
@@ -0,0 +1,237 @@
+import json
+import time
+import threading
+import multiprocessing as mp
+from collections import deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import numpy as np
+
+from .prints import print_run as print
+
+# Fields published by each child process into its shared metrics block
+INFERENCE_METRICS = (
+    "frames",
+    "fps",
+    "probe_latency_p50",
+    "probe_latency_p90",
+    "probe_latency_p99",
+    "stats_queue_drops",
+    "grass_queue_drops",
+    "output_encoding",
+    "output_ports",
+    "shm_drops",
+)
+SERIAL_METRICS = (
+    "lines",
+    "lines_per_second",
+)
+# Rates and quantiles: only published while events arrive, read as 0 once
+# they stop (e.g. no frames), without any timer in the writer process
+INFERENCE_EXPIRING = ("fps", "probe_latency_p50", "probe_latency_p90", "probe_latency_p99")
+SERIAL_EXPIRING = ("lines_per_second",)
+
+# Update derived values (fps, quantiles) at most once per this period
+METRICS_UPDATE_PERIOD = 1.0  # seconds
+EXPIRE_AFTER = 2 * METRICS_UPDATE_PERIOD  # Expiring fields not published within this read as 0
+LATENCY_WINDOW_SIZE = 512  # Last probe calls used to compute quantiles
+
+
+class SharedMetrics:
+    """Named float counters in shared memory.
+    Created by the orchestrator and passed to one child process,
+    which is the only writer, so no locks are used on the hot path.
+    The orchestrator reads them only when a status is requested.
+    expiring: fields read as 0 when not set within EXPIRE_AFTER (the
+    monotonic clock is the same for all processes).
+    """
+
+    def __init__(self, fields, expiring=()):
+        self.fields = tuple(fields)
+        self._index = {name: idx for idx, name in enumerate(self.fields)}
+        self._values = mp.RawArray("d", len(self.fields))
+        self._expiring = frozenset(self._index[name] for name in expiring)
+        self._set_times = mp.RawArray("d", len(self.fields))
+
+    def set(self, name, value):
+        idx = self._index[name]
+        self._values[idx] = value
+        if idx in self._expiring:
+            self._set_times[idx] = time.monotonic()
+
+    def inc(self, name, value=1):
+        self._values[self._index[name]] += value
+
+    def get(self, name):
+        return self._values[self._index[name]]
+
+    def snapshot(self):
+        values = self._values[:]
+        if self._expiring:
+            set_times = self._set_times[:]
+            t_now = time.monotonic()
+            for idx in self._expiring:
+                if t_now - set_times[idx] > EXPIRE_AFTER:
+                    values[idx] = 0.0
+        return {name: values[idx] for idx, name in enumerate(self.fields)}
+
+
+class RateMeter:
+    # Counts events and publishes a count + rate into SharedMetrics
+    def __init__(self, metrics, count_field, rate_field):
+        self.metrics = metrics
+        self.count_field = count_field
+        self.rate_field = rate_field
+        self.count = 0
+        self.t_last = time.monotonic()
+        self.t_tick = self.t_last
+        self.count_last = 0
+
+    def tick(self, n=1):
+        t_now = time.monotonic()
+        if n and t_now - self.t_tick >= EXPIRE_AFTER:
+            # First events after a pause (the rate expired meanwhile): restart the period
+            self.t_last = t_now
+            self.count_last = self.count
+        if n:
+            self.t_tick = t_now
+        self.count += n
+        elapsed = t_now - self.t_last
+        if elapsed >= METRICS_UPDATE_PERIOD:
+            self.metrics.set(self.count_field, self.count)
+            self.metrics.set(self.rate_field, (self.count - self.count_last) / elapsed)
+            self.t_last = t_now
+            self.count_last = self.count
+
+
+class LatencyMeter:
+    # Keeps a window of latencies and publishes p50/p90/p99 (in ms)
+    def __init__(self, metrics, field_prefix):
+        self.metrics = metrics
+        self.fields = [f"{field_prefix}_p{q}" for q in (50, 90, 99)]
+        self.window = deque(maxlen=LATENCY_WINDOW_SIZE)
+        self.t_last = time.monotonic()
+        self.t_added = self.t_last
+
+    def add(self, seconds):
+        t_now = time.monotonic()
+        if t_now - self.t_added >= EXPIRE_AFTER:
+            self.window.clear()  # Latencies from before a pause
+        self.window.append(seconds)
+        self.t_added = t_now
+        if t_now - self.t_last >= METRICS_UPDATE_PERIOD:
+            quantiles = np.percentile(self.window, (50, 90, 99)) * 1000
+            for field, value in zip(self.fields, quantiles):
+                self.metrics.set(field, value)
+            self.t_last = t_now
+
+
+def prometheus_name(*parts):
+    return "maskcam_" + "_".join(part.replace("-", "_") for part in parts)
+
+
+def render_prometheus(status):
+    # Flatten status dict (see maskcam_run.get_status) into Prometheus text format
+    lines = []
+
+    def add(name, value, labels=None, help_text=None, metric_type="gauge"):
+        if help_text is not None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+        label_str = ""
+        if labels:
+            label_str = "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+        lines.append(f"{name}{label_str} {float(value)!r}")
+
+    processes = status.get("processes", {})
+    for field, help_text in (
+        ("running", "Process is running (1) or not (0)"),
+        ("uptime_seconds", "Seconds since the process was (re)started"),
+        ("restarts", "Number of times the process was restarted"),
+    ):
+        name = prometheus_name("process", field)
+        for n, (process_name, info) in enumerate(processes.items()):
+            add(
+                name,
+                info[field],
+                labels={"process": process_name},
+                help_text=help_text if n == 0 else None,
+            )
+
+    for group in ("inference", "serial"):
+        for field, value in status.get(group, {}).items():
+            add(prometheus_name(group, field), value, help_text=f"{group} {field}")
+
+    for queue_name, queue_info in status.get("queues", {}).items():
+        for field, value in queue_info.items():
+            add(
+                prometheus_name("queue", field),
+                value,
+                labels={"queue": queue_name},
+            )
+
+    add(
+        prometheus_name("filesave_active_segments"),
+        status.get("filesave", {}).get("active_segments", 0),
+        help_text="File-save segments currently recording",
+    )
+
+    for n, (port, count) in enumerate(status.get("outputs", {}).items()):
+        add(
+            prometheus_name("output_consumers"),
+            count,
+            labels={"port": port},
+            help_text="Consumers reading each output port" if n == 0 else None,
+        )
+
+    for disk_name, disk_info in status.get("disk", {}).items():
+        for field in ("free_bytes", "total_bytes"):
+            add(
+                prometheus_name("disk", field),
+                disk_info[field],
+                labels={"disk": disk_name, "path": disk_info["path"]},
+            )
+    return "\n".join(lines) + "\n"
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path in ("", "/metrics"):
+            content_type = "text/plain; version=0.0.4"
+            body = render_prometheus(self.server.get_status())
+        elif path == "/status":
+            content_type = "application/json"
+            body = json.dumps(self.server.get_status(), indent=2, default=str)
+        else:
+            self.send_error(404)
+            return
+        body = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Don't log every scrape
+
+
+class StatusServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, get_status):
+        super().__init__(address, StatusHandler)
+        self.get_status = get_status
+
+
+def start_status_server(port, get_status):
+    """Serve get_status() on /metrics (Prometheus text) and /status (JSON)
+    from a background thread. Returns the server, call shutdown() to stop it.
+    """
+    server = StatusServer(("127.0.0.1", port), get_status)  # Local only
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    print(f"[green]Status server STARTED[/green] at 127.0.0.1:{port} (/metrics, /status)")
+    return server
@@ -0,0 +1,98 @@
+import os
+import time
+import multiprocessing as mp
+
+from maskcam.common import TRANSPORT_SHM
+
+# Who is reading each UDP output of the inference pipeline, so it only
+# draws, encodes and sends video that somebody consumes.
+# Each port has a single writer: the streaming process for its port (RTSP
+# clients attached) and the orchestrator for the file-save ports (segment
+# being recorded). Each change is signalled through a pipe, watched by the
+# inference GLib loop: it reads the counts right away and sleeps otherwise.
+# Consumers are identified by their UDP port number, also when their
+# transport is shared memory (transport-streaming, transport-filesave).
+
+# HLS output (hls-enabled): written by inference into hls-dir, served by the file server
+HLS_PLAYLIST = "live.m3u8"
+HLS_SEGMENT_EXTENSION = ".ts"
+
+
+def get_transports(config):
+    # {port: transport} of every consumer
+    transports = {config["maskcam"]["udp-port-streaming"]: config["maskcam"]["transport-streaming"]}
+    for port in config["maskcam"]["udp-ports-filesave"]:
+        transports[port] = config["maskcam"]["transport-filesave"]
+    return transports
+
+
+def get_shm_socket_path(config, port):
+    return os.path.join(config["maskcam"]["runtime-dir"], f"video-{port}.sock")
+
+
+def is_shm(config, port):
+    return get_transports(config)[port] == TRANSPORT_SHM
+
+
+def prepare_hls_dir(directory):
+    """Creates the HLS directory, removing the files of previous runs.
+    Returns a segment file name pattern unique to this run, so segments can
+    be cached as immutable: names aren't reused after a restart.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for entry in os.scandir(directory):
+        if entry.name == HLS_PLAYLIST or entry.name.endswith(HLS_SEGMENT_EXTENSION):
+            os.remove(entry.path)
+    return os.path.join(directory, f"{int(time.time())}-%05d{HLS_SEGMENT_EXTENSION}")
+
+
+class OutputConsumers:
+    """Number of consumers of each UDP output port, in shared memory.
+    Created by the orchestrator and passed to the processes at start.
+    A byte is written to the change pipe after each update: the reader
+    watches fileno(), calls clear_changed() and then reads the counts.
+    """
+
+    def __init__(self, ports):
+        self.ports = tuple(sorted(ports))
+        self._index = {port: idx for idx, port in enumerate(self.ports)}
+        self._counts = mp.RawArray("i", len(self.ports))
+        # mp connections, so spawned processes get the fds (non-blocking for all of them)
+        self._changes_r, self._changes_w = mp.Pipe(duplex=False)
+        os.set_blocking(self._changes_r.fileno(), False)
+        os.set_blocking(self._changes_w.fileno(), False)
+
+    def set(self, port, count):
+        self._counts[self._index[port]] = count
+        self._changed()
+
+    def add(self, port, n=1):
+        self._counts[self._index[port]] += n
+        self._changed()
+
+    def _changed(self):
+        try:
+            os.write(self._changes_w.fileno(), b"\0")
+        except BlockingIOError:
+            pass  # Pipe full: changes already signalled, the reader reads all counts
+
+    def fileno(self):
+        return self._changes_r.fileno()
+
+    def clear_changed(self):
+        try:
+            while os.read(self._changes_r.fileno(), 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def get(self, port):
+        return self._counts[self._index[port]]
+
+    def active_ports(self):
+        counts = self._counts[:]
+        return {port for idx, port in enumerate(self.ports) if counts[idx] > 0}
+
+    def snapshot(self):
+        counts = self._counts[:]
+        return {port: counts[idx] for idx, port in enumerate(self.ports)}
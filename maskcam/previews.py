@@ -0,0 +1,272 @@
+import os
+import sys
+import time
+import queue
+import hashlib
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from maskcam.prints import print_fileserver as print
+
+# Thumbnails and contact sheets of the recorded clips, so operators can find
+# the clip they want from a few KB of JPEG instead of downloading each MP4.
+# Made by a background thread when a recording is closed (CPU decoding with
+# OpenCV), and kept in a content-addressed cache: the key comes from the file
+# content, so a renamed or re-indexed clip isn't decoded again. The cache is
+# bounded in size, least recently used previews are evicted first.
+
+VIDEO_EXTENSIONS = (".mp4", ".mkv", ".avi")
+PREVIEW_KINDS = ("thumb", "sheet")
+SAMPLE_SIZE = 65536  # Bytes hashed from the start and the end of each file
+THUMBNAIL_WIDTH = 320
+SHEET_COLUMNS = 4
+SHEET_ROWS = 2
+SHEET_TILE_WIDTH = 160
+JPEG_QUALITY = 75
+TOUCH_INTERVAL = 60  # seconds, between mtime updates of used previews (LRU order on disk)
+
+
+def content_key(path):
+    """Cache key of a file: hash of its size and its first and last SAMPLE_SIZE
+    bytes. Recordings end with the MP4 index (sample tables), unique per clip.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+        digest.update(f.read(SAMPLE_SIZE))
+        if size > SAMPLE_SIZE:
+            f.seek(max(size - SAMPLE_SIZE, SAMPLE_SIZE))
+            digest.update(f.read(SAMPLE_SIZE))
+    return digest.hexdigest()
+
+
+def is_video(name):
+    return name.lower().endswith(VIDEO_EXTENSIONS)
+
+
+def open_capture(path):
+    # FFmpeg backend, decoding on the CPU (the GPU is busy with inference)
+    if hasattr(cv2, "CAP_PROP_HW_ACCELERATION"):
+        return cv2.VideoCapture(
+            path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_NONE]
+        )
+    return cv2.VideoCapture(path)
+
+
+def resize_to_width(frame, width):
+    height = max(1, round(frame.shape[0] * width / frame.shape[1]))
+    return cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+
+
+def encode_jpeg(frame):
+    ok, data = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    return data.tobytes() if ok else None
+
+
+def make_previews(path):
+    """{kind: JPEG bytes} for a video file, None if it can't be decoded.
+    thumb: the first frame (a keyframe, decoded on its own).
+    sheet: SHEET_COLUMNS x SHEET_ROWS frames evenly spread over the clip. Each
+    seek decodes from the previous keyframe only, not the whole clip.
+    """
+    capture = open_capture(path)
+    try:
+        if not capture.isOpened():
+            return None
+        n_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        ok, first = capture.read()
+        if not ok:
+            return None
+        n_tiles = SHEET_COLUMNS * SHEET_ROWS
+        tiles = [resize_to_width(first, SHEET_TILE_WIDTH)]
+        for idx in range(1, n_tiles):
+            frame = None
+            if n_frames > n_tiles:
+                capture.set(cv2.CAP_PROP_POS_FRAMES, idx * n_frames // n_tiles)
+                ok, frame = capture.read()
+            tiles.append(resize_to_width(frame, SHEET_TILE_WIDTH) if frame is not None else None)
+    finally:
+        capture.release()
+
+    tile_height, tile_width = tiles[0].shape[:2]
+    sheet = np.zeros((tile_height * SHEET_ROWS, tile_width * SHEET_COLUMNS, 3), dtype=np.uint8)
+    for idx, tile in enumerate(tiles):
+        if tile is not None and tile.shape[:2] == (tile_height, tile_width):
+            row, column = divmod(idx, SHEET_COLUMNS)
+            top, left = row * tile_height, column * tile_width
+            sheet[top : top + tile_height, left : left + tile_width] = tile
+    previews = {"thumb": encode_jpeg(resize_to_width(first, THUMBNAIL_WIDTH)), "sheet": encode_jpeg(sheet)}
+    if None in previews.values():
+        return None
+    return previews
+
+
+class PreviewCache:
+    """Previews on disk as <directory>/<key[:2]>/<key>-<kind>.jpg, at most
+    max_bytes in total. The LRU order is kept in memory, and on disk as the
+    files mtime so it survives restarts. Thread safe.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> bytes, least recently used first
+        self.total_bytes = 0
+        self.keys = {}  # recording path -> key
+        self._touched = {}  # key -> time.monotonic() of the last mtime update
+        os.makedirs(self.directory, exist_ok=True)
+        self._load()
+
+    def path(self, key, kind):
+        return os.path.join(self.directory, key[:2], f"{key}-{kind}.jpg")
+
+    def _load(self):
+        found = {}  # key -> [last used, bytes]
+        for subdir in os.scandir(self.directory):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if entry.name.endswith(".tmp"):
+                    os.remove(entry.path)  # Interrupted write
+                    continue
+                stat_result = entry.stat()
+                item = found.setdefault(entry.name.partition("-")[0], [0, 0])
+                item[0] = max(item[0], stat_result.st_mtime)
+                item[1] += stat_result.st_size
+        with self.lock:
+            for key, (_, size) in sorted(found.items(), key=lambda item: item[1][0]):
+                self.entries[key] = size
+                self.total_bytes += size
+            self._evict()
+        print(f"Preview cache: {len(self.entries)} clips, {self.total_bytes / 1e6:.1f} MB in {self.directory}")
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, kind):
+        # Path of a preview (marking it as used), None if not cached
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            now = time.monotonic()
+            touch = now - self._touched.get(key, 0) > TOUCH_INTERVAL
+            if touch:
+                self._touched[key] = now
+        path = self.path(key, kind)
+        if touch:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return path
+
+    def put(self, key, previews):
+        os.makedirs(os.path.dirname(self.path(key, PREVIEW_KINDS[0])), exist_ok=True)
+        size = 0
+        for kind, data in previews.items():
+            path = self.path(key, kind)
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+            size += len(data)
+        with self.lock:
+            self.total_bytes += size - self.entries.pop(key, 0)
+            self.entries[key] = size
+            self._evict()
+
+    def _evict(self):
+        # The newest entry is always kept
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            key, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            self._touched.pop(key, None)
+            for kind in PREVIEW_KINDS:
+                try:
+                    os.remove(self.path(key, kind))
+                except OSError:
+                    pass
+
+    def key_for(self, path):
+        # Key of a recording whose previews are cached, None otherwise
+        key = self.keys.get(path)
+        return key if key is not None and key in self.entries else None
+
+    def set_key(self, path, key):
+        if key is None:
+            self.keys.pop(path, None)
+        else:
+            self.keys[path] = key
+
+
+class PreviewWorker:
+    """Makes the previews of recordings in a background thread, one at a time.
+    Used as a RecordingsIndex listener: listener(path, recording) is called
+    for added files, and with recording=None for removed ones.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="preview-worker", daemon=True)
+        self.made = 0
+        self.seconds = 0
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join(timeout=5)
+
+    def __call__(self, path, recording):
+        if recording is None:
+            self.cache.set_key(path, None)
+        elif is_video(path):
+            self.queue.put(path)
+
+    def _run(self):
+        # Leave the other cores to inference
+        cv2.setNumThreads(1)
+        while True:
+            path = self.queue.get()
+            if path is None:
+                break
+            try:
+                self._process(path)
+            except Exception as e:
+                print(f"Preview of {path} failed: {e}", warning=True)
+
+    def _process(self, path):
+        try:
+            key = content_key(path)
+        except OSError:
+            return  # Removed meanwhile
+        if key not in self.cache:
+            t_start = time.monotonic()
+            previews = make_previews(path)
+            if previews is None:
+                print(f"Preview of {path}: can't decode video", warning=True)
+                return
+            self.cache.put(key, previews)
+            self.made += 1
+            self.seconds += time.monotonic() - t_start
+        self.cache.set_key(path, key)
+
+
+if __name__ == "__main__":
+    # Preview cost and size: python3 -m maskcam.previews <video> [<video> ...]
+    cv2.setNumThreads(1)
+    for path in sys.argv[1:]:
+        t_start = time.perf_counter()
+        previews = make_previews(path)
+        seconds = time.perf_counter() - t_start
+        if previews is None:
+            print(f"{path}: can't decode video", error=True)
+            continue
+        sizes = ", ".join(f"{kind} {len(data) / 1e3:.1f} KB" for kind, data in previews.items())
+        print(f"{path}: {os.path.getsize(path) / 1e6:.1f} MB -> {sizes} in {1000 * seconds:.0f} ms")
@@ -1,29 +1,231 @@
+import os
+import sys
+import json
+import time
+import queue
+import atexit
 import logging
+import logging.handlers
+import multiprocessing.util
+from datetime import datetime
+
 from rich.logging import RichHandler
+from rich.markup import escape
+from rich.text import Text
+from rich.errors import MarkupError
+
+# Every process logs through a queue: the caller (sometimes a GStreamer
+# streaming thread) only checks the level and enqueues a record, a listener
+# thread of the same process formats it (Rich markup on the console, or JSON
+# lines with log-json-file) and writes it.
+# On top of the print_X(*args, error=, warning=, exception=) calls:
+#   debug=True: only logged if the level of that process (log-levels) allows it
+#   fields={...}: structured values, copied (shallow) and only formatted by
+#     the listener (key=value on the console, a "fields" object in JSON)
+#   every=seconds: at most one message per period from that call site, the
+#     next one reports how many were suppressed
+
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+DEFAULT_LOG_LEVEL = "INFO"
+LOG_QUEUE_SIZE = 10000  # records, new ones are dropped if the listener falls behind
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    # Doesn't format records: the listener does, in its own thread
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        if self.dropped:
+            record.dropped = self.dropped
+        try:
+            self.queue.put_nowait(record)
+            self.dropped = 0
+        except queue.Full:
+            self.dropped += 1
+
+
+def describe(record, markup):
+    # Message with process name, fields and counters, as shown on the console
+    msg = record.getMessage()
+    process_name = getattr(record, "process_name", None)
+    if process_name is not None:
+        msg = f"[{record.color}]{process_name}[/{record.color}] | {msg}" if markup else f"{process_name} | {msg}"
+    fields = getattr(record, "fields", None)
+    if fields:
+        values = " ".join(f"{key}={value}" for key, value in fields.items())
+        msg += " " + (escape(values) if markup else values)
+    suppressed = getattr(record, "suppressed", 0)
+    if suppressed:
+        msg += f" ({suppressed} similar messages suppressed)"
+    dropped = getattr(record, "dropped", 0)
+    if dropped:
+        msg += f" ({dropped} log messages dropped before this one)"
+    return msg
+
+
+class ConsoleFormatter(logging.Formatter):
+    def format(self, record):
+        record.message = describe(record, markup=True)
+        if record.exc_info:
+            return record.message + "\n" + self.formatException(record.exc_info)
+        return record.message
+
+
+class JsonFormatter(logging.Formatter):
+    # One JSON object per line, without Rich markup
+    def format(self, record):
+        msg = record.getMessage()
+        try:
+            msg = Text.from_markup(msg).plain
+        except MarkupError:
+            pass
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "process": getattr(record, "process_name", record.name),
+            "pid": record.process,
+            "thread": record.threadName,
+            "msg": msg,
+        }
+        for key in ("fields", "suppressed", "dropped"):
+            if getattr(record, key, None):
+                entry[key] = getattr(record, key)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def console_handler():
+    handler = RichHandler(markup=True, show_path=False)  # The path would always be this file
+    handler.setFormatter(ConsoleFormatter(datefmt="|"))  # Not needed w/balena, use [%X] otherwise
+    return handler
+
+
+def json_handler(path):
+    # Each record is a single small append, so processes can share the file
+    handler = logging.FileHandler(path, encoding="utf-8")
+    handler.setFormatter(JsonFormatter())
+    return handler
+
+
+_queue_handler = QueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+_output_handler = console_handler()
+_listener = None
+_listener_pid = None
+_loggers = {}  # Process name: logger, getLogger() takes a lock
+_rate_limits = {}  # Call site: [next allowed time, suppressed count]
+
+logging.root.handlers = [_queue_handler]
+logging.root.setLevel(DEFAULT_LOG_LEVEL)
+
+
+def start_listener():
+    # Also called after a fork: the listener thread isn't copied into the child
+    global _listener, _listener_pid
+    if _listener_pid is not None and _listener_pid != os.getpid():
+        _queue_handler.queue = queue.Queue(LOG_QUEUE_SIZE)  # The parent's may be locked
+    _listener_pid = os.getpid()
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, _output_handler)
+    _listener.start()
+    # Forked children exit without atexit, but run the multiprocessing finalizers
+    multiprocessing.util.Finalize(None, stop_listener, exitpriority=-100)
 
-logging.basicConfig(
-    level="NOTSET",
-    format="%(message)s",
-    datefmt="|",  # Not needed w/balena, use [%X] otherwise
-    handlers=[RichHandler(markup=True)],
-)
 
-log = logging.getLogger("rich")
+def stop_listener():
+    # Writes the records still queued
+    global _listener
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+        _listener = None
+
+
+start_listener()
+atexit.register(stop_listener)
+
+
+def configure_logging(config):
+    """Applies the log settings of the config to this process: call at the
+    start of each process (they don't share the logging setup).
+    """
+    global _output_handler
+    logging.root.setLevel(config["maskcam"]["log-level"])
+    for process_name, level in config["maskcam"]["log-levels"].items():
+        logging.getLogger(f"maskcam.{process_name}").setLevel(level)
+    json_path = config["maskcam"]["log-json-file"].strip()
+    if json_path:
+        stop_listener()
+        _output_handler.close()
+        _output_handler = json_handler(json_path)
+        start_listener()
 
 
 def print_process(
-    color, process_name, *args, error=False, warning=False, exception=False, **kwargs
+    color,
+    process_name,
+    *args,
+    error=False,
+    warning=False,
+    exception=False,
+    debug=False,
+    fields=None,
+    every=None,
+    **kwargs,
 ):
-    msg = " ".join([str(arg) for arg in args])  # Concatenate all incoming strings or objects
-    rich_msg = f"[{color}]{process_name}[/{color}] | {msg}"
+    logger = _loggers.get(process_name)
+    if logger is None:
+        logger = _loggers[process_name] = logging.getLogger(f"maskcam.{process_name}")
     if error:
-        log.error(rich_msg)
+        level = logging.ERROR
     elif warning:
-        log.warning(rich_msg)
+        level = logging.WARNING
     elif exception:
-        log.exception(rich_msg)
+        level = logging.ERROR
+    elif debug:
+        level = logging.DEBUG
     else:
-        log.info(rich_msg)
+        level = logging.INFO
+    if not logger.isEnabledFor(level):
+        return
+    if _listener_pid != os.getpid():
+        start_listener()
+
+    suppressed = 0
+    if every is not None:
+        caller = sys._getframe(2)  # print_X -> print_process
+        key = (caller.f_code, caller.f_lineno)
+        t_now = time.monotonic()
+        limit = _rate_limits.get(key)
+        if limit is not None and t_now < limit[0]:
+            limit[1] += 1
+            return
+        suppressed = limit[1] if limit is not None else 0
+        _rate_limits[key] = [t_now + every, 0]
+
+    if len(args) == 1 and type(args[0]) is str:
+        msg = args[0]
+    else:
+        msg = " ".join([str(arg) for arg in args])  # Concatenate all incoming strings or objects
+    record = logger.makeRecord(
+        logger.name,
+        level,
+        "",  # No caller lookup, it'd always be this function
+        0,
+        msg,
+        None,
+        sys.exc_info() if exception else None,
+        extra={
+            "process_name": process_name,
+            "color": color,
+            "fields": dict(fields) if fields else None,  # The caller may change it before it's formatted
+            "suppressed": suppressed,
+        },
+    )
+    logger.handle(record)
 
 
 def print_run(*args, **kwargs):
@@ -50,5 +252,90 @@ def print_mqtt(*args, **kwargs):
     print_process("bright_green", "mqtt", *args, **kwargs)
 
 
+def print_serial(*args, **kwargs):
+    print_process("cyan", "save-serial", *args, **kwargs)
+
+
 def print_common(*args, **kwargs):
     print_process("white", "common", *args, **kwargs)
+
+
+if __name__ == "__main__":
+    # Per-call cost on the calling thread (e.g. the inference probe), writing
+    # to /dev/null: synchronous Rich handler as before, queued, and the calls
+    # that return early (level disabled, rate limited). Then the listener's
+    # cost per record, and how much it slows the caller's own work.
+    # Usage: python3 -m maskcam.prints [calls]
+    import threading
+    from rich.console import Console
+
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    devnull = open(os.devnull, "w")
+
+    def timed(function):
+        t_start = time.perf_counter()
+        for frame_number in range(calls):
+            function(frame_number)
+        return (time.perf_counter() - t_start) / calls * 1e6
+
+    def wait_queue():
+        while not _queue_handler.queue.empty():
+            time.sleep(0.01)
+
+    # Before: formatted and written by the caller
+    sync_handler = RichHandler(markup=True, console=Console(file=devnull))
+    sync_handler.setFormatter(logging.Formatter("%(message)s", datefmt="|"))
+    sync_log = logging.getLogger("bench-sync")
+    sync_log.propagate = False
+    sync_log.addHandler(sync_handler)
+    results = {
+        "synchronous Rich": timed(
+            lambda n: sync_log.info(f"[bright_yellow]inference[/bright_yellow] | Processed {n} frames...")
+        )
+    }
+
+    # The listener writes to /dev/null too, the queue is drained between runs
+    stop_listener()
+    _output_handler = RichHandler(markup=True, show_path=False, console=Console(file=devnull))
+    _output_handler.setFormatter(ConsoleFormatter(datefmt="|"))
+    start_listener()
+    results["queued"] = timed(lambda n: print_inference(f"Processed {n} frames..."))
+    wait_queue()
+    results["queued, with fields"] = timed(lambda n: print_inference("Processed frames", fields={"frames": n}))
+    wait_queue()
+    results["debug, disabled"] = timed(lambda n: print_inference("Drawing", fields={"n": n}, debug=True))
+    results["rate limited (every=1)"] = timed(lambda n: print_inference(f"Queue full {n}", every=1))
+    wait_queue()
+
+    # Listener time per record, i.e. what left the calling thread
+    t_start = time.perf_counter()
+    for n in range(calls):
+        print_inference(f"Processed {n} frames...")
+    wait_queue()
+    results["queued, until written (listener)"] = (time.perf_counter() - t_start) / calls * 1e6
+
+    # The listener formats with the GIL held: the calling thread's own Python
+    # work (stand-in for the probe) waits for it, at each switch interval
+    def stats(samples):
+        samples = sorted(samples)
+        return sum(samples) / len(samples), samples[int(len(samples) * 0.99)]
+
+    def work():
+        t_start = time.perf_counter()
+        sum(range(20000))
+        return (time.perf_counter() - t_start) * 1e6
+
+    idle_work = stats([work() for _ in range(2000)])
+    for n in range(calls):
+        print_inference(f"Processed {n} frames...")
+    busy_samples = []
+    while not _queue_handler.queue.empty():
+        busy_samples.append(work())
+    wait_queue()
+    busy_work = stats(busy_samples)
+
+    print(f"{calls} calls, {threading.active_count()} threads")
+    for name, micros in results.items():
+        print(f"{name:<36} {micros:7.2f} µs/call")
+    print(f"{'caller work, listener idle':<36} {idle_work[0]:7.2f} µs mean, {idle_work[1]:7.2f} µs p99")
+    print(f"{'caller work, listener formatting':<36} {busy_work[0]:7.2f} µs mean, {busy_work[1]:7.2f} µs p99")
@@ -0,0 +1,256 @@
+import os
+import stat
+import bisect
+import select
+import threading
+from datetime import datetime
+
+from dateutil import parser as date_parser
+
+from maskcam.archive import FILENAME_PATTERNS
+from maskcam.catalog import Catalog
+from maskcam.inotify import (
+    Inotify,
+    IN_CLOSE_WRITE,
+    IN_DELETE,
+    IN_MOVED_FROM,
+    IN_MOVED_TO,
+    IN_Q_OVERFLOW,
+)
+from maskcam.prints import print_fileserver as print
+
+# In-memory index of the files in the file server directory, for the
+# /api/recordings JSON API. Built from disk once at startup, then kept
+# current from inotify events (files finished by the recorder, moved in
+# from the RAM dir or deleted), so requests never list or stat the directory.
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+SORT_KEYS = ("start", "end", "size", "name")
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE | IN_MOVED_FROM
+LAST_NAME = "\U0010ffff"  # Sorts after any file name, for bisect
+
+
+class Recording:
+    __slots__ = ("name", "size", "start", "end", "run_id")
+
+    def __init__(self, name, size, start, end, run_id):
+        self.name = name
+        self.size = size
+        self.start = start  # epoch seconds, from the filename (or mtime if it has no time)
+        self.end = end  # epoch seconds, modification time
+        self.run_id = run_id
+
+    def to_json(self):
+        return {
+            "name": self.name,
+            "size": self.size,
+            "start": datetime.fromtimestamp(self.start).isoformat(timespec="seconds"),
+            "end": datetime.fromtimestamp(self.end).isoformat(timespec="seconds"),
+            "run_id": self.run_id,
+        }
+
+
+def filename_time(name):
+    # Start time from a maskcam filename (epoch seconds), None if it has none
+    for _, pattern, time_format in FILENAME_PATTERNS:
+        match = pattern.search(name)
+        if match:
+            return datetime.strptime(match.group(1), time_format).timestamp()
+    return None
+
+
+class RecordingsIndex:
+    """Recordings by start time, updated by a watcher thread. Queries are
+    served from a list kept sorted by (start, name) with bisect, other sort
+    orders are computed once per index version.
+    catalog_path: session catalog to find each recording's run (optional).
+    listeners: called from the watcher thread as listener(path, recording)
+      for each file indexed (newest first on scans), and with recording=None
+      for each file removed.
+    """
+
+    def __init__(self, root, catalog_path=None, listeners=()):
+        self.root = os.path.abspath(root)
+        self.catalog_path = catalog_path
+        self.listeners = list(listeners)
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.recordings = {}  # name -> Recording
+        self.keys = []  # (start, name), sorted
+        self.max_duration = 0  # Longest recording, to bisect time-range queries
+        self.version = 0  # Changes on every update, used as ETag
+        self._sorted_cache = {}  # (key, reverse) -> [Recording] for the current version
+        self._stop_r, self._stop_w = os.pipe()
+        self.thread = threading.Thread(target=self._run, name="recordings-index", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        os.write(self._stop_w, b"x")
+        self.thread.join(timeout=2)
+        os.close(self._stop_r)
+        os.close(self._stop_w)
+
+    def _run(self):
+        # SQLite connections can't be shared between threads, open it here
+        catalog = Catalog(self.catalog_path) if self.catalog_path else None
+        inotify = Inotify()
+        try:
+            # Watch before scanning, so nothing created meanwhile is missed
+            inotify.add_watch(self.root, WATCH_MASK | IN_Q_OVERFLOW)
+            self._rebuild(catalog)
+            self.ready.set()
+            while True:
+                readable, _, _ = select.select([inotify, self._stop_r], [], [])
+                if self._stop_r in readable:
+                    break
+                self._apply(inotify.read_events(), catalog)
+        finally:
+            self.ready.set()
+            inotify.close()
+            if catalog is not None:
+                catalog.close()
+
+    def _scan_file(self, name, catalog):
+        if name.startswith(".") or name.endswith(".tmp"):
+            return None
+        try:
+            stat_result = os.stat(os.path.join(self.root, name))
+        except OSError:
+            return None  # Already removed
+        if not stat.S_ISREG(stat_result.st_mode):
+            return None
+        start = filename_time(name)
+        if start is None:
+            start = stat_result.st_mtime
+        run = catalog.run_at(start) if catalog is not None else None
+        return Recording(name, stat_result.st_size, start, stat_result.st_mtime, run["id"] if run else None)
+
+    def _rebuild(self, catalog):
+        recordings = {}
+        for entry in os.scandir(self.root):
+            recording = self._scan_file(entry.name, catalog)
+            if recording is not None:
+                recordings[recording.name] = recording
+        with self.lock:
+            removed = [name for name in self.recordings if name not in recordings]
+            self.recordings = recordings
+            self.keys = sorted((recording.start, recording.name) for recording in recordings.values())
+            self.max_duration = max((r.end - r.start for r in recordings.values()), default=0)
+            self._changed()
+            keys = list(self.keys)
+        print(f"Recordings index: {len(recordings)} files in {self.root}")
+        for name in removed:
+            self._notify(name, None)
+        for _, name in reversed(keys):
+            self._notify(name, recordings[name])
+
+    def _apply(self, events, catalog):
+        for _, mask, _, name in events:
+            if mask & IN_Q_OVERFLOW:
+                print("Recordings index: inotify queue overflow, rescanning", warning=True)
+                self._rebuild(catalog)
+                return
+        for _, mask, _, name in events:
+            if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                recording = self._scan_file(name, catalog)
+                if recording is not None:
+                    with self.lock:
+                        self._remove(name)
+                        self.recordings[name] = recording
+                        bisect.insort(self.keys, (recording.start, name))
+                        self.max_duration = max(self.max_duration, recording.end - recording.start)
+                        self._changed()
+                    self._notify(name, recording)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                with self.lock:
+                    removed = self._remove(name)
+                    if removed:
+                        self._changed()
+                if removed:
+                    self._notify(name, None)
+
+    def _notify(self, name, recording):
+        for listener in self.listeners:
+            listener(os.path.join(self.root, name), recording)
+
+    def _remove(self, name):
+        recording = self.recordings.pop(name, None)
+        if recording is None:
+            return False
+        idx = bisect.bisect_left(self.keys, (recording.start, name))
+        del self.keys[idx]
+        return True
+
+    def _changed(self):
+        self.version += 1
+        self._sorted_cache = {}
+
+    def __len__(self):
+        return len(self.recordings)
+
+    def query(self, start=None, end=None, sort="start", reverse=False, offset=0, limit=DEFAULT_PAGE_SIZE):
+        """Recordings overlapping [start, end] (epoch seconds, None for open),
+        sorted by sort (one of SORT_KEYS). Returns (total matching, page, version).
+        """
+        limit = max(0, min(limit, MAX_PAGE_SIZE))
+        offset = max(0, offset)
+        with self.lock:
+            if sort == "start":
+                # Only recordings started up to max_duration before the range
+                # need their end checked, the page is taken by position
+                early_first = 0 if start is None else bisect.bisect_left(self.keys, (start - self.max_duration,))
+                first = 0 if start is None else bisect.bisect_left(self.keys, (start,))
+                last = len(self.keys) if end is None else bisect.bisect_right(self.keys, (end, LAST_NAME))
+                early = [
+                    name for _, name in self.keys[early_first:min(first, last)] if self.recordings[name].end >= start
+                ]
+                last = max(last, first)
+                total = len(early) + last - first
+                if reverse:
+                    positions = range(total - 1 - offset, max(total - 1 - offset - limit, -1), -1)
+                else:
+                    positions = range(offset, min(offset + limit, total))
+                page = [
+                    self.recordings[early[pos] if pos < len(early) else self.keys[first + pos - len(early)][1]]
+                    for pos in positions
+                ]
+                return total, page, self.version
+            else:
+                cache_key = (sort, reverse)
+                if cache_key not in self._sorted_cache:
+                    self._sorted_cache[cache_key] = sorted(
+                        self.recordings.values(),
+                        key=lambda recording: (getattr(recording, sort), recording.name),
+                        reverse=reverse,
+                    )
+                matching = [
+                    recording
+                    for recording in self._sorted_cache[cache_key]
+                    if (start is None or recording.end >= start) and (end is None or recording.start <= end)
+                ]
+            return len(matching), matching[offset : offset + limit], self.version
+
+
+def parse_query(params):
+    """Query string parameters ({name: [values]}, as parse_qs) to query()
+    keyword arguments. Raises ValueError on invalid values.
+    """
+    def single(name, default=None):
+        values = params.get(name)
+        return values[-1] if values else default
+
+    kwargs = {}
+    sort = single("sort", "start")
+    kwargs["reverse"] = sort.startswith("-")
+    kwargs["sort"] = sort.lstrip("-")
+    if kwargs["sort"] not in SORT_KEYS:
+        raise ValueError(f"sort must be one of {', '.join(SORT_KEYS)}, optionally with a - prefix")
+    for name, key in (("from", "start"), ("to", "end")):
+        value = single(name)
+        kwargs[key] = date_parser.parse(value).timestamp() if value else None
+    kwargs["offset"] = int(single("offset", 0))
+    kwargs["limit"] = int(single("limit", DEFAULT_PAGE_SIZE))
+    return kwargs
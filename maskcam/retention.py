@@ -0,0 +1,494 @@
+import os
+import gzip
+import json
+import time
+import select
+import shutil
+import threading
+from datetime import datetime
+
+from maskcam.archive import (
+    ARCHIVE_EXTENSION,
+    FILENAME_PATTERNS,
+    KIND_GPS_LOG,
+    KIND_GRASS,
+    KIND_STATISTICS,
+    KIND_VIDEO,
+)
+from maskcam.catalog import Catalog
+from maskcam.inotify import (
+    Inotify,
+    IN_CLOSE_WRITE,
+    IN_CREATE,
+    IN_DELETE,
+    IN_MOVED_FROM,
+    IN_MOVED_TO,
+    IN_Q_OVERFLOW,
+)
+from maskcam.prints import print_common as print
+
+# Disk retention for the directories maskcam keeps writing to (videos,
+# statistics, grass events, GPS logs). Each directory has a quota and a
+# time-to-live; when a unit runs low on free space, the oldest files of every
+# directory on that disk go first. Clips with defects (from the catalog) are a
+# higher priority class: evicted only after every normal file, and with their
+# own TTL. Old statistics and logs are gzipped (readers use open_archived()).
+# Sizes are tracked in memory from inotify events after one initial scan, so
+# checks never walk the directories. Every eviction goes to the report file.
+
+CLASS_NORMAL = 0
+CLASS_DEFECT = 1  # Evicted last
+CLASS_NAMES = {CLASS_NORMAL: "normal", CLASS_DEFECT: "defect"}
+COMPRESS_KINDS = (KIND_STATISTICS, KIND_GRASS, KIND_GPS_LOG)
+RECENT_SECONDS = 120  # Files modified this recently are never touched (may be in use)
+COPY_CHUNK = 1024 * 1024
+WATCH_MASK = IN_CREATE | IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE | IN_MOVED_FROM | IN_Q_OVERFLOW
+
+
+def paths_open_for_writing(paths):
+    # Those of paths a process has open for writing, from /proc (processes
+    # of other users can't be inspected, maskcam runs as a single user)
+    paths = {os.path.realpath(path): path for path in paths}  # /proc has resolved paths
+    found = set()
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        fd_dir = f"/proc/{pid}/fd"
+        try:
+            fds = os.listdir(fd_dir)
+        except OSError:
+            continue
+        for fd in fds:
+            try:
+                target = os.readlink(os.path.join(fd_dir, fd))
+                if target not in paths:
+                    continue
+                with open(f"/proc/{pid}/fdinfo/{fd}") as f:
+                    flags = next(int(line.split()[1], 8) for line in f if line.startswith("flags:"))
+            except (OSError, StopIteration):
+                continue  # Closed meanwhile
+            if flags & os.O_ACCMODE in (os.O_WRONLY, os.O_RDWR):
+                found.add(paths[target])
+    return found
+
+
+def file_kind(name):
+    for kind, pattern, _ in FILENAME_PATTERNS:
+        if pattern.search(name):
+            return kind
+    return None
+
+
+class TrackedFile:
+    __slots__ = ("path", "size", "mtime", "kind", "priority", "active")
+
+    def __init__(self, path, size, mtime, kind, active=False):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.kind = kind
+        self.priority = CLASS_NORMAL
+        self.active = active  # Created and not closed yet
+
+
+class DirectoryRule:
+    """Limits for one directory (not recursive). 0 disables a limit.
+    ttls: {class: seconds} by modification time.
+    """
+
+    def __init__(self, name, directory, quota_bytes=0, ttls=None, compress_after=0):
+        self.name = name
+        self.directory = os.path.abspath(directory)
+        self.quota_bytes = quota_bytes
+        self.ttls = ttls or {}
+        self.compress_after = compress_after
+        self.files = {}  # path -> TrackedFile
+        self.total_bytes = 0
+
+    def add(self, tracked):
+        self.discard(tracked.path)
+        self.files[tracked.path] = tracked
+        self.total_bytes += tracked.size
+
+    def discard(self, path):
+        tracked = self.files.pop(path, None)
+        if tracked is not None:
+            self.total_bytes -= tracked.size
+        return tracked
+
+    def resize(self, tracked, size, mtime):
+        self.total_bytes += size - tracked.size
+        tracked.size = size
+        tracked.mtime = mtime
+
+
+class RetentionManager:
+    """Enforces the rules every interval seconds, from a background thread.
+    min_free_bytes: free space to keep on each disk (0 to disable).
+    catalog_path: session catalog, for clips with defects and to drop evicted
+      files from it (optional).
+    report_path: JSON lines file with one record per evicted or compressed file.
+    """
+
+    def __init__(self, rules, min_free_bytes=0, interval=60, catalog_path=None, report_path=None):
+        self.rules = rules
+        self.min_free_bytes = min_free_bytes
+        self.interval = interval
+        self.catalog_path = catalog_path
+        self.report_path = report_path
+        self.lock = threading.Lock()
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+        self.compressed_files = 0
+        self.compressed_saved_bytes = 0
+        self._stop_r, self._stop_w = os.pipe()
+        self.thread = threading.Thread(target=self._run, name="retention", daemon=True)
+
+    @classmethod
+    def from_config(cls, config):
+        section = config["retention"]
+        day = 24 * 3600
+        compress_after = section["compress-after-hours"] * 3600
+        rules = [
+            DirectoryRule(
+                "videos",
+                config["maskcam"]["fileserver-hdd-dir"],
+                section["videos-quota-mb"] * 1000000,
+                {
+                    CLASS_NORMAL: section["videos-ttl-days"] * day,
+                    CLASS_DEFECT: section["defect-videos-ttl-days"] * day,
+                },
+            ),
+        ]
+        for name, directory in (
+            ("statistics", config["maskcam"]["statistics-directory"]),
+            ("grass", config["grass-detection"]["file-directory"]),
+            ("gps", config["serial"]["output-directory"]),
+        ):
+            ttl = section[f"{name}-ttl-days"] * day
+            rules.append(
+                DirectoryRule(
+                    name,
+                    directory,
+                    section[f"{name}-quota-mb"] * 1000000,
+                    {CLASS_NORMAL: ttl, CLASS_DEFECT: ttl},
+                    compress_after,
+                )
+            )
+        return cls(
+            rules,
+            min_free_bytes=section["min-free-mb"] * 1000000,
+            interval=section["check-interval"],
+            catalog_path=config["maskcam"]["catalog-file"].strip() or None,
+            report_path=section["report-file"].strip() or None,
+        )
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        os.write(self._stop_w, b"x")
+        self.thread.join(timeout=10)
+        os.close(self._stop_r)
+        os.close(self._stop_w)
+
+    def status(self):
+        with self.lock:
+            return {
+                "directories": {
+                    rule.name: {
+                        "path": rule.directory,
+                        "files": len(rule.files),
+                        "bytes": rule.total_bytes,
+                        "quota_bytes": rule.quota_bytes,
+                    }
+                    for rule in self.rules
+                },
+                "evicted_files": self.evicted_files,
+                "evicted_bytes": self.evicted_bytes,
+                "compressed_files": self.compressed_files,
+                "compressed_saved_bytes": self.compressed_saved_bytes,
+            }
+
+    def _run(self):
+        # SQLite connections can't be shared between threads, open it here
+        catalog = Catalog(self.catalog_path) if self.catalog_path else None
+        inotify = Inotify()
+        try:
+            watched = {}  # directory -> rule
+            for rule in self.rules:
+                os.makedirs(rule.directory, exist_ok=True)
+                # Watch before scanning, so nothing created meanwhile is missed
+                inotify.add_watch(rule.directory, WATCH_MASK)
+                watched[rule.directory] = rule
+                self._scan(rule)
+            next_check = time.monotonic()
+            while True:
+                if time.monotonic() >= next_check:
+                    self.enforce(catalog)
+                    next_check = time.monotonic() + self.interval
+                timeout = max(0, next_check - time.monotonic())
+                readable, _, _ = select.select([inotify, self._stop_r], [], [], timeout)
+                if self._stop_r in readable:
+                    break
+                if readable:
+                    self._apply(inotify.read_events(), watched)
+        except Exception as e:
+            print(f"Retention stopped: {e}", error=True)
+        finally:
+            inotify.close()
+            if catalog is not None:
+                catalog.close()
+
+    def _track(self, rule, name, active=False):
+        if name.endswith(".tmp"):
+            return None
+        path = os.path.join(rule.directory, name)
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            return None  # Already removed
+        if not os.path.isfile(path):
+            return None
+        tracked = TrackedFile(path, stat_result.st_size, stat_result.st_mtime, file_kind(name), active)
+        with self.lock:
+            rule.add(tracked)
+        return tracked
+
+    def _scan(self, rule):
+        with self.lock:
+            rule.files = {}
+            rule.total_bytes = 0
+        for entry in os.scandir(rule.directory):
+            self._track(rule, entry.name)
+        print(f"Retention: {rule.name} {len(rule.files)} files, {rule.total_bytes / 1e6:.1f} MB in {rule.directory}")
+
+    def _apply(self, events, watched):
+        for directory, mask, _, name in events:
+            rule = watched.get(directory)
+            if rule is None:
+                continue
+            if mask & IN_Q_OVERFLOW:
+                print("Retention: inotify queue overflow, rescanning", warning=True)
+                for rule in self.rules:
+                    self._scan(rule)
+                return
+            path = os.path.join(rule.directory, name)
+            if mask & IN_CREATE:
+                self._track(rule, name, active=True)
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                self._track(rule, name)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                with self.lock:
+                    rule.discard(path)
+
+    def _refresh(self, rule):
+        # Files still being written have grown since their last event
+        for tracked in [tracked for tracked in rule.files.values() if tracked.active]:
+            try:
+                stat_result = os.stat(tracked.path)
+            except OSError:
+                with self.lock:
+                    rule.discard(tracked.path)
+                continue
+            with self.lock:
+                rule.resize(tracked, stat_result.st_size, stat_result.st_mtime)
+
+    def enforce(self, catalog=None, dry_run=False):
+        """Applies every rule once. Returns the report records (also written
+        to the report file, unless dry_run).
+        """
+        now = time.time()
+        defect_paths = catalog.defect_paths() if catalog is not None else set()
+        for rule in self.rules:
+            self._refresh(rule)
+            for tracked in rule.files.values():
+                if tracked.kind == KIND_VIDEO:
+                    tracked.priority = CLASS_DEFECT if tracked.path in defect_paths else CLASS_NORMAL
+
+        handled = set()  # Paths already in records (a dry run doesn't remove them)
+
+        def removable(tracked):
+            return not tracked.active and now - tracked.mtime > RECENT_SECONDS and tracked.path not in handled
+
+        records = []
+        # Time to live
+        for rule in self.rules:
+            for tracked in sorted(rule.files.values(), key=lambda tracked: tracked.mtime):
+                ttl = rule.ttls.get(tracked.priority, 0)
+                if ttl and now - tracked.mtime > ttl and removable(tracked):
+                    records.append(self._evict(rule, tracked, "ttl", now, catalog, dry_run))
+                    handled.add(tracked.path)
+
+        # Compression of old statistics and logs. Not the files of the running
+        # session: the statistics JSON is reopened and rewritten on each update,
+        # the GPS log stays open while the device sends nothing
+        to_compress = [
+            (rule, tracked)
+            for rule in self.rules
+            if rule.compress_after
+            for tracked in sorted(rule.files.values(), key=lambda tracked: tracked.mtime)
+            if tracked.kind in COMPRESS_KINDS
+            and not tracked.path.endswith(ARCHIVE_EXTENSION)
+            and now - tracked.mtime > rule.compress_after
+            and removable(tracked)
+        ]
+        if to_compress:
+            in_use = catalog.active_paths() if catalog is not None else set()
+            in_use |= paths_open_for_writing(tracked.path for _, tracked in to_compress)
+            for rule, tracked in to_compress:
+                if tracked.path in in_use:
+                    continue
+                record = self._compress(rule, tracked, now, catalog, dry_run)
+                if record is not None:
+                    records.append(record)
+                    handled.add(tracked.path)
+
+        # Directory quotas: normal files first, oldest first
+        for rule in self.rules:
+            if not rule.quota_bytes or rule.total_bytes <= rule.quota_bytes:
+                continue
+            excess = rule.total_bytes - rule.quota_bytes
+            for tracked in self._eviction_order([rule], removable):
+                if excess <= 0:
+                    break
+                excess -= tracked.size
+                records.append(self._evict(rule, tracked, "quota", now, catalog, dry_run))
+                handled.add(tracked.path)
+
+        # Free space on each disk, across all its directories
+        if self.min_free_bytes:
+            disks = {}
+            for rule in self.rules:
+                disks.setdefault(os.stat(rule.directory).st_dev, []).append(rule)
+            for rules in disks.values():
+                usage = shutil.disk_usage(rules[0].directory)
+                missing = self.min_free_bytes - usage.free
+                if missing <= 0:
+                    continue
+                owner = {tracked.path: rule for rule in rules for tracked in rule.files.values()}
+                for tracked in self._eviction_order(rules, removable):
+                    if missing <= 0:
+                        break
+                    missing -= tracked.size
+                    records.append(self._evict(owner[tracked.path], tracked, "min-free", now, catalog, dry_run))
+                    handled.add(tracked.path)
+                if missing > 0:
+                    print(f"Retention: {missing / 1e6:.0f} MB below min-free-mb, nothing left to evict", warning=True)
+
+        if records:
+            self._report(records, dry_run)
+        return records
+
+    def _eviction_order(self, rules, removable):
+        candidates = [tracked for rule in rules for tracked in rule.files.values() if removable(tracked)]
+        return sorted(candidates, key=lambda tracked: (tracked.priority, tracked.mtime))
+
+    def _record(self, action, reason, tracked, now, **extra):
+        record = {
+            "time": datetime.fromtimestamp(now).isoformat(timespec="seconds"),
+            "action": action,
+            "reason": reason,
+            "path": tracked.path,
+            "bytes": tracked.size,
+            "class": CLASS_NAMES[tracked.priority],
+            "age_hours": round((now - tracked.mtime) / 3600, 1),
+        }
+        record.update(extra)
+        return record
+
+    def _evict(self, rule, tracked, reason, now, catalog, dry_run):
+        record = self._record("evicted", reason, tracked, now)
+        if dry_run:
+            return record
+        try:
+            os.remove(tracked.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            record["error"] = str(e)
+            return record
+        with self.lock:
+            rule.discard(tracked.path)
+            self.evicted_files += 1
+            self.evicted_bytes += tracked.size
+        if catalog is not None:
+            catalog.remove_artifact(tracked.path)
+        return record
+
+    def _compress(self, rule, tracked, now, catalog, dry_run):
+        archive_path = tracked.path + ARCHIVE_EXTENSION
+        if dry_run:
+            return self._record("compressed", "age", tracked, now, new_path=archive_path)
+        tmp_path = archive_path + ".tmp"
+        try:
+            with open(tracked.path, "rb") as src, gzip.open(tmp_path, "wb", compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, COPY_CHUNK)
+            shutil.copystat(tracked.path, tmp_path)  # Keeps the age for TTL and eviction order
+            os.replace(tmp_path, archive_path)
+            os.remove(tracked.path)
+        except OSError as e:
+            print(f"Retention: can't compress {tracked.path}: {e}", warning=True)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return None
+        archive_size = os.path.getsize(archive_path)
+        with self.lock:
+            rule.discard(tracked.path)
+            archived = TrackedFile(archive_path, archive_size, tracked.mtime, tracked.kind)
+            rule.add(archived)
+            self.compressed_files += 1
+            self.compressed_saved_bytes += tracked.size - archive_size
+        if catalog is not None:
+            catalog.move_artifact(tracked.path, archive_path)
+        return self._record("compressed", "age", tracked, now, new_path=archive_path, new_bytes=archive_size)
+
+    def _report(self, records, dry_run):
+        evicted = [record for record in records if record["action"] == "evicted"]
+        compressed = [record for record in records if record["action"] == "compressed"]
+        prefix = "Retention (dry run)" if dry_run else "Retention"
+        if evicted:
+            defects = sum(1 for record in evicted if record["class"] == "defect")
+            print(
+                f"{prefix}: evicted {len(evicted)} files ({defects} with defects), "
+                f"{sum(record['bytes'] for record in evicted) / 1e6:.1f} MB",
+                warning=True,
+            )
+        if compressed:
+            print(f"{prefix}: compressed {len(compressed)} files")
+        if dry_run or self.report_path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.report_path)), exist_ok=True)
+            with open(self.report_path, "a") as f:
+                for record in records:
+                    f.write(json.dumps(record) + "\n")
+        except OSError as e:
+            print(f"Retention: can't write report {self.report_path}: {e}", error=True)
+
+
+if __name__ == "__main__":
+    import argparse
+    from .config import config
+
+    arg_parser = argparse.ArgumentParser(description="Disk retention (rules from the [retention] config section)")
+    arg_parser.add_argument("--apply", action="store_true", help="Evict and compress now (default: dry run)")
+    args = arg_parser.parse_args()
+
+    manager = RetentionManager.from_config(config)
+    catalog = Catalog(manager.catalog_path) if manager.catalog_path else None
+    for rule in manager.rules:
+        if os.path.isdir(rule.directory):
+            manager._scan(rule)
+    records = manager.enforce(catalog, dry_run=not args.apply)
+    for record in records:
+        print(
+            f"{record['action']:<10} {record['reason']:<8} {record['class']:<6} "
+            f"{record['bytes'] / 1e6:8.1f} MB  {record['age_hours']:7.1f} h  {record['path']}"
+        )
+    if not records:
+        print("Nothing to evict or compress")
+    if catalog is not None:
+        catalog.close()
@@ -1,48 +1,332 @@
-import serial
-import time
-from datetime import datetime
 import os
+import time
+import builtins
 import multiprocessing as mp
+from datetime import datetime
+
+import numpy as np
+import serial
+
+from maskcam.gps import parse_gps_chunk, parse_gps_line
+from maskcam.gps_store import GpsStoreWriter, get_store_path
+from maskcam.metrics import RateMeter
+from maskcam.prints import print_serial as print, configure_logging
 
-def main(config=None, e_external_interrupt=None):
-    # Set a timeout of 1 second on the serial port
-    ser = serial.Serial('/dev/ttyUSB0', 115200, timeout=1) 
-    time.sleep(2)
+# Defaults when running without a config (e.g. python3 -m maskcam.save_serial)
+DEFAULT_SETTINGS = {
+    "port": "/dev/ttyUSB0",
+    "baudrate": 115200,
+    "output-directory": "/home/lab5/Desktop/gps_data",
+    "arrival-timestamps": 1,
+    "fsync-interval": 5.0,
+    "echo-interval": 10.0,
+}
+READ_TIMEOUT = 0.1  # seconds, max. wait for data before checking the interrupt event
+WRITE_BUFFER_SIZE = 64 * 1024
+MAX_LINE_LENGTH = 4096  # bytes without a newline, written as a line anyway
+ESP32_RESET_DELAY = 2  # seconds, the ESP32 reboots when the port is opened
 
-    # Set output directory
-    output_dir = '/home/lab5/Desktop/gps_data'
-    os.makedirs(output_dir, exist_ok=True)  # Create the directory if it doesn't exist
 
+def get_log_path(output_dir):
     # Generate filename with current date and time
     timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-    filename = f'esp32_data_{timestamp}.txt'
-    file_path = os.path.join(output_dir, filename)
+    return os.path.join(output_dir, f'esp32_data_{timestamp}.txt')
 
 
-    try:
-        with open(file_path, 'w') as f:
-            while True:
-                # 1. Check for the interrupt signal FIRST.
-                if e_external_interrupt is not None and e_external_interrupt.is_set():
-                    print("Interrupt received, stopping serial capture.")
-                    break # Exit the loop gracefully
-
-                # 2. Try to read a line. This will wait a maximum of 1 second.
-                line = ser.readline()
-
-                # 3. If a line was actually received, process it.
-                if line:
-                    decoded_line = line.decode('utf-8', errors='ignore').strip()
-                    if decoded_line: # Ensure it's not an empty line
-                        print(decoded_line)
-                        f.write(decoded_line + '\n')
-                        f.flush()
+def get_settings(config=None, **overrides):
+    settings = dict(DEFAULT_SETTINGS)
+    if config is not None:
+        settings.update(config["serial"])
+    settings.update({key: value for key, value in overrides.items() if value is not None})
+    return settings
+
+
+class ArrivalClock:
+    """Wall-clock arrival times derived from the monotonic clock, anchored
+    when the capture starts. Times stay evenly spaced if the system clock is
+    stepped while running (NTP sync after boot, the Jetson has no RTC).
+    """
+
+    def __init__(self):
+        self.wall_start = time.time()
+        self.monotonic_start = time.monotonic()
+
+    def now(self):
+        return self.wall_start + (time.monotonic() - self.monotonic_start)
+
+    def stamp(self):
+        # Line prefix, local time like the GPS log names
+        return datetime.fromtimestamp(self.now()).strftime("%Y-%m-%dT%H:%M:%S.%f").encode()
+
+
+class ConsoleEcho:
+    # Prints the latest line at most once per interval (0: never)
+    def __init__(self, interval):
+        self.interval = interval
+        self.t_last = time.monotonic()
+        self.n_lines = 0
+
+    def lines(self, last_line, n_lines):
+        self.n_lines += n_lines
+        if not self.interval:
+            return
+        t_now = time.monotonic()
+        if t_now - self.t_last >= self.interval:
+            rate = self.n_lines / (t_now - self.t_last)
+            print(f"{last_line.decode('utf-8', errors='replace')}  [{rate:.1f} lines/s]")
+            self.t_last = t_now
+            self.n_lines = 0
+
+
+class SerialIngest:
+    """Reads the serial port in bulk and processes the complete lines of each
+    read together: one write to the log (buffered, fsync'd every
+    fsync_interval), one parse for the GPS store and ring.
+    """
+
+    def __init__(self, ser, log_file, store, settings, gps_ring=None, line_meter=None):
+        self.ser = ser
+        self.log_file = log_file
+        self.store = store
+        self.gps_ring = gps_ring
+        self.line_meter = line_meter
+        self.fsync_interval = float(settings["fsync-interval"])
+        self.clock = ArrivalClock() if int(settings["arrival-timestamps"]) else None
+        self.echo = ConsoleEcho(float(settings["echo-interval"]))
+        self.pending = b""
+        self.t_last_sync = time.monotonic()
+        self.lines = 0
+        self.fixes = 0
+
+    def poll(self):
+        # Waits up to READ_TIMEOUT for data, returns the number of lines processed
+        data = self.ser.read(max(self.ser.in_waiting, 1))
+        n_lines = 0
+        if data:
+            self.pending += data
+            last_newline = self.pending.rfind(b"\n")
+            if last_newline >= 0:
+                complete = self.pending[: last_newline + 1]
+                self.pending = self.pending[last_newline + 1 :]
+                n_lines = self.process(complete)
+            elif len(self.pending) > MAX_LINE_LENGTH:
+                n_lines = self.process(self.pending + b"\n")
+                self.pending = b""
+        if self.line_meter is not None:
+            self.line_meter.tick(n_lines)  # Also keeps the rate updated while idle
+        if time.monotonic() - self.t_last_sync >= self.fsync_interval:
+            self.sync()
+        return n_lines
+
+    def process(self, data):
+        # Complete lines (bytes ending with a newline) received in one read
+        data = data.decode("utf-8", errors="ignore").encode().replace(b"\r", b"")
+        lines = [line.strip() for line in data.split(b"\n")]
+        lines = [line for line in lines if line]
+        if not lines:
+            return 0
+        if self.clock is not None:
+            # Same arrival time for all the lines of a read
+            prefix = self.clock.stamp() + b"\t"
+            self.log_file.write(prefix + (b"\n" + prefix).join(lines) + b"\n")
+        else:
+            self.log_file.write(b"\n".join(lines) + b"\n")
+
+        times, lat, lon = parse_gps_chunk(data)
+        if len(times):
+            self.store.append_many(times, lat, lon)
+            if self.gps_ring is not None:
+                # Live tagging (see maskcam_run.py)
+                for fix in zip(times.astype(np.int64).tolist(), lat.tolist(), lon.tolist()):
+                    self.gps_ring.publish(*fix)
+        self.lines += len(lines)
+        self.fixes += len(times)
+        self.echo.lines(lines[-1], len(lines))
+        return len(lines)
 
+    def sync(self):
+        # Data lost if the Jetson loses power is bounded by fsync_interval
+        self.log_file.flush()
+        os.fsync(self.log_file.fileno())
+        self.store.flush()
+        self.t_last_sync = time.monotonic()
+
+    def close(self):
+        if self.pending:
+            self.process(self.pending + b"\n")  # Last line without newline
+            self.pending = b""
+        self.sync()
+
+
+def main(
+    config=None,
+    e_external_interrupt=None,
+    metrics=None,
+    gps_ring=None,
+    port=None,
+    file_path=None,
+):
+    if config is not None:
+        configure_logging(config)
+    # Settings from [serial] in the config. port: e.g. a pty to test without the device
+    settings = get_settings(config, port=port)
+    ser = serial.Serial(settings["port"], int(settings["baudrate"]), timeout=READ_TIMEOUT)
+    time.sleep(ESP32_RESET_DELAY)
+
+    # Log path chosen by maskcam_run.py (to register it in the catalog) or a new one
+    if file_path is None:
+        file_path = get_log_path(settings["output-directory"])
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)  # Create the directory if it doesn't exist
+
+    # Parsed fixes are also stored in binary, so readers don't parse the text again
+    store = GpsStoreWriter(get_store_path(file_path))
+
+    line_meter = RateMeter(metrics, "lines", "lines_per_second") if metrics is not None else None
+
+    ingest = None
+    try:
+        with open(file_path, 'wb', buffering=WRITE_BUFFER_SIZE) as f:
+            ingest = SerialIngest(ser, f, store, settings, gps_ring=gps_ring, line_meter=line_meter)
+            print(f"Capturing {settings['port']} at {settings['baudrate']} baud to {file_path}")
+            try:
+                while e_external_interrupt is None or not e_external_interrupt.is_set():
+                    ingest.poll()
+                print("Interrupt received, stopping serial capture.")
+            finally:
+                ingest.close()  # Also on Ctrl+C when running standalone
     except Exception as e:
-        print(f"An error occurred: {e}")
+        print(f"An error occurred: {e}", error=True)
     finally:
         ser.close() # Always ensure the serial port is closed.
-        print(f"File saved and serial port closed.")
+        store.close()
+        if ingest is not None:
+            print(f"File saved and serial port closed ({ingest.lines} lines, {ingest.fixes} fixes).")
+
+
+def legacy_capture(port, file_path, e_external_interrupt, gps_ring):
+    # Former loop (readline, decode, print and flush per line), for the benchmark
+    ser = serial.Serial(port, 115200, timeout=1)
+    store = GpsStoreWriter(get_store_path(file_path))
+    with open(file_path, 'w') as f:
+        while not e_external_interrupt.is_set():
+            line = ser.readline()
+            if line:
+                decoded_line = line.decode('utf-8', errors='ignore').strip()
+                if decoded_line:
+                    builtins.print(decoded_line)
+                    f.write(decoded_line + '\n')
+                    f.flush()
+                    fix = parse_gps_line(line)
+                    if fix is not None:
+                        store.append(*fix)
+                        gps_ring.publish(*fix)
+            store.flush_if_due()
+    ser.close()
+    store.close()
+
+
+def _benchmark_capture(loop_name, port, file_path, e_interrupt, gps_ring):
+    # Console output discarded: its cost is measured, not the terminal's
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.dup2(devnull, 2)
+    if loop_name == "legacy":
+        legacy_capture(port, file_path, e_interrupt, gps_ring)
+    else:
+        main(port=port, file_path=file_path, e_external_interrupt=e_interrupt, gps_ring=gps_ring)
+
+
+def run_benchmark(rate, seconds):
+    """Feed a pty at rate lines/s to the former and the current capture loop,
+    each in a child process. Latency is measured until a fix is visible in the
+    GPS ring (what live tagging sees), CPU from the child's resource usage.
+    """
+    import tty
+    import resource
+    import tempfile
+    import threading
+    from maskcam.gps_ring import GpsRing
+
+    gps_time = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+    n_lines = int(rate * seconds)
+    for loop_name in ("legacy", "bulk"):
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        gps_ring = GpsRing()
+        e_interrupt = mp.Event()
+        with tempfile.TemporaryDirectory() as output_dir:
+            usage_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+            process = mp.Process(
+                target=_benchmark_capture,
+                args=(loop_name, os.ttyname(slave), os.path.join(output_dir, "gps.txt"), e_interrupt, gps_ring),
+            )
+            process.start()
+            # Wait until the capture is up (the bulk loop waits for the ESP32 reset)
+            while len(gps_ring) == 0:
+                os.write(master, f"GPS: -1.0, 0.0 @ {gps_time}\r\n".encode())
+                time.sleep(0.1)
+
+            sent = np.full(n_lines, np.nan)
+            latencies = []
+            done = threading.Event()
+
+            def watch_ring():
+                seen = np.zeros(n_lines, dtype=bool)
+                while not done.is_set():
+                    t_now = time.monotonic()
+                    indexes = gps_ring.snapshot().lat.astype(np.int64)
+                    indexes = indexes[(indexes >= 0) & (indexes < n_lines)]
+                    new = indexes[~seen[indexes]]
+                    seen[new] = True
+                    latencies.extend((t_now - sent[new]).tolist())
+                    time.sleep(0.001)
+
+            watcher = threading.Thread(target=watch_ring, daemon=True)
+            watcher.start()
+            t_start = time.monotonic()
+            idx = 0
+            while idx < n_lines:
+                # Lines due until now, written together like a burst from the device
+                due = min(int((time.monotonic() - t_start) * rate) + 1, n_lines)
+                if due > idx:
+                    lines = "".join(f"GPS: {line_idx}.0, 79.86 @ {gps_time}\r\n" for line_idx in range(idx, due))
+                    sent[idx:due] = time.monotonic()
+                    os.write(master, lines.encode())
+                    idx = due
+                time.sleep(0.001)
+            feed_seconds = time.monotonic() - t_start
+            time.sleep(1)  # Let the capture drain the pty
+            done.set()
+            watcher.join()
+            e_interrupt.set()
+            process.join()
+            usage_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        os.close(master)
+        os.close(slave)
+
+        cpu = (usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime)
+        latencies_ms = np.array(latencies) * 1000
+        p50, p99 = np.percentile(latencies_ms, [50, 99]) if len(latencies_ms) else (np.nan, np.nan)
+        print(
+            f"{loop_name:<6}: {n_lines / feed_seconds:8.0f} lines/s fed, {len(latencies)} fixes seen, "
+            f"CPU {cpu:.2f} s ({100 * cpu / feed_seconds:.0f}%), "
+            f"latency p50 {p50:.1f} ms, p99 {p99:.1f} ms"
+        )
+
 
 if __name__ == "__main__":
-    main()
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description="Capture the GPS serial port to a log")
+    arg_parser.add_argument("port", nargs="?", help="Serial port, e.g. a pty from utils/fake_gps_serial.py")
+    arg_parser.add_argument("--benchmark", action="store_true", help="Compare with the former loop on a pty")
+    arg_parser.add_argument("--rate", type=float, default=5000, help="Benchmark lines/s")
+    arg_parser.add_argument("--seconds", type=float, default=5, help="Benchmark duration")
+    args = arg_parser.parse_args()
+
+    if args.benchmark:
+        run_benchmark(args.rate, args.seconds)
+    else:
+        from maskcam.config import config
+
+        main(config=config, port=args.port)
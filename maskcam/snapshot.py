@@ -0,0 +1,148 @@
+import time
+import threading
+import multiprocessing as mp
+
+import cv2
+import numpy as np
+
+# Latest frame of the inference output (with the OSD overlay), for a quick
+# look at the camera (/snapshot.jpg on the file server) without a stream.
+# Inference downscales frames into a single-slot shared memory buffer, at
+# most snapshot-max-fps and only while snapshots are being requested: when
+# nobody polls, it's one timestamp check per frame. The file server encodes
+# the JPEG on demand, shared by the requests within snapshot-cache-ms.
+
+SNAPSHOT_IDLE_TIMEOUT = 5  # seconds after the last request, inference stops publishing
+FIRST_FRAME_TIMEOUT = 2  # seconds, max. wait for a frame when publishing (re)starts
+OVERLAY_FALLBACK_TIMEOUT = 1  # seconds without overlay frames (output disabled) to use frames before the OSD
+SNAPSHOT_JPEG_QUALITY = 80
+READ_RETRIES = 10
+
+
+def snapshot_size(config):
+    # (width, height) of the snapshots, with the aspect ratio of the output video
+    width = config["maskcam"]["snapshot-width"]
+    output_width = config["maskcam"]["output-video-width"]
+    output_height = config["maskcam"]["output-video-height"]
+    return width, max(2, round(width * output_height / output_width / 2) * 2)
+
+
+class SharedFrame:
+    """Single-slot BGR frame in shared memory. One writer (inference), any
+    readers, synchronized by a sequence number (seqlock): odd while the
+    frame is written, so readers retry instead of using a torn copy.
+    Created by the orchestrator and passed to both processes.
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self._pixels = mp.RawArray("B", width * height * 3)
+        self._state = mp.RawArray("d", 3)  # sequence, frame time, last request time
+        self._view = None
+
+    def view(self):
+        # Numpy view of the pixels, made in each process
+        if self._view is None:
+            self._view = np.frombuffer(self._pixels, dtype=np.uint8).reshape(self.height, self.width, 3)
+        return self._view
+
+    def request(self):
+        self._state[2] = time.time()
+
+    def wanted(self):
+        return time.time() - self._state[2] < SNAPSHOT_IDLE_TIMEOUT
+
+    def write(self, frame):
+        self._state[0] += 1
+        self.view()[:] = frame
+        self._state[1] = time.time()
+        self._state[0] += 1
+
+    def read(self):
+        # (frame copy, frame time, sequence), None if there's no frame yet
+        for _ in range(READ_RETRIES):
+            sequence = self._state[0]
+            if sequence == 0:
+                return None
+            if sequence % 2:
+                time.sleep(0.001)  # Being written
+                continue
+            frame = self.view().copy()
+            frame_time = self._state[1]
+            if self._state[0] == sequence:
+                return frame, frame_time, sequence
+        return None
+
+
+class SnapshotPublisher:
+    """Inference side: picks the frames published into a SharedFrame. Offered
+    every frame from after the OSD (overlay) and before it, which is only
+    used while the output is disabled (see OutputBranches).
+    """
+
+    def __init__(self, shared_frame, max_fps):
+        self.shared_frame = shared_frame
+        self.min_interval = 1 / max_fps
+        self.t_published = 0
+        self.t_overlay = 0
+
+    def due(self, overlay):
+        now = time.monotonic()
+        if overlay:
+            self.t_overlay = now
+        elif now - self.t_overlay < OVERLAY_FALLBACK_TIMEOUT:
+            return False
+        if now - self.t_published < self.min_interval or not self.shared_frame.wanted():
+            return False
+        self.t_published = now
+        return True
+
+    def publish(self, rgba_frame):
+        size = (self.shared_frame.width, self.shared_frame.height)
+        frame = cv2.resize(rgba_frame, size, interpolation=cv2.INTER_AREA)
+        self.shared_frame.write(cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR))
+
+
+class SnapshotEncoder:
+    """File server side: JPEG of the latest frame. Concurrent requests wait
+    for the same encode, and share it for cache_seconds.
+    """
+
+    def __init__(self, shared_frame, cache_seconds):
+        self.shared_frame = shared_frame
+        self.cache_seconds = cache_seconds
+        self.lock = threading.Lock()
+        self.jpeg = None
+        self.frame_time = None
+        self.sequence = None
+        self.t_encoded = 0
+        self.encodes = 0
+
+    def get(self):
+        # (JPEG bytes, frame time), (None, None) if inference isn't publishing
+        self.shared_frame.request()
+        with self.lock:
+            now = time.monotonic()
+            if self.jpeg is not None and now - self.t_encoded < self.cache_seconds:
+                return self.jpeg, self.frame_time
+            # After a pause, inference publishes again once it sees the request
+            t_end = now + FIRST_FRAME_TIMEOUT
+            while True:
+                result = self.shared_frame.read()
+                if result is not None and time.time() - result[1] < SNAPSHOT_IDLE_TIMEOUT:
+                    break
+                if time.monotonic() >= t_end:
+                    return None, None
+                time.sleep(0.02)
+            frame, frame_time, sequence = result
+            if sequence != self.sequence:
+                ok, data = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, SNAPSHOT_JPEG_QUALITY])
+                if not ok:
+                    return None, None
+                self.jpeg = data.tobytes()
+                self.frame_time = frame_time
+                self.sequence = sequence
+                self.encodes += 1
+            self.t_encoded = time.monotonic()
+            return self.jpeg, self.frame_time
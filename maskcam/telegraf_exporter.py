@@ -0,0 +1,430 @@
+import os
+import gzip
+import time
+import random
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+from .export import DefectResults, line_protocol_text
+from .prints import print_common as print
+
+# Sends InfluxDB line-protocol records to Telegraf's http_listener_v2.
+# Lines are batched by size and time, gzip-compressed and POSTed over one
+# persistent connection. Failed batches go to a spool directory and are
+# replayed in order, with exponential backoff, once the listener is back.
+# Each program spools in its own subdirectory (spool-dir/<name>), so they
+# don't share sequence numbers.
+
+SPOOL_PREFIX = "spool-"
+SPOOL_SUFFIX = ".lp.gz"
+MAX_PENDING_LINES = 200_000  # Lines waiting for the sender thread, more are dropped
+BACKOFF_INITIAL = 0.5  # seconds
+BACKOFF_MAX = 60
+
+
+def defect_line(track_id, confidence, lat, lon, species, timestamp_ns):
+    # Line-protocol record of one located defect, same format as the bulk
+    # export in maskcam.export
+    results = DefectResults([track_id], [confidence], [lat], [lon], species, [timestamp_ns])
+    return line_protocol_text(results).rstrip("\n")
+
+
+class SendError(Exception):
+    pass
+
+
+class RejectedError(SendError):
+    # The listener refused the batch (4xx), retrying won't help
+    pass
+
+
+class Spool:
+    """Compressed batches waiting to be sent, one file each, in order.
+    Kept across restarts: batches from a previous run are replayed first.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        names = sorted(
+            name
+            for name in os.listdir(directory)
+            if name.startswith(SPOOL_PREFIX) and name.endswith(SPOOL_SUFFIX)
+        )
+        self.files = [(name, os.path.getsize(os.path.join(directory, name))) for name in names]
+        self.size = sum(size for _, size in self.files)
+        self.next_seq = int(names[-1][len(SPOOL_PREFIX) : -len(SPOOL_SUFFIX)]) + 1 if names else 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.files)
+
+    def push(self, body):
+        name = f"{SPOOL_PREFIX}{self.next_seq:012d}{SPOOL_SUFFIX}"
+        self.next_seq += 1
+        tmp_path = os.path.join(self.directory, name + ".tmp")
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(body)
+            os.replace(tmp_path, os.path.join(self.directory, name))  # No partial files
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.files.append((name, len(body)))
+        self.size += len(body)
+        while self.size > self.max_bytes and len(self.files) > 1:
+            self.dropped += 1
+            print(f"Telegraf spool over {self.max_bytes} bytes, dropping oldest batch", warning=True)
+            self.pop()
+
+    def peek(self):
+        # Oldest batch, None if its file is gone (removed by hand or a cleanup)
+        try:
+            with open(os.path.join(self.directory, self.files[0][0]), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def pop(self):
+        name, size = self.files.pop(0)
+        self.size -= size
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+
+class TelegrafExporter:
+    """Background sender, submit() only appends to a list.
+    Call flush() to wait until everything submitted was sent or spooled,
+    and close() before exiting.
+    """
+
+    def __init__(
+        self,
+        url,
+        spool_dir,
+        batch_lines=5000,
+        batch_bytes=512 * 1024,
+        flush_interval=1.0,
+        compress=True,
+        timeout=5.0,
+        max_spool_bytes=256 * 1024 * 1024,
+    ):
+        url_parts = urlsplit(url)
+        self.host = url_parts.hostname
+        self.port = url_parts.port or 80
+        self.path = url_parts.path or "/"
+        self.batch_lines = batch_lines
+        self.batch_bytes = batch_bytes
+        self.flush_interval = flush_interval
+        self.compress = compress
+        self.timeout = timeout
+        self.spool = Spool(spool_dir, max_spool_bytes)
+
+        self.stats = {
+            "lines": 0,
+            "lines_dropped": 0,
+            "batches_sent": 0,
+            "bytes_sent": 0,
+            "batches_spooled": 0,
+            "batches_replayed": 0,
+            "batches_rejected": 0,
+            "send_failures": 0,
+            "connections": 0,
+            "errors": 0,
+        }
+        self._cond = threading.Condition()
+        self._pending = []  # Lines submitted, not yet taken by the sender thread
+        self._pending_bytes = 0
+        self._t_first = 0.0  # When the oldest pending line was submitted
+        self._flush_events = []
+        self._closing = False
+        self._connection = None
+        self._failures = 0
+        self._next_attempt = 0.0  # monotonic time, backoff after failures
+        self._thread = threading.Thread(target=self._run, name="telegraf-exporter", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_config(cls, config, name):
+        # name: spool subdirectory of the program exporting
+        section = config["telegraf"]
+        return cls(
+            section["url"],
+            os.path.join(section["spool-dir"], name),
+            batch_lines=section["batch-lines"],
+            batch_bytes=section["batch-kb"] * 1024,
+            flush_interval=section["flush-interval"],
+            compress=bool(section["gzip"]),
+            max_spool_bytes=section["spool-max-mb"] * 1024 * 1024,
+        )
+
+    def submit(self, line):
+        # Never blocks: drops the line (returns False) if the sender is stuck
+        with self._cond:
+            if len(self._pending) >= MAX_PENDING_LINES:
+                self.stats["lines_dropped"] += 1
+                print(
+                    f"Telegraf exporter behind, dropping lines ({self.stats['lines_dropped']} so far)",
+                    error=True,
+                    every=10,
+                )
+                return False
+            self._pending.append(line)
+            self._pending_bytes += len(line) + 1
+            if len(self._pending) == 1:
+                self._t_first = time.monotonic()
+                self._cond.notify_all()
+            elif len(self._pending) == self.batch_lines or self._pending_bytes >= self.batch_bytes:
+                self._cond.notify_all()
+        return True
+
+    def submit_many(self, lines):
+        for line in lines:
+            self.submit(line)
+
+    def flush(self, timeout=None):
+        # Returns True if all submitted lines were sent or spooled in time
+        done = threading.Event()
+        with self._cond:
+            self._flush_events.append(done)
+            self._cond.notify_all()
+        return done.wait(timeout)
+
+    def close(self, timeout=30):
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        self._close_connection()
+
+    # Sender thread
+
+    def _wait_work(self):
+        # With the lock held, wait until a batch is due, a flush or a spool retry
+        while not (self._closing or self._flush_events):
+            if self._pending:
+                if len(self._pending) >= self.batch_lines or self._pending_bytes >= self.batch_bytes:
+                    return
+                timeout = self._t_first + self.flush_interval - time.monotonic()
+            elif len(self.spool):
+                timeout = self._next_attempt - time.monotonic()
+            else:
+                timeout = None
+            if timeout is not None and timeout <= 0:
+                return
+            self._cond.wait(timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._wait_work()
+                lines, self._pending, self._pending_bytes = self._pending, [], 0
+                flush_events, self._flush_events = self._flush_events, []
+                closing = self._closing
+
+            try:
+                self._send_lines(lines)
+                self._replay(force=closing)
+            except Exception as e:
+                # e.g. spool disk full: keep the thread alive, retry the spool later
+                self.stats["errors"] += 1
+                self._backoff()
+                print(f"Telegraf exporter error: {e}", error=True, every=10)
+            for done in flush_events:
+                done.set()
+            if closing:
+                return
+
+    def _send_lines(self, lines):
+        self.stats["lines"] += len(lines)
+        batch, batch_size = [], 0
+        for line in lines:
+            batch.append(line)
+            batch_size += len(line) + 1
+            if len(batch) >= self.batch_lines or batch_size >= self.batch_bytes:
+                self._ship_or_drop(batch)
+                batch, batch_size = [], 0
+        if batch:
+            self._ship_or_drop(batch)
+
+    def _ship_or_drop(self, batch):
+        try:
+            self._ship(batch)
+        except OSError as e:
+            # Couldn't spool it either: lost, the next batches are still tried
+            self.stats["lines_dropped"] += len(batch)
+            print(f"Telegraf batch of {len(batch)} lines lost, can't spool it: {e}", error=True, every=10)
+
+    def _ship(self, lines):
+        body = ("\n".join(lines) + "\n").encode("utf-8")
+        if self.compress:
+            body = gzip.compress(body, compresslevel=5)
+        # Keep order: if there's anything spooled, this goes after it
+        if len(self.spool) == 0 and time.monotonic() >= self._next_attempt:
+            if self._try_send(body):
+                return
+        self.spool.push(body)
+        self.stats["batches_spooled"] += 1
+
+    def _replay(self, force=False):
+        # force: one last attempt when closing, ignoring the backoff
+        while len(self.spool) and (force or time.monotonic() >= self._next_attempt):
+            body = self.spool.peek()
+            if body is None:
+                print("Telegraf spooled batch missing, skipping it", warning=True)
+                self.spool.pop()
+                continue
+            if not self._try_send(body):
+                return
+            self.spool.pop()
+            self.stats["batches_replayed"] += 1
+
+    def _try_send(self, body):
+        try:
+            self._post(body)
+        except RejectedError as e:
+            # Bad data, don't block the queue with it
+            print(f"Telegraf rejected batch, discarding it: {e}", error=True)
+            self.stats["batches_rejected"] += 1
+            return True
+        except (SendError, OSError, http.client.HTTPException) as e:
+            self._close_connection()
+            self.stats["send_failures"] += 1
+            delay = self._backoff()
+            if self._failures == 1 or self._failures % 10 == 0:
+                print(f"Telegraf unavailable ({e}), spooling. Retry in {delay:.1f} s", warning=True)
+            return False
+        if self._failures:
+            print(f"Telegraf available again after {self._failures} failed attempts")
+        self._failures = 0
+        self._next_attempt = 0.0
+        self.stats["batches_sent"] += 1
+        self.stats["bytes_sent"] += len(body)
+        return True
+
+    def _backoff(self):
+        # Delays the next send or replay after a failure, returns the delay
+        self._failures += 1
+        delay = min(BACKOFF_INITIAL * 2 ** (self._failures - 1), BACKOFF_MAX)
+        delay *= random.uniform(0.5, 1.0)  # Jitter, avoid synchronized retries
+        self._next_attempt = time.monotonic() + delay
+        return delay
+
+    def _post(self, body):
+        if self._connection is None:
+            self._connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self.stats["connections"] += 1
+        headers = {"Content-Type": "text/plain; charset=utf-8"}
+        if self.compress:
+            headers["Content-Encoding"] = "gzip"
+        self._connection.request("POST", self.path, body=body, headers=headers)
+        response = self._connection.getresponse()
+        detail = response.read()  # Needed to reuse the connection
+        if response.getheader("Connection", "").lower() == "close":
+            self._close_connection()
+        if 200 <= response.status < 300:
+            return
+        message = f"HTTP {response.status}: {detail[:200].decode('utf-8', 'replace')}"
+        if 400 <= response.status < 500 and response.status not in (408, 429):
+            raise RejectedError(message)
+        raise SendError(message)
+
+    def _close_connection(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+def run_benchmark(n_lines=200_000, outage=2.0):
+    # Exporter against a local stand-in listener: throughput, then an outage
+    import tempfile
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+    received = []
+    listener = {"down": False, "connections": 0}
+
+    class ListenerHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # Keep-alive, like Telegraf
+
+        def setup(self):
+            super().setup()
+            listener["connections"] += 1
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            if listener["down"]:
+                self.send_response(503)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if self.headers.get("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+            received.extend(body.decode("utf-8").splitlines())
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    class Listener(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    server = Listener(("127.0.0.1", 0), ListenerHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/telegraf"
+    lines = [
+        defect_line(idx, 0.9, 6.9 + idx * 1e-6, 79.86 + idx * 1e-6, "fastener", 1735718400000000000 + idx)
+        for idx in range(n_lines)
+    ]
+
+    with tempfile.TemporaryDirectory() as spool_dir:
+        exporter = TelegrafExporter(url, spool_dir)
+        t_start = time.perf_counter()
+        exporter.submit_many(lines)
+        exporter.flush()
+        elapsed = time.perf_counter() - t_start
+        raw_bytes = sum(len(line) + 1 for line in lines)
+        print(
+            f"Sent {n_lines} lines in {elapsed:.2f} s: {n_lines / elapsed:,.0f} lines/s, "
+            f"{exporter.stats['batches_sent']} requests over {listener['connections']} connection(s), "
+            f"gzip {raw_bytes / exporter.stats['bytes_sent']:.1f}x"
+        )
+        assert received == lines, "Listener didn't receive all lines in order"
+
+        # Outage: listener fails for a while, lines are spooled and replayed after it
+        received.clear()
+        listener["down"] = True
+        for line in lines[: n_lines // 2]:
+            exporter.submit(line)
+        exporter.flush()
+        print(f"Listener down: {len(exporter.spool)} batches spooled, {len(received)} lines received")
+        time.sleep(outage)
+        listener["down"] = False
+        exporter.submit_many(lines[n_lines // 2 :])
+        t_start = time.perf_counter()
+        while len(received) < n_lines and time.perf_counter() - t_start < BACKOFF_MAX * 2:
+            exporter.flush()
+            time.sleep(0.1)
+        exporter.close()
+        print(
+            f"Listener back: {len(received)} lines received in "
+            f"{time.perf_counter() - t_start:.2f} s, stats: {exporter.stats}"
+        )
+        assert received == lines, "Lines lost or reordered after the outage"
+    server.shutdown()
+    print("[green]OK[/green]")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description="Telegraf exporter benchmark")
+    arg_parser.add_argument("--lines", type=int, default=200_000)
+    args = arg_parser.parse_args()
+    run_benchmark(args.lines)
@@ -1,6 +1,8 @@
-from .config import config
-from gi.repository import GLib
+import os
+import signal
 import socket
+import threading
+from gi.repository import GLib
 
 ADDRESS_UNKNOWN_LABEL = "<device-address-not-configured>"
 
@@ -16,7 +18,7 @@ def get_local_ip():
         s.close()
     return IP
 
-def get_ip_address():
+def get_ip_address(config):
     result_value = config["maskcam"]["device-address"].strip()
     if not result_value or result_value == "0":
         result_value = get_local_ip()        
@@ -34,16 +36,61 @@ def format_tdelta(time_delta):
     return f"{time_delta}".split(".")[0]  # Remove nanoseconds
 
 
-def glib_cb_restart(t_restart):
-    # Timer to avoid GLoop locking infinitely
-    # We want to run g_context.iteration(may_block=True)
-    # since may_block=False will use high CPU,
-    # and adding sleeps lags event processing.
-    # But we want to check periodically for other events
-    GLib.timeout_add(t_restart, glib_cb_restart, t_restart)
+def glib_watch_interrupt(e_interrupt, callback, *args):
+    """Call callback(*args) from the GLib loop once e_interrupt is set.
+    A helper thread blocks on the event (threading or mp) and writes to a pipe
+    watched by the loop, so the loop can sleep until there's actual work
+    instead of waking up periodically to poll the event.
+    The pipe is also the signal wakeup fd: Python signal handlers (like SIGINT
+    setting e_interrupt) run right away even if the loop is blocked in C code.
+    Returns a function to call once the loop has ended: it restores the
+    previous wakeup fd and closes the pipe.
+    """
+    read_fd, write_fd = os.pipe()
+    os.set_blocking(read_fd, False)
+    os.set_blocking(write_fd, False)
+    previous_wakeup_fd = None
+    if threading.current_thread() is threading.main_thread():
+        previous_wakeup_fd = signal.set_wakeup_fd(write_fd)
+    # The helper may still be waiting at close (loop ended by EOS or error)
+    lock = threading.Lock()
+    closed = [False]
+
+    def wait_interrupt():
+        e_interrupt.wait()
+        with lock:
+            if not closed[0]:
+                os.write(write_fd, b"\0")
+
+    def cb_wakeup(fd, condition):
+        try:
+            while os.read(fd, 64):
+                pass
+        except BlockingIOError:
+            pass
+        if not e_interrupt.is_set():
+            return True  # Woken up by a signal that didn't set the interrupt
+        callback(*args)
+        return False  # Only once
+
+    def close():
+        # Not from cb_wakeup: PyGObject's loop.run() restores the wakeup fd it found
+        if previous_wakeup_fd is not None:
+            signal.set_wakeup_fd(previous_wakeup_fd)
+        with lock:
+            closed[0] = True
+            source = GLib.MainContext.default().find_source_by_id(source_id)
+            if source is not None:
+                source.destroy()  # Loop ended without the interrupt
+            os.close(write_fd)
+            os.close(read_fd)
+
+    threading.Thread(target=wait_interrupt, daemon=True).start()
+    source_id = GLib.io_add_watch(read_fd, GLib.PRIORITY_DEFAULT, GLib.IOCondition.IN, cb_wakeup)
+    return close
 
 
 def load_udp_ports_filesaving(config, udp_ports_pool):
-    for port in config["maskcam"]["udp-ports-filesave"].split(","):
-        udp_ports_pool.add(int(port))
+    for port in config["maskcam"]["udp-ports-filesave"]:
+        udp_ports_pool.add(port)
     return udp_ports_pool
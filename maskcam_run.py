@@ -12,8 +12,8 @@ from datetime import datetime, timedelta
 import queue
 import threading
 
-from maskcam.prints import print_run as print
-from maskcam.config import config, print_config_overrides
+from maskcam.prints import print_run as print, configure_logging
+from maskcam.config import config, get_config, print_config_overrides, ConfigError
 from maskcam.common import USBCAM_PROTOCOL, RASPICAM_PROTOCOL
 from maskcam.common import (
     CMD_FILE_SAVE,
@@ -22,6 +22,7 @@ from maskcam.common import (
     CMD_INFERENCE_RESTART,
     CMD_FILESERVER_RESTART,
     CMD_STATUS_REQUEST,
+    CMD_SHUTDOWN,
 )
 from maskcam.utils import (
     get_ip_address,
@@ -34,14 +35,43 @@ from maskcam.maskcam_inference import main as inference_main
 from maskcam.maskcam_filesave import main as filesave_main
 from maskcam.maskcam_fileserver import main as fileserver_main
 from maskcam.maskcam_streaming import main as streaming_main
-from maskcam.save_serial import main as save_serial_main
+from maskcam.save_serial import main as save_serial_main, get_log_path
+from maskcam.gps import locate_positions, local_to_epoch_ns, parse_times, seconds_to_timedelta
+from maskcam.gps_ring import GpsRing
+from maskcam.telegraf_exporter import TelegrafExporter, defect_line
+from maskcam.metrics import (
+    SharedMetrics,
+    INFERENCE_METRICS,
+    INFERENCE_EXPIRING,
+    SERIAL_METRICS,
+    SERIAL_EXPIRING,
+    start_status_server,
+)
+from maskcam.control import (
+    get_control_socket_path,
+    start_control_server,
+    stop_control_server,
+)
+from maskcam.retention import RetentionManager
+from maskcam.outputs import OutputConsumers
+from maskcam.snapshot import SharedFrame, snapshot_size
+from maskcam.catalog import (
+    open_catalog,
+    KIND_STATISTICS,
+    KIND_GRASS,
+    KIND_GPS_LOG,
+    KIND_VIDEO,
+)
 
 udp_ports_pool = set()
 console = Console()
 # Use threading.Event instead of mp.Event() for sigint_handler, see:
 # https://bugs.python.org/issue41606
 e_interrupt = threading.Event()
-q_commands = mp.Queue(maxsize=4)
+# Wakes up the main loop on new commands or interrupts
+e_wakeup = threading.Event()
+# Items are (command, reply), reply is a Future for commands from the control socket
+q_commands = queue.Queue(maxsize=4)
 active_filesave_processes = []
 
 P_INFERENCE = "inference"
@@ -49,8 +79,18 @@ P_STREAMING = "streaming"
 P_FILESERVER = "file-server"
 P_FILESAVE_PREFIX = "file-save-"
 P_SAVESERIAL = "save-serial"
+FRAGMENTED_FINISH_TIMEOUT = 2  # seconds, max. wait for a fragmented file-save to end
 
 processes_info = {}
+# Held while changing processes_info and active_filesave_processes, which the
+# status server thread reads (get_status)
+state_lock = threading.Lock()
+processes_metrics = {}  # Shared metrics blocks, by process name (see maskcam/metrics.py)
+commands_dropped = 0
+catalog = None  # Session catalog, see maskcam/catalog.py
+run_id = None
+retention = None  # Disk retention, see maskcam/retention.py
+output_consumers = None  # Readers of each UDP output, see maskcam/outputs.py
 all_grass_statistics = [] # New list to store grass events from the queue
 
 def write_statistics_async(stats_dir, data, stats_file_name):
@@ -71,6 +111,7 @@ def write_statistics_async(stats_dir, data, stats_file_name):
 def sigint_handler(sig, frame):
     print("[red]Ctrl+C pressed. Interrupting all processes...[/red]")
     e_interrupt.set()
+    e_wakeup.set()
 
 
 def start_process(name, target_function, config, **kwargs):
@@ -84,44 +125,152 @@ def start_process(name, target_function, config, **kwargs):
             **kwargs,
         ),
     )
-    processes_info[name] = {"started": datetime.now(), "running": True}
     process.start()
+    with state_lock:
+        restarts = processes_info[name]["restarts"] + 1 if name in processes_info else 0
+        processes_info[name] = {
+            "started": datetime.now(),
+            "running": True,
+            "restarts": restarts,
+            "pid": process.pid,
+        }
     print(f"Process [yellow]{name}[/yellow] started with PID: {process.pid}")
     return process, e_interrupt_process
 
 
-def terminate_process(name, process, e_interrupt_process, delete_info=False):
+def start_save_serial(config, gps_ring):
+    # New GPS log on each (re)start, registered in the catalog before it's written
+    gps_log_path = get_log_path(config["serial"]["output-directory"])
+    if catalog is not None:
+        catalog.add_artifact(run_id, KIND_GPS_LOG, gps_log_path)
+    process, e_interrupt_process = start_process(
+        P_SAVESERIAL,
+        save_serial_main,
+        config,
+        metrics=processes_metrics[P_SAVESERIAL],
+        gps_ring=gps_ring,
+        file_path=gps_log_path,
+    )
+    return process, e_interrupt_process, gps_log_path
+
+
+def terminate_process(name, process, e_interrupt_process, delete_info=False, timeout=10):
     print(f"Sending interrupt to {name} process")
     e_interrupt_process.set()
     print(f"Waiting for process [yellow]{name}[/yellow] to terminate...")
-    process.join(timeout=10)
+    process.join(timeout=timeout)
     if process.is_alive():
         print(
             f"[red]Forcing termination of process:[/red] [bold]{name}[/bold]",
             warning=True,
         )
         process.terminate()
-    if name in processes_info:
-        if delete_info:
-            del processes_info[name]  # Sequential processes, avoid filling memory
-        else:
-            processes_info[name].update({"ended": datetime.now(), "running": False})
+    with state_lock:
+        if name in processes_info:
+            if delete_info:
+                del processes_info[name]  # Sequential processes, avoid filling memory
+            else:
+                processes_info[name].update({"ended": datetime.now(), "running": False})
     print(f"Process terminated: [yellow]{name}[/yellow]\n")
 
 
-def new_command(command):
-    if q_commands.full():
+def new_command(command, reply=None):
+    global commands_dropped
+    try:
+        q_commands.put_nowait((command, reply))
+    except queue.Full:
         print(f"Command {command} IGNORED. Queue is full.", error=True)
-        return
+        commands_dropped += 1
+        return False
     print(f"Received command: [yellow]{command}[/yellow]")
-    q_commands.put_nowait(command)
+    e_wakeup.set()
+    return True
+
+
+def get_status(stats_queue, grass_stats_queue, disk_dirs):
+    # Snapshot of the whole system, served by the status server and CMD_STATUS_REQUEST
+    now = datetime.now()
+    with state_lock:
+        processes_copy = {name: dict(info) for name, info in processes_info.items()}
+        segments = [p["filename"] for p in active_filesave_processes]
+    processes = {}
+    for name, info in processes_copy.items():
+        processes[name] = {
+            "pid": info.get("pid"),
+            "running": int(info["running"]),
+            "started": info["started"],
+            "uptime_seconds": (now - info["started"]).total_seconds() if info["running"] else 0,
+            "restarts": info["restarts"],
+        }
+
+    inference_metrics = processes_metrics[P_INFERENCE].snapshot()
+    queues = {
+        "stats": {"depth": stats_queue.qsize(), "drops": inference_metrics["stats_queue_drops"]},
+        "grass": {
+            "depth": grass_stats_queue.qsize(),
+            "drops": inference_metrics["grass_queue_drops"],
+        },
+        "commands": {"depth": q_commands.qsize(), "drops": commands_dropped},
+    }
+
+    disk = {}
+    for disk_name, path in disk_dirs.items():
+        try:
+            usage = shutil.disk_usage(path)
+        except OSError:
+            continue
+        disk[disk_name] = {"path": path, "free_bytes": usage.free, "total_bytes": usage.total}
+
+    status = {
+        "time": now,
+        "processes": processes,
+        "inference": {
+            field: value
+            for field, value in inference_metrics.items()
+            if not field.endswith("_queue_drops")
+        },
+        "queues": queues,
+        "filesave": {
+            "active_segments": len(segments),
+            "segments": segments,
+        },
+        "disk": disk,
+    }
+    if P_SAVESERIAL in processes_metrics:
+        status["serial"] = processes_metrics[P_SAVESERIAL].snapshot()
+    if retention is not None:
+        status["retention"] = retention.status()
+    if output_consumers is not None:
+        status["outputs"] = {str(port): count for port, count in output_consumers.snapshot().items()}
+    return status
+
+
+def print_status(status):
+    print("[yellow]Status report[/yellow]")
+    for name, info in status["processes"].items():
+        print(
+            f"  {name}: running={info['running']} restarts={info['restarts']}"
+            f" uptime={format_tdelta(timedelta(seconds=info['uptime_seconds']))}"
+        )
+    inference = status["inference"]
+    print(
+        f"  inference: {inference['fps']:.1f} FPS | probe latency (ms)"
+        f" p50={inference['probe_latency_p50']:.1f} p99={inference['probe_latency_p99']:.1f}"
+    )
+    for queue_name, queue_info in status["queues"].items():
+        print(f"  queue {queue_name}: depth={queue_info['depth']} drops={queue_info['drops']:g}")
+    print(f"  file-save active segments: {status['filesave']['active_segments']}")
+    for disk_name, disk_info in status["disk"].items():
+        print(f"  disk {disk_name} ({disk_info['path']}): {disk_info['free_bytes'] / 2**30:.2f} GB free")
+    if "serial" in status:
+        print(f"  serial: {status['serial']['lines_per_second']:.1f} lines/s")
 
 
 def is_alert_condition(statistics, config):
     # Thresholds config
-    max_total_tracks = int(config["maskcam"]["alert-max-total-tracks"])
-    min_visible_tracks = int(config["maskcam"]["alert-min-visible-tracks"])
-    max_defective = float(config["maskcam"]["alert-defective-fraction"])
+    max_total_tracks = config["maskcam"]["alert-max-total-tracks"]
+    min_visible_tracks = config["maskcam"]["alert-min-visible-tracks"]
+    max_defective = config["maskcam"]["alert-defective-fraction"]
 
     # Calculate visible tracks
     defective = int(statistics["tracks_defective"])
@@ -137,12 +286,61 @@ def is_alert_condition(statistics, config):
     print(f"[yellow]ALERT condition: {is_alert}[/yellow]")
     return is_alert
 
+def tag_defects_position(defects, gps_ring, config):
+    # Add the position at detection time to each defect, from the latest fixes
+    # published by save_serial. Untagged defects are located after the run
+    # by compare_time_get_gps.py
+    fixes = gps_ring.snapshot()
+    if len(fixes) == 0:
+        return
+    times = parse_times([defect["detection_time"] for defect in defects])
+    times = times + seconds_to_timedelta(config["gps"]["clock-offset"])
+    lats, lons, interpolated, located = locate_positions(
+        fixes,
+        times,
+        method=config["gps"]["interpolation"],
+        max_gap=config["gps"]["max-gap"],
+    )
+    for idx, defect in enumerate(defects):
+        if located[idx]:
+            defect["lat"] = float(lats[idx])
+            defect["lon"] = float(lons[idx])
+            defect["gps_time"] = str(times[idx])
+            defect["gps_method"] = "interpolated" if interpolated[idx] else "nearest"
+
+
+def export_defects(defects, exporter, species):
+    # Stream tagged defects to Telegraf (batched and spooled by the exporter)
+    tagged = [defect for defect in defects if "lat" in defect]
+    if not tagged:
+        return
+    timestamps_ns = local_to_epoch_ns(parse_times([defect["gps_time"] for defect in tagged]))
+    for defect, timestamp_ns in zip(tagged, timestamps_ns):
+        exporter.submit(
+            defect_line(
+                defect["track_id"],
+                defect.get("confidence", 0),
+                defect["lat"],
+                defect["lon"],
+                species,
+                timestamp_ns,
+            )
+        )
+
+
 # handle_statistics gets called every 0.1 seconds
-def handle_statistics(stats_queue, config, is_live_input, all_statistics):    
+def handle_statistics(
+    stats_queue, config, is_live_input, all_statistics, gps_ring=None, exporter=None, species=None
+):
     while not stats_queue.empty():
         try:
             statistics = stats_queue.get_nowait() # get stats in a non blocking way
+            if gps_ring is not None:
+                tag_defects_position(statistics, gps_ring, config)
+                if exporter is not None:
+                    export_defects(statistics, exporter, species)
             all_statistics.append(statistics) # add them
+            count_clip_defects(len(statistics))
 
             # if is_live_input:
             #     # Alert conditions detection
@@ -201,8 +399,9 @@ def handle_file_saving(
             latest_number = active_process["number"]
 
     # Remove terminated processes from list in a separated loop
-    for idx in sorted(terminated_idxs, reverse=True):
-        del active_filesave_processes[idx]
+    with state_lock:
+        for idx in sorted(terminated_idxs, reverse=True):
+            del active_filesave_processes[idx]
 
     # Start new file-saving process if time has elapsed
     if latest_start is None or (datetime.now() - latest_start >= period):
@@ -222,27 +421,37 @@ def handle_file_saving(
             output_filename=new_filepath,
             udp_port=new_udp_port,
         )
-        active_filesave_processes.append(
-            dict(
-                number=new_process_number,
-                name=new_process_name,
-                filepath=new_filepath,
-                filename=new_filename,
-                started=datetime.now(),
-                process_handler=process_handler,
-                e_interrupt=e_interrupt_process,
-                flag_keep_file=False,
-                udp_port=new_udp_port,
+        if output_consumers is not None:
+            output_consumers.set(new_udp_port, 1)
+        if catalog is not None:
+            catalog.add_artifact(run_id, KIND_VIDEO, new_filepath)
+        with state_lock:
+            active_filesave_processes.append(
+                dict(
+                    number=new_process_number,
+                    name=new_process_name,
+                    filepath=new_filepath,
+                    filename=new_filename,
+                    started=datetime.now(),
+                    process_handler=process_handler,
+                    e_interrupt=e_interrupt_process,
+                    flag_keep_file=False,
+                    udp_port=new_udp_port,
+                    defects=0,
+                )
             )
-        )
 
 
 def finish_filesave_process(active_process, hdd_dir, force_filesave):
+    if output_consumers is not None:
+        output_consumers.set(active_process["udp_port"], 0)
     terminate_process(
         active_process["name"],
         active_process["process_handler"],
         active_process["e_interrupt"],
         delete_info=True,
+        # Fragmented files are valid without EOS, don't wait long for it
+        timeout=FRAGMENTED_FINISH_TIMEOUT if config["maskcam"]["recording-fragment-ms"] else 10,
     )
     release_udp_port(active_process["udp_port"])
 
@@ -253,9 +462,22 @@ def finish_filesave_process(active_process, hdd_dir, force_filesave):
         print(f"Permanent video file created: [green]{definitive_filepath}[/green]")
         # Must use shutil here to move RAM->HDD
         shutil.move(active_process["filepath"], definitive_filepath)
+        if catalog is not None:
+            catalog.end_artifact(active_process["filepath"], new_path=definitive_filepath)
+            if active_process["defects"]:
+                # Kept longest by retention
+                catalog.set_defects(definitive_filepath, active_process["defects"])
     else:
         print(f"Removing RAM video file: {active_process['filepath']}")
         os.remove(active_process["filepath"])
+        if catalog is not None:
+            catalog.remove_artifact(active_process["filepath"])
+
+
+def count_clip_defects(n_defects):
+    # Defects detected now are in every clip being recorded
+    for process in active_filesave_processes:
+        process["defects"] += n_defects
 
 
 def flag_keep_current_files():
@@ -276,6 +498,11 @@ if __name__ == "__main__":
     process_streaming = None
     process_save_serial = None
     e_interrupt_save_serial = None
+    gps_log_path = None
+    gps_ring = None
+    telegraf_exporter = None
+    status_server = None
+    control_server = None
 
     if len(sys.argv) > 2:
         print(
@@ -295,6 +522,14 @@ if __name__ == "__main__":
         """
         )
         sys.exit(0)
+    try:
+        # Parse and validate config once, children receive this snapshot
+        config = get_config()
+    except ConfigError as e:
+        print(str(e), error=True)
+        sys.exit(1)
+    configure_logging(config)
+
     try:
         # Print any ENV var config override to avoid confusions
         print_config_overrides()
@@ -322,21 +557,21 @@ if __name__ == "__main__":
         is_live_input = is_usbcamera or is_raspicamera
 
         # Streaming enabled by default?
-        streaming_autostart = int(config["maskcam"]["streaming-start-default"])
+        streaming_autostart = config["maskcam"]["streaming-start-default"]
 
         # Fileserver: sequentially save videos (only for camera input)
-        fileserver_enabled = is_live_input and int(config["maskcam"]["fileserver-enabled"])
-        fileserver_period = int(config["maskcam"]["fileserver-video-period"])
-        fileserver_duration = int(config["maskcam"]["fileserver-video-duration"])
-        fileserver_force_save = int(config["maskcam"]["fileserver-force-save"])
+        fileserver_enabled = is_live_input and config["maskcam"]["fileserver-enabled"]
+        fileserver_period = config["maskcam"]["fileserver-video-period"]
+        fileserver_duration = config["maskcam"]["fileserver-video-duration"]
+        fileserver_force_save = config["maskcam"]["fileserver-force-save"]
         fileserver_ram_dir = config["maskcam"]["fileserver-ram-dir"]
         fileserver_hdd_dir = config["maskcam"]["fileserver-hdd-dir"]
 
         # Save serial: save serial data to a file
-        save_serial_enabled = int(config["maskcam"]["save_serial"])
+        save_serial_enabled = config["maskcam"]["save_serial"]
 
         # Inference restart timeout
-        tout_inference_restart = int(config["maskcam"]["timeout-inference-restart"])
+        tout_inference_restart = config["maskcam"]["timeout-inference-restart"]
         if is_live_input and tout_inference_restart:
             tout_inference_restart = timedelta(seconds=tout_inference_restart)
         else:
@@ -345,6 +580,29 @@ if __name__ == "__main__":
         # Filesave processes: load available ports
         load_udp_ports_filesaving(config, udp_ports_pool)
 
+        # Only draw, encode and send the video that is being read
+        if config["maskcam"]["output-on-demand"]:
+            output_consumers = OutputConsumers(
+                udp_ports_pool | {config["maskcam"]["udp-port-streaming"]}
+            )
+
+        # Shared metrics blocks, written by children and read on status requests
+        processes_metrics[P_INFERENCE] = SharedMetrics(INFERENCE_METRICS, INFERENCE_EXPIRING)
+        if save_serial_enabled:
+            processes_metrics[P_SAVESERIAL] = SharedMetrics(SERIAL_METRICS, SERIAL_EXPIRING)
+
+        # Latest output frame, written by inference and served by the file server
+        shared_frame = None
+        if config["maskcam"]["snapshot-enabled"]:
+            shared_frame = SharedFrame(*snapshot_size(config))
+
+        # Latest GPS fixes from save_serial, to tag defects while running
+        gps_ring = None
+        if save_serial_enabled and config["gps"]["live-tagging"]:
+            gps_ring = GpsRing()
+            if config["telegraf"]["live-export"]:
+                telegraf_exporter = TelegrafExporter.from_config(config, "maskcam-run")
+
         # Should only have 1 element at a time unless this thread gets blocked
         stats_queue = mp.Queue(maxsize=5)
         grass_stats_queue = mp.Queue() # New queue for grass statistics
@@ -362,7 +620,7 @@ if __name__ == "__main__":
 
         if fileserver_enabled:
             process_fileserver, e_interrupt_fileserver = start_process(
-                P_FILESERVER, fileserver_main, config, directory=fileserver_hdd_dir
+                P_FILESERVER, fileserver_main, config, directory=fileserver_hdd_dir, shared_frame=shared_frame
             )
 
         if streaming_autostart:
@@ -380,10 +638,13 @@ if __name__ == "__main__":
             stats_queue=stats_queue, #created stats queue is passed to inference process
             grass_stats_queue=grass_stats_queue, # Pass the new grass queue
             e_ready=e_inference_ready,
+            metrics=processes_metrics[P_INFERENCE],
+            consumers=output_consumers,
+            shared_frame=shared_frame,
         )
 
         all_statistics = [] 
-        statistics_saving_period = int(config["maskcam"]["statistics-to-json-period"])  # 60 seconds
+        statistics_saving_period = config["maskcam"]["statistics-to-json-period"]  # 60 seconds
         stats_dir = config["maskcam"]["statistics-directory"]  # home directory
         last_write_time = datetime.now()  # Track the last write time
 
@@ -399,24 +660,51 @@ if __name__ == "__main__":
         print(f"Grass events will be saved to: {grass_events_log_file_name}")
         os.makedirs(os.path.dirname(grass_events_log_file_name), exist_ok=True)
 
-        # Write the PID to a unique file for access by other scripts
-        pid = os.getpid()
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        pidfile = f"/tmp/maskcam_run_{timestamp}.pid"
-        with open(pidfile, "w") as f:
-            f.write(str(pid))
-        print(f"PID file is written to : {pidfile}")
+        # Register this run and its files, so scripts find them without guessing
+        catalog = open_catalog(config)
+        if catalog is not None:
+            run_id = catalog.start_run(input_filename, fault_type)
+            catalog.add_artifact(run_id, KIND_STATISTICS, stats_file_name)
+            catalog.add_artifact(run_id, KIND_GRASS, grass_events_log_file_name)
+            print(f"Run {run_id} registered in catalog: {catalog.path}")
+
+        # Keeps the output directories within their quotas, in a background thread
+        if config["retention"]["enabled"]:
+            retention = RetentionManager.from_config(config)
+            retention.start()
+
+        # Control socket for other scripts (see maskcam/control.py)
+        control_server = start_control_server(get_control_socket_path(config), new_command)
+
+        # Local status endpoint (Prometheus /metrics and JSON /status)
+        status_args = (
+            stats_queue,
+            grass_stats_queue,
+            {"ram": fileserver_ram_dir, "hdd": fileserver_hdd_dir},
+        )
+        if config["maskcam"]["status-enabled"]:
+            status_server = start_status_server(
+                config["maskcam"]["status-port"], lambda: get_status(*status_args)
+            )
 
         if save_serial_enabled:
-            process_save_serial, e_interrupt_save_serial = start_process(
-                P_SAVESERIAL, save_serial_main, config
+            process_save_serial, e_interrupt_save_serial, gps_log_path = start_save_serial(
+                config, gps_ring
             )
 
         # MAIN PROGRAM LOOP    
         while not e_interrupt.is_set():
             # handle_statistics gets called 0.1 seconds to check if there are any stats in the stats_queue
             # Retrieves statistics from stats_queue and appends them to all_statistics,
-            handle_statistics(stats_queue, config, is_live_input, all_statistics)
+            handle_statistics(
+                stats_queue,
+                config,
+                is_live_input,
+                all_statistics,
+                gps_ring,
+                telegraf_exporter,
+                fault_type,
+            )
             handle_grass_statistics(grass_stats_queue, all_grass_statistics) # Handle grass stats
             current_time = datetime.now()
             
@@ -442,16 +730,19 @@ if __name__ == "__main__":
                     )
 
             if not q_commands.empty():
-                command = q_commands.get_nowait()
+                command, reply = q_commands.get_nowait()
                 print(f"Processing command: [yellow]{command}[yellow]")
+                result = None
                 if command == CMD_STREAMING_START:
                     if process_streaming is None or not process_streaming.is_alive():
                         process_streaming, e_interrupt_streaming = start_process(
-                            P_STREAMING, streaming_main, config
+                            P_STREAMING, streaming_main, config, consumers=output_consumers
                         )
                 elif command == CMD_STREAMING_STOP:
                     if process_streaming is not None and process_streaming.is_alive():
                         terminate_process(P_STREAMING, process_streaming, e_interrupt_streaming)
+                    if output_consumers is not None:
+                        output_consumers.set(config["maskcam"]["udp-port-streaming"], 0)
                 elif command == CMD_INFERENCE_RESTART:
                     if process_inference.is_alive():
                         terminate_process(P_INFERENCE, process_inference, e_interrupt_inference)
@@ -462,6 +753,9 @@ if __name__ == "__main__":
                         input_filename=input_filename,
                         output_filename=output_filename,
                         stats_queue=stats_queue,
+                        metrics=processes_metrics[P_INFERENCE],
+                        consumers=output_consumers,
+                        shared_frame=shared_frame,
                     )
                 elif command == CMD_FILESERVER_RESTART:
                     if process_fileserver is not None and process_fileserver.is_alive():
@@ -471,14 +765,26 @@ if __name__ == "__main__":
                         fileserver_main,
                         config,
                         directory=fileserver_hdd_dir,
+                        shared_frame=shared_frame,
                     )
                     fileserver_enabled = True
                 elif command == CMD_FILE_SAVE:
                     flag_keep_current_files()
+                elif command == CMD_STATUS_REQUEST:
+                    result = get_status(*status_args)
+                    print_status(result)
+                elif command == CMD_SHUTDOWN:
+                    print("[red]Shutdown command received. Interrupting all processes...[/red]")
+                    e_interrupt.set()
                 else:
                     print("[red]Command not recognized[/red]", error=True)
+                    if reply is not None:
+                        reply.set_exception(ValueError(f"Command not recognized: {command}"))
+                if reply is not None and not reply.done():
+                    reply.set_result(result)
             else:
-                e_interrupt.wait(timeout=15)
+                e_wakeup.wait(timeout=15)
+                e_wakeup.clear()
 
             # Routine check: finish loop if the inference process is dead
             if not process_inference.is_alive():
@@ -498,8 +804,10 @@ if __name__ == "__main__":
             if save_serial_enabled:
                 if process_save_serial is not None and not process_save_serial.is_alive():
                     print("[red]save_serial process died. Restarting...[/red]")
-                    process_save_serial, e_interrupt_save_serial = start_process(
-                        P_SAVESERIAL, save_serial_main, config
+                    if catalog is not None:
+                        catalog.end_artifact(gps_log_path)
+                    process_save_serial, e_interrupt_save_serial, gps_log_path = start_save_serial(
+                        config, gps_ring
                     )
 
         
@@ -517,6 +825,10 @@ if __name__ == "__main__":
     while not stats_queue.empty():
         try:
             statistics = stats_queue.get_nowait()
+            if gps_ring is not None:
+                tag_defects_position(statistics, gps_ring, config)
+                if telegraf_exporter is not None:
+                    export_defects(statistics, telegraf_exporter, fault_type)
             all_statistics.append(statistics)
         except queue.Empty:
             break
@@ -546,6 +858,13 @@ if __name__ == "__main__":
             print(f"Error writing final grass events: {str(e)}")
         all_grass_statistics.clear()
 
+    # Whatever Telegraf didn't accept stays in the spool for the next run
+    if telegraf_exporter is not None:
+        try:
+            telegraf_exporter.close()
+        except:  # noqa
+            console.print_exception()
+
     # Terminate all running processes, avoid breaking on any exception
     for active_file_process in active_filesave_processes:
         try:
@@ -572,9 +891,33 @@ if __name__ == "__main__":
     except:  # noqa
         console.print_exception()
 
+    if status_server is not None:
+        status_server.shutdown()
+
+    if retention is not None:
+        try:
+            retention.stop()
+        except:  # noqa
+            console.print_exception()
+
     # Terminate save_serial process
     try:
         if process_save_serial is not None and process_save_serial.is_alive():
             terminate_process(P_SAVESERIAL, process_save_serial, e_interrupt_save_serial)
     except:  # noqa
         console.print_exception()
+
+    # Close time ranges in the catalog, files are complete now
+    if catalog is not None:
+        try:
+            for artifact_path in (stats_file_name, grass_events_log_file_name, gps_log_path):
+                if artifact_path is not None:
+                    catalog.end_artifact(artifact_path)
+            catalog.end_run(run_id)
+            catalog.close()
+        except:  # noqa
+            console.print_exception()
+
+    # Removing the socket signals clients that shutdown has finished
+    if control_server is not None:
+        stop_control_server(control_server)
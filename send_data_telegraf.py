@@ -1,14 +1,16 @@
 import os
 import re
-import requests
 from datetime import datetime
 
+from maskcam.config import config
+from maskcam.catalog import open_catalog, KIND_MATCHED_GPS
+from maskcam.telegraf_exporter import TelegrafExporter
+
 # Directory and file pattern
 final_data_dir = "/home/lab5/Desktop/final_data"
 final_data_pattern = re.compile(r"matched_gps_(\d{4}-\d{2}-\d{2})_(\d{2}-\d{2}-\d{2})\.txt")
 
-# Telegraf listener endpoint
-telegraf_url = "http://localhost:8186/telegraf"
+# Telegraf listener endpoint, batching and spool: [telegraf] in maskcam_config.txt
 
 def find_closest_file(directory, pattern):
     now = datetime.now()
@@ -33,29 +35,33 @@ def find_closest_file(directory, pattern):
 
     return closest_file
 
-# Find latest matched file
-matched_file = find_closest_file(final_data_dir, final_data_pattern)
-if not matched_file:
-    print("No matched file found.")
-    exit()
-
-file_path = os.path.join(final_data_dir, matched_file)
+# Find latest matched file: registered by compare_time_get_gps.py, or by filename
+catalog = open_catalog(config)
+matched_artifact = catalog.latest_artifact(KIND_MATCHED_GPS) if catalog is not None else None
+if matched_artifact is not None and os.path.exists(matched_artifact["path"]):
+    file_path = matched_artifact["path"]
+else:
+    matched_file = find_closest_file(final_data_dir, final_data_pattern)
+    if not matched_file:
+        print("No matched file found.")
+        exit()
+    file_path = os.path.join(final_data_dir, matched_file)
 print("Sending file:", file_path)
 
-# Read and send
+# Stream the file in batches. Anything not accepted is spooled and
+# sent on the next run of this script
+exporter = TelegrafExporter.from_config(config, "send-data")
 with open(file_path, 'r') as file:
-    data = file.read()
-
-response = requests.post(
-    telegraf_url,
-    headers={"Content-Type": "text/plain"},
-    data=data
-)
+    exporter.submit_many(line.rstrip("\n") for line in file if line.strip())
+exporter.flush()
+exporter.close()
 
-# Check response
-if response.status_code == 204:
-    print("Data sent successfully to Telegraf.")
+stats = exporter.stats
+if len(exporter.spool) == 0:
+    print(f"Data sent successfully to Telegraf: {stats['lines']} lines in {stats['batches_sent']} requests.")
 else:
-    print(f"Failed to send data: {response.status_code}")
-    print(response.text)
+    print(
+        f"Telegraf unavailable, {len(exporter.spool)} batches spooled in "
+        f"{exporter.spool.directory} to be sent later."
+    )
 
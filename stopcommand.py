@@ -1,50 +1,12 @@
 #!/usr/bin/env python3
 
-import os
-import glob
-from datetime import datetime
 import RPi.GPIO as GPIO
 import time
 import subprocess
-import signal
 
-def find_closest_pidfile(directory="/tmp", prefix="maskcam_run_", suffix=".pid"):
-    # List all matching pid files
-    pattern = os.path.join(directory, f"{prefix}*{suffix}")
-    pidfiles = glob.glob(pattern)
-    if not pidfiles:
-        print("No PID files found.")
-        return None
-
-    # Parse timestamps and find the closest
-    now = datetime.now()
-    closest_file = None
-    closest_time = None
-    min_diff = None
-
-    for pidfile in pidfiles:
-        # Extract timestamp from filename
-        basename = os.path.basename(pidfile)
-        try:
-            timestamp_str = basename[len(prefix):-len(suffix)]
-            file_time = datetime.strptime(timestamp_str, "%Y%m%d_%H%M%S")
-            diff = abs((now - file_time).total_seconds())
-            if min_diff is None or diff < min_diff:
-                min_diff = diff
-                closest_time = file_time
-                closest_file = pidfile
-        except Exception as e:
-            print(f"Skipping file {pidfile}: {e}")
-
-    if closest_file:
-        print(f"Closest PID file: {closest_file} (timestamp: {closest_time})")
-        with open(closest_file, "r") as f:
-            pid = int(f.read().strip())
-        print(f"PID in file: {pid}")
-        return closest_file, pid
-    else:
-        print("No valid PID files found.")
-        return None
+from maskcam.config import config
+from maskcam.common import CMD_SHUTDOWN
+from maskcam.control import get_control_socket_path, send_command, wait_server_closed
 
 def main():
     # Set up GPIO
@@ -58,16 +20,18 @@ def main():
         while True:
             current_input = GPIO.input(13)
             if current_input == 0 and prev_input == 1:
-                print("Switch turned ON. Sending SIGINT (Ctrl+C)...")
-
-                # Find the closest maskcam_run.py PID using the PID file logic
-                result = find_closest_pidfile()
-                if result:
-                    _, pid = result
-                    os.kill(int(pid), signal.SIGINT)
-                    print(f"Sent SIGINT to process {pid} (maskcam_run.py)")
-                else:
-                    print("No running maskcam_run.py process found via PID file.")
+                print("Switch turned ON. Sending shutdown command...")
+
+                # Ask maskcam_run.py to stop through its control socket
+                socket_path = get_control_socket_path(config)
+                try:
+                    reply = send_command(socket_path, CMD_SHUTDOWN)
+                    print(f"Shutdown reply: {reply}")
+                    # Wait until final statistics are written before matching GPS
+                    if not wait_server_closed(socket_path):
+                        print("maskcam_run.py did not finish shutting down in time.")
+                except ConnectionError as e:
+                    print(f"No running maskcam_run.py process found: {e}")
 
                 # Run the 'compare_time_get_gps.py' script
                 print("Running compare_time_get_gps.py...")
@@ -0,0 +1,17 @@
+import os
+import tty
+
+import pytest
+import serial
+
+
+@pytest.fixture
+def pty_serial():
+    # (master fd to write device output to, serial.Serial reading the other end)
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    ser = serial.Serial(os.ttyname(slave), 115200, timeout=0.1)
+    yield master, ser
+    ser.close()
+    os.close(master)
+    os.close(slave)
@@ -0,0 +1,65 @@
+import os
+import time
+import socket
+import threading
+import http.client
+
+import pytest
+
+pytest.importorskip("gi")  # maskcam.utils needs GLib
+
+from maskcam import maskcam_fileserver
+from maskcam.maskcam_fileserver import FileRequestHandler, PooledHTTPServer
+
+
+@pytest.fixture
+def server(tmp_path):
+    (tmp_path / "clip.mp4").write_bytes(os.urandom(100000))
+    httpd = PooledHTTPServer(("127.0.0.1", 0), FileRequestHandler, str(tmp_path), workers=2)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def get(connection, path="/clip.mp4"):
+    connection.request("GET", path)
+    response = connection.getresponse()
+    return response.status, response.read()
+
+
+def test_idle_keepalive_connections_dont_hold_workers(server):
+    port = server.server_address[1]
+    idle = [http.client.HTTPConnection("127.0.0.1", port, timeout=5) for _ in range(10)]
+    for connection in idle:
+        assert get(connection)[0] == 200  # Then left open, kept alive
+    t_start = time.monotonic()
+    status, body = get(http.client.HTTPConnection("127.0.0.1", port, timeout=5))
+    assert status == 200 and len(body) == 100000
+    assert time.monotonic() - t_start < 1
+    assert len(server.idle_connections) >= 10
+    # Parked connections are served again on their next request
+    for connection in idle:
+        assert get(connection)[0] == 200
+        connection.close()
+
+
+def test_idle_keepalive_connections_time_out(server, monkeypatch):
+    monkeypatch.setattr(maskcam_fileserver, "KEEPALIVE_TIMEOUT", 0.2)
+    with socket.create_connection(server.server_address, timeout=5) as conn:
+        conn.sendall(b"HEAD /clip.mp4 HTTP/1.1\r\nHost: x\r\n\r\n")
+        assert conn.recv(4096).startswith(b"HTTP/1.1 200")
+        time.sleep(0.5)
+        assert conn.recv(4096) == b""  # Closed by the server
+    assert len(server.idle_connections) == 0
+
+
+def test_pipelined_requests(server):
+    with socket.create_connection(server.server_address, timeout=5) as conn:
+        conn.sendall(b"HEAD /clip.mp4 HTTP/1.1\r\nHost: x\r\n\r\n" * 2 + b"HEAD /missing HTTP/1.1\r\nHost: x\r\n\r\n")
+        data = b""
+        while data.count(b"HTTP/1.1 ") < 3:
+            chunk = conn.recv(4096)
+            assert chunk
+            data += chunk
+    assert data.count(b"HTTP/1.1 200") == 2 and data.count(b"HTTP/1.1 404") == 1
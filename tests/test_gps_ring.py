@@ -0,0 +1,66 @@
+import os
+import time
+import multiprocessing as mp
+
+import numpy as np
+
+from maskcam.gps_ring import GpsRing
+from maskcam.gps_store import GpsStoreWriter, get_store_path
+from maskcam.save_serial import SerialIngest, get_settings
+
+N_FIXES = 20000
+
+
+def publish_fixes(gps_ring, n_fixes):
+    # Fix i: time i s, lat i, lon -i, so a torn copy is detectable
+    for idx in range(n_fixes):
+        gps_ring.publish(idx * 10 ** 9, float(idx), -float(idx))
+
+
+def test_snapshot_keeps_latest_fixes():
+    gps_ring = GpsRing(size=4)
+    assert len(gps_ring.snapshot()) == 0
+    publish_fixes(gps_ring, 10)
+    fixes = gps_ring.snapshot()
+    assert len(gps_ring) == 4
+    assert fixes.lat.tolist() == [6.0, 7.0, 8.0, 9.0]
+    assert fixes.times.astype(np.int64).tolist() == [idx * 10 ** 9 for idx in range(6, 10)]
+
+
+def test_snapshot_while_publishing_from_another_process():
+    gps_ring = GpsRing(size=16)
+    writer = mp.Process(target=publish_fixes, args=(gps_ring, N_FIXES))
+    writer.start()
+    snapshots = 0
+    while writer.is_alive() or snapshots == 0:
+        fixes = gps_ring.snapshot()
+        snapshots += 1
+        if len(fixes) == 0:
+            continue
+        assert (fixes.lon == -fixes.lat).all()
+        assert (fixes.times.astype(np.int64) == fixes.lat.astype(np.int64) * 10 ** 9).all()
+        assert (np.diff(fixes.lat) == 1).all()  # Consecutive fixes, none missing
+    writer.join()
+    assert writer.exitcode == 0
+    assert gps_ring.snapshot().lat[-1] == N_FIXES - 1
+
+
+def test_fixes_fed_through_a_pty_reach_the_ring(pty_serial, tmp_path):
+    master, ser = pty_serial
+    gps_ring = GpsRing()
+    log_path = str(tmp_path / "gps.txt")
+    settings = get_settings(**{"echo-interval": 0})
+    with open(log_path, "wb") as log_file, GpsStoreWriter(get_store_path(log_path)) as store:
+        ingest = SerialIngest(ser, log_file, store, settings, gps_ring=gps_ring)
+        os.write(master, b"ESP32 status: satellites=9\r\n")
+        for idx in range(5):
+            os.write(master, f"GPS: 6.9{idx}, 79.8{idx} @ 2025-01-01T08:00:0{idx}\r\n".encode())
+        t_end = time.monotonic() + 5
+        while len(gps_ring) < 5 and time.monotonic() < t_end:
+            ingest.poll()
+        ingest.close()
+
+    fixes = gps_ring.snapshot()
+    assert fixes.lat.tolist() == [6.9, 6.91, 6.92, 6.93, 6.94]
+    assert fixes.lon.tolist() == [79.8, 79.81, 79.82, 79.83, 79.84]
+    assert str(fixes.times[-1]) == "2025-01-01T08:00:04.000000000"
@@ -0,0 +1,94 @@
+import os
+import re
+import time
+
+from maskcam.gps_store import GpsStore, GpsStoreWriter, get_store_path
+from maskcam.save_serial import MAX_LINE_LENGTH, SerialIngest, get_settings
+
+ARRIVAL_PREFIX = re.compile(rb"^\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d\.\d{6}\t")
+
+
+def fix_line(idx):
+    return f"GPS: 6.9{idx}, 79.8{idx} @ 2025-01-01T08:00:0{idx}".encode()
+
+
+def poll_until(ingest, done, timeout=5):
+    t_end = time.monotonic() + timeout
+    while not done() and time.monotonic() < t_end:
+        ingest.poll()
+    assert done()
+
+
+def capture(pty_serial, tmp_path, feed, **settings):
+    # Runs feed(master, ingest) on a SerialIngest reading the pty, returns
+    # (log lines, fixes of the GPS store) once it's closed
+    master, ser = pty_serial
+    log_path = str(tmp_path / "esp32_data.txt")
+    settings = get_settings(**{"echo-interval": 0, **settings})
+    with open(log_path, "wb") as log_file, GpsStoreWriter(get_store_path(log_path)) as store:
+        ingest = SerialIngest(ser, log_file, store, settings)
+        feed(master, ingest)
+        ingest.close()
+    with open(log_path, "rb") as log_file:
+        log_lines = log_file.read().splitlines()
+    return log_lines, GpsStore(get_store_path(log_path)).fixes()
+
+
+def test_lines_are_logged_with_arrival_time_and_stored(pty_serial, tmp_path):
+    def feed(master, ingest):
+        os.write(master, b"ESP32 status: satellites=9\r\n" + b"\r\n".join(fix_line(idx) for idx in range(3)) + b"\r\n")
+        poll_until(ingest, lambda: ingest.lines == 4)
+
+    log_lines, fixes = capture(pty_serial, tmp_path, feed)
+    assert all(ARRIVAL_PREFIX.match(line) for line in log_lines)
+    assert [ARRIVAL_PREFIX.sub(b"", line) for line in log_lines] == [b"ESP32 status: satellites=9"] + [
+        fix_line(idx) for idx in range(3)
+    ]
+    assert fixes.lat.tolist() == [6.90, 6.91, 6.92]
+    assert fixes.lon.tolist() == [79.80, 79.81, 79.82]
+
+
+def test_without_arrival_timestamps(pty_serial, tmp_path):
+    def feed(master, ingest):
+        os.write(master, fix_line(0) + b"\n")
+        poll_until(ingest, lambda: ingest.lines == 1)
+
+    log_lines, fixes = capture(pty_serial, tmp_path, feed, **{"arrival-timestamps": 0})
+    assert log_lines == [fix_line(0)]
+    assert len(fixes) == 1
+
+
+def test_line_split_across_reads(pty_serial, tmp_path):
+    def feed(master, ingest):
+        line = fix_line(1)
+        os.write(master, line[:10])
+        poll_until(ingest, lambda: ingest.pending == line[:10])
+        assert ingest.lines == 0
+        os.write(master, line[10:] + b"\r\n")
+        poll_until(ingest, lambda: ingest.lines == 1)
+
+    log_lines, fixes = capture(pty_serial, tmp_path, feed)
+    assert [ARRIVAL_PREFIX.sub(b"", line) for line in log_lines] == [fix_line(1)]
+    assert fixes.lat.tolist() == [6.91]
+
+
+def test_long_line_without_newline_is_written(pty_serial, tmp_path):
+    def feed(master, ingest):
+        os.write(master, b"x" * (MAX_LINE_LENGTH + 1))
+        poll_until(ingest, lambda: ingest.lines == 1)
+        assert ingest.pending == b""
+
+    log_lines, fixes = capture(pty_serial, tmp_path, feed)
+    assert [ARRIVAL_PREFIX.sub(b"", line) for line in log_lines] == [b"x" * (MAX_LINE_LENGTH + 1)]
+    assert len(fixes) == 0
+
+
+def test_close_writes_the_last_line_without_newline(pty_serial, tmp_path):
+    def feed(master, ingest):
+        os.write(master, fix_line(0) + b"\n" + fix_line(1))
+        poll_until(ingest, lambda: ingest.pending == fix_line(1))
+        assert ingest.lines == 1
+
+    log_lines, fixes = capture(pty_serial, tmp_path, feed)
+    assert [ARRIVAL_PREFIX.sub(b"", line) for line in log_lines] == [fix_line(0), fix_line(1)]
+    assert fixes.lat.tolist() == [6.90, 6.91]
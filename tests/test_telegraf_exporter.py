@@ -0,0 +1,128 @@
+import os
+import gzip
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import pytest
+
+from maskcam import telegraf_exporter
+from maskcam.telegraf_exporter import TelegrafExporter, defect_line
+
+
+class Listener(ThreadingMixIn, HTTPServer):
+    # Stand-in for Telegraf's http_listener_v2
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), ListenerHandler)
+        self.received = []
+        self.down = False
+        self.url = f"http://127.0.0.1:{self.server_address[1]}/telegraf"
+
+
+class ListenerHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.server.down:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        self.server.received.extend(body.decode("utf-8").splitlines())
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def listener():
+    server = Listener()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_lines(n_lines):
+    return [defect_line(idx, 0.9, 6.9, 79.86, "fastener", 1735718400000000000 + idx) for idx in range(n_lines)]
+
+
+def wait_received(listener, exporter, n_lines, timeout=10):
+    t_end = time.monotonic() + timeout
+    while len(listener.received) < n_lines and time.monotonic() < t_end:
+        exporter.flush(timeout=1)
+        time.sleep(0.05)
+
+
+def test_lines_arrive_in_order(listener, tmp_path):
+    lines = make_lines(12000)
+    exporter = TelegrafExporter(listener.url, str(tmp_path), batch_lines=5000)
+    exporter.submit_many(lines)
+    assert exporter.flush(timeout=10)
+    exporter.close()
+    assert listener.received == lines
+
+
+def test_outage_is_spooled_and_replayed_in_order(listener, tmp_path, monkeypatch):
+    monkeypatch.setattr(telegraf_exporter, "BACKOFF_INITIAL", 0.05)
+    monkeypatch.setattr(telegraf_exporter, "BACKOFF_MAX", 0.2)
+    lines = make_lines(3000)
+    exporter = TelegrafExporter(listener.url, str(tmp_path), batch_lines=500)
+    listener.down = True
+    exporter.submit_many(lines[:1500])
+    assert exporter.flush(timeout=10)
+    assert len(exporter.spool) > 0 and listener.received == []
+
+    listener.down = False
+    exporter.submit_many(lines[1500:])
+    wait_received(listener, exporter, len(lines))
+    exporter.close()
+    assert listener.received == lines
+    assert len(exporter.spool) == 0
+
+
+def test_spool_errors_dont_stop_the_sender(listener, tmp_path, monkeypatch):
+    monkeypatch.setattr(telegraf_exporter, "BACKOFF_INITIAL", 0.05)
+    monkeypatch.setattr(telegraf_exporter, "BACKOFF_MAX", 0.2)
+    spool_dir = tmp_path / "spool"
+    exporter = TelegrafExporter(listener.url, str(spool_dir), batch_lines=10)
+    listener.down = True
+    exporter.submit_many(make_lines(30))
+    assert exporter.flush(timeout=10)
+    assert len(exporter.spool) == 3
+
+    # A spooled batch removed meanwhile, then a spool that can't be written
+    os.remove(os.path.join(str(spool_dir), exporter.spool.files[0][0]))
+    (tmp_path / "not-a-directory").write_text("")
+    monkeypatch.setattr(exporter.spool, "directory", str(tmp_path / "not-a-directory"))
+    exporter.submit_many(make_lines(10))
+    assert exporter.flush(timeout=10)
+    assert exporter.stats["lines_dropped"] == 10
+    monkeypatch.setattr(exporter.spool, "directory", str(spool_dir))
+
+    listener.down = False
+    lines = make_lines(20)
+    exporter.submit_many(lines)
+    wait_received(listener, exporter, 40)
+    exporter.close()
+    # The two remaining spooled batches, then the new lines
+    assert listener.received == make_lines(30)[10:] + lines
+    assert exporter.stats["errors"] == 0
+
+
+def test_submit_drops_instead_of_blocking(tmp_path, monkeypatch):
+    monkeypatch.setattr(telegraf_exporter, "MAX_PENDING_LINES", 5)
+    # Unreachable listener and a sender that never takes the lines
+    exporter = TelegrafExporter("http://127.0.0.1:9/telegraf", str(tmp_path), batch_lines=100, flush_interval=60)
+    results = [exporter.submit(line) for line in make_lines(8)]
+    assert results == [True] * 5 + [False] * 3
+    assert exporter.stats["lines_dropped"] == 3
+    exporter.close()
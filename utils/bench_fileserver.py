@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# Compare the former static file server (SimpleHTTPRequestHandler on
+# ThreadingTCPServer, chdir) with maskcam_fileserver (sendfile, Range,
+# keep-alive, worker pool) on concurrent downloads of clip-sized files.
+# Usage: python3 utils/bench_fileserver.py [--clients 16] [--clips 8] [--clip-mb 18]
+# 18 MB is about a 35 s clip (fileserver-video-duration) at 4 Mbit/s.
+#
+# --slow N: N clients downloading at --slow-rate KB/s each (like cellular
+# links), against the former server and both fileserver-mode values.
+# Reports server memory per connection, threads and clients served.
+# --client-rate caps the asyncio server per connection (fileserver-client-rate).
+
+import os
+import sys
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import http.client
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+READ_SIZE = 1024 * 1024
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def run_legacy_server(root, port):
+    from http.server import SimpleHTTPRequestHandler
+    from socketserver import ThreadingTCPServer
+
+    os.chdir(root)
+    SimpleHTTPRequestHandler.log_message = lambda *args: None
+    ThreadingTCPServer.handle_error = lambda *args: None  # Clients reset on exit
+    with ThreadingTCPServer(("127.0.0.1", port), SimpleHTTPRequestHandler) as httpd:
+        httpd.serve_forever(poll_interval=0.5)
+
+
+def run_new_server(root, port, workers):
+    from maskcam.maskcam_fileserver import FileRequestHandler, PooledHTTPServer
+
+    with PooledHTTPServer(("127.0.0.1", port), FileRequestHandler, root, workers) as httpd:
+        httpd.serve_forever(poll_interval=0.5)
+
+
+def run_async_server(root, port, max_connections, client_rate):
+    from maskcam.maskcam_fileserver import AsyncFileServer
+
+    with AsyncFileServer(
+        ("127.0.0.1", port), root, max_connections=max_connections, client_rate=client_rate * 1000
+    ) as httpd:
+        httpd.serve_forever()
+
+
+def rss_kb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")  # utime + stime
+
+
+def thread_count(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("Threads:"):
+                return int(line.split()[1])
+    return 0
+
+
+def download(port, names, keepalive):
+    # Downloads each file, returns bytes received
+    received = 0
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    for name in names:
+        connection.request("GET", "/" + name)
+        response = connection.getresponse()
+        while True:
+            chunk = response.read(READ_SIZE)
+            if not chunk:
+                break
+            received += len(chunk)
+        if not keepalive or response.will_close:
+            connection.close()
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    connection.close()
+    return received
+
+
+def seek(port, name, size, n_requests):
+    # Range requests like a video player seeking, returns latencies (s)
+    latencies = []
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    for _ in range(n_requests):
+        start = random.randrange(0, size - 65536)
+        t_start = time.perf_counter()
+        connection.request("GET", "/" + name, headers={"Range": f"bytes={start}-{start + 65535}"})
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - t_start)
+        if response.will_close:
+            connection.close()
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    connection.close()
+    return latencies
+
+
+def bench(label, process, port, names, clip_size, clients, keepalive):
+    # Wait for the server
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+
+    peak_threads = [0]
+    done = threading.Event()
+
+    def sample_threads():
+        while not done.is_set():
+            peak_threads[0] = max(peak_threads[0], thread_count(process.pid))
+            time.sleep(0.01)
+
+    sampler = threading.Thread(target=sample_threads, daemon=True)
+    sampler.start()
+    cpu_before = cpu_seconds(process.pid)
+    t_start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as executor:
+        received = sum(executor.map(lambda _: download(port, names, keepalive), range(clients)))
+    seconds = time.perf_counter() - t_start
+    cpu = cpu_seconds(process.pid) - cpu_before
+    latencies = sorted(seek(port, names[0], clip_size, 50))
+    done.set()
+    sampler.join()
+
+    gigabytes = received / 1e9
+    print(
+        f"{label:<7} {received / seconds / 1e6:8.0f} MB/s  CPU {cpu:5.2f} s ({cpu / gigabytes:.2f} s/GB)  "
+        f"threads {peak_threads[0]:>3}  64 KB seek p50 {1000 * latencies[len(latencies) // 2]:6.1f} ms"
+    )
+
+
+async def slow_client(loop, port, name, rate, stats):
+    # Downloads at about rate bytes/s with a small receive buffer, until cancelled
+    conn = socket.socket()
+    conn.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 16384)
+    conn.setblocking(False)
+    try:
+        await loop.sock_connect(conn, ("127.0.0.1", port))
+        await loop.sock_sendall(conn, f"GET /{name} HTTP/1.1\r\nHost: bench\r\n\r\n".encode())
+        first = await loop.sock_recv(conn, 4096)
+        if first.split(b" ", 2)[1:2] != [b"200"]:
+            stats["rejected"] += 1
+            return
+        stats["served"] += 1
+        t_start = time.monotonic()
+        received = 0
+        while True:
+            chunk = await loop.sock_recv(conn, 4096)
+            if not chunk:
+                break
+            received += len(chunk)
+            stats["bytes"] += len(chunk)
+            delay = t_start + received / rate - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+    except OSError:
+        stats["rejected"] += 1
+    finally:
+        conn.close()
+
+
+def bench_slow(label, process, port, names, args):
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    time.sleep(0.2)
+    rss_before = rss_kb(process.pid)
+    cpu_before = cpu_seconds(process.pid)
+    stats = {"served": 0, "rejected": 0, "bytes": 0}
+    samples = {"rss": 0, "threads": 0}
+
+    async def run_clients():
+        loop = asyncio.get_event_loop()
+        tasks = [
+            asyncio.ensure_future(slow_client(loop, port, names[idx % len(names)], args.slow_rate * 1000, stats))
+            for idx in range(args.slow)
+        ]
+        t_end = time.monotonic() + args.seconds
+        while time.monotonic() < t_end:
+            await asyncio.sleep(0.25)
+            samples["rss"] = max(samples["rss"], rss_kb(process.pid))
+            samples["threads"] = max(samples["threads"], thread_count(process.pid))
+        bytes_at_end = stats["bytes"]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return bytes_at_end
+
+    loop = asyncio.new_event_loop()
+    received = loop.run_until_complete(run_clients())
+    loop.close()
+    cpu = cpu_seconds(process.pid) - cpu_before
+    served = max(stats["served"], 1)
+    waiting = args.slow - stats["served"] - stats["rejected"]
+    print(
+        f"{label:<8} served {stats['served']:>4}  waiting {waiting:>4}  rejected {stats['rejected']:>4}  "
+        f"threads {samples['threads']:>4}  "
+        f"RSS +{(samples['rss'] - rss_before) / 1024:6.1f} MB ({(samples['rss'] - rss_before) / served:5.1f} KB/conn)  "
+        f"{received / args.seconds / served / 1000:6.1f} KB/s per client  CPU {cpu:5.2f} s"
+    )
+
+
+def main_slow(args, root, names):
+    print(
+        f"{args.slow} clients reading at {args.slow_rate} KB/s for {args.seconds} s"
+        + (f", asyncio cap {args.client_rate} KB/s per client" if args.client_rate else "")
+    )
+    for label, target, extra in (
+        ("former", run_legacy_server, ()),
+        ("threads", run_new_server, (args.workers,)),
+        ("asyncio", run_async_server, (args.max_connections, args.client_rate)),
+    ):
+        port = free_port()
+        process = mp.Process(target=target, args=(root, port) + extra, daemon=True)
+        process.start()
+        try:
+            bench_slow(label, process, port, names, args)
+        finally:
+            process.terminate()
+            process.join()
+
+
+def main(args):
+    random.seed(0)
+    clip_size = int(args.clip_mb * 1e6)
+    block = os.urandom(READ_SIZE)
+    with tempfile.TemporaryDirectory() as root:
+        names = []
+        for idx in range(args.clips):
+            name = f"20250101_0800{idx:02d}_{idx}.mp4"
+            with open(os.path.join(root, name), "wb") as f:
+                for _ in range(clip_size // READ_SIZE):
+                    f.write(block)
+                f.write(block[: clip_size % READ_SIZE])
+            names.append(name)
+        if args.slow:
+            main_slow(args, root, names)
+            return
+        print(f"{args.clients} clients downloading {args.clips} x {args.clip_mb} MB clips each")
+
+        for label, target, extra, keepalive in (
+            ("former", run_legacy_server, (), False),
+            ("new", run_new_server, (args.workers,), True),
+        ):
+            port = free_port()
+            process = mp.Process(target=target, args=(root, port) + extra, daemon=True)
+            process.start()
+            try:
+                bench(label, process, port, names, clip_size, args.clients, keepalive)
+            finally:
+                process.terminate()
+                process.join()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Static file server benchmark")
+    arg_parser.add_argument("--clients", type=int, default=16)
+    arg_parser.add_argument("--clips", type=int, default=8)
+    arg_parser.add_argument("--clip-mb", type=float, default=18)
+    arg_parser.add_argument("--workers", type=int, default=16, help="New server worker threads")
+    arg_parser.add_argument("--slow", type=int, default=0, help="Number of slow clients (slow clients mode)")
+    arg_parser.add_argument("--slow-rate", type=float, default=20, help="Slow clients read rate, KB/s")
+    arg_parser.add_argument("--seconds", type=float, default=10, help="Slow clients mode duration")
+    arg_parser.add_argument("--max-connections", type=int, default=500, help="asyncio server connection limit")
+    arg_parser.add_argument("--client-rate", type=float, default=0, help="asyncio server cap per client, KB/s")
+    main(arg_parser.parse_args())
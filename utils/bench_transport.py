@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# Compare the transports from inference to its consumers (transport-streaming,
+# transport-filesave): loopback UDP (multiudpsink -> udpsrc) and shared memory
+# (shmsink -> shmsrc), with the same settings maskcam uses.
+# A sender process payloads raw test video into RTP (many packets per frame,
+# no encoder needed) to --receivers receiver processes, which count RTP
+# packets lost (sequence number gaps) and the CPU each process used.
+# --load N: N busy processes competing for the CPU, like inference running.
+# Usage: python3 utils/bench_transport.py [--seconds 20] [--receivers 2] [--load 4]
+
+import os
+import time
+import argparse
+import tempfile
+import multiprocessing as mp
+
+import gi
+
+gi.require_version("Gst", "1.0")
+from gi.repository import GLib, Gst
+
+RTP_CAPS = "application/x-rtp, media=video, clock-rate=90000, encoding-name=(string)RAW, payload=96"
+UDP_BUFFER_SIZE = 524288  # As maskcam_streaming and maskcam_filesave
+FIRST_PORT = 5450
+
+
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")  # utime + stime
+
+
+def busy_loop(e_stop):
+    while not e_stop.is_set():
+        for _ in range(100000):
+            pass
+
+
+def run_pipeline(pipeline, seconds):
+    g_loop = GLib.MainLoop()
+    pipeline.set_state(Gst.State.PLAYING)
+    GLib.timeout_add(int(seconds * 1000), g_loop.quit)
+    g_loop.run()
+    pipeline.set_state(Gst.State.NULL)
+
+
+def sender(transport, args, sockets, results):
+    Gst.init(None)
+    source = (
+        f"videotestsrc is-live=true pattern=ball ! video/x-raw,format=I420,width={args.width},"
+        f"height={args.height},framerate={args.fps}/1 ! rtpvrawpay mtu=1400"
+    )
+    if transport == "udp":
+        clients = ",".join(f"127.0.0.1:{FIRST_PORT + idx}" for idx in range(args.receivers))
+        launch = f"{source} ! multiudpsink clients={clients} sync=true async=false"
+    else:
+        # As the inference pipeline: bounded leaky queue before each shmsink
+        launch = f"{source} ! tee name=t"
+        for idx, socket_path in enumerate(sockets):
+            launch += (
+                f" t. ! queue name=queue_shm{idx} leaky=2 max-size-buffers={args.shm_queue_packets}"
+                f" max-size-bytes=0 max-size-time=0 ! shmsink socket-path={socket_path}"
+                f" shm-size={args.shm_size_kb * 1024} wait-for-connection=false sync=true async=false"
+            )
+    pipeline = Gst.parse_launch(launch)
+    drops = [0]
+
+    def cb_overrun(queue):
+        drops[0] += 1
+
+    if transport == "shm":
+        for idx in range(len(sockets)):
+            pipeline.get_by_name(f"queue_shm{idx}").connect("overrun", cb_overrun)
+    run_pipeline(pipeline, args.seconds + 2)  # Outlives the receivers
+    results.put(("sender", 0, drops[0]))
+
+
+def receiver(transport, idx, args, sockets, results):
+    Gst.init(None)
+    if transport == "udp":
+        launch = f'udpsrc port={FIRST_PORT + idx} buffer-size={UDP_BUFFER_SIZE} caps="{RTP_CAPS}"'
+    else:
+        launch = (
+            f"shmsrc socket-path={sockets[idx]} is-live=true do-timestamp=true"
+            f' ! capsfilter caps="{RTP_CAPS}"'
+        )
+    pipeline = Gst.parse_launch(f"{launch} ! fakesink name=sink sync=false")
+    counts = {"received": 0, "lost": 0, "last": None}
+
+    def cb_received(pad, info):
+        header = info.get_buffer().extract_dup(0, 4)
+        seq = header[2] << 8 | header[3]
+        if counts["last"] is not None:
+            counts["lost"] += (seq - counts["last"] - 1) % 65536
+        counts["last"] = seq
+        counts["received"] += 1
+        return Gst.PadProbeReturn.OK
+
+    pipeline.get_by_name("sink").get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, cb_received)
+    run_pipeline(pipeline, args.seconds)
+    results.put((f"receiver {idx}", counts["received"], counts["lost"]))
+
+
+def bench(transport, args, runtime_dir):
+    sockets = [os.path.join(runtime_dir, f"video-{transport}-{idx}.sock") for idx in range(args.receivers)]
+    results = mp.Queue()
+    e_stop = mp.Event()
+    loaders = [mp.Process(target=busy_loop, args=(e_stop,), daemon=True) for _ in range(args.load)]
+    for process in loaders:
+        process.start()
+
+    send = mp.Process(target=sender, args=(transport, args, sockets, results))
+    receivers = [
+        mp.Process(target=receiver, args=(transport, idx, args, sockets, results)) for idx in range(args.receivers)
+    ]
+    if transport == "udp":
+        for process in receivers:
+            process.start()
+        time.sleep(1)
+        send.start()
+    else:
+        send.start()  # shmsrc needs the shmsink socket
+        time.sleep(1)
+        for process in receivers:
+            process.start()
+
+    cpu = {}
+    time.sleep(1)  # Skip startup
+    for process in [send] + receivers:
+        cpu[process.pid] = cpu_seconds(process.pid)
+    measured = args.seconds - 3  # Ends before the first receiver
+    time.sleep(measured)
+    for process in [send] + receivers:
+        cpu[process.pid] = cpu_seconds(process.pid) - cpu[process.pid]
+
+    for process in [send] + receivers:
+        process.join()
+    e_stop.set()
+    for process in loaders:
+        process.join()
+
+    counts = dict((name, (a, b)) for name, a, b in (results.get() for _ in range(1 + args.receivers)))
+    _, shm_drops = counts.pop("sender")
+    received = sum(a for a, _ in counts.values())
+    lost = sum(b for _, b in counts.values())
+    receivers_cpu = sum(cpu[process.pid] for process in receivers)
+    print(
+        f"{transport:<4} received {received:>8}  lost {lost:>7}"
+        f" ({100 * lost / max(received + lost, 1):5.2f} %)"
+        + (f"  queue drops {shm_drops:>6}" if transport == "shm" else "")
+        + f"  CPU sender {100 * cpu[send.pid] / measured:5.1f} %"
+        f"  receivers {100 * receivers_cpu / measured:5.1f} %"
+    )
+
+
+def main(args):
+    packets_per_frame = args.width * args.height * 3 // 2 // 1400 + 1
+    print(
+        f"{args.width}x{args.height}@{args.fps} raw RTP, ~{packets_per_frame * args.fps} packets/s"
+        f" to {args.receivers} receivers, {args.load} busy processes, {args.seconds} s"
+    )
+    with tempfile.TemporaryDirectory() as runtime_dir:
+        for transport in args.transports.split(","):
+            bench(transport, args, runtime_dir)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="UDP vs shared memory RTP transport benchmark")
+    arg_parser.add_argument("--transports", default="udp,shm")
+    arg_parser.add_argument("--seconds", type=float, default=20, help="Receivers run time, at least 5")
+    arg_parser.add_argument("--receivers", type=int, default=2, help="Like streaming + 1 file-save")
+    arg_parser.add_argument("--load", type=int, default=0, help="Busy processes during the test")
+    arg_parser.add_argument("--width", type=int, default=640)
+    arg_parser.add_argument("--height", type=int, default=360)
+    arg_parser.add_argument("--fps", type=int, default=30)
+    arg_parser.add_argument("--shm-size-kb", type=int, default=4096)
+    arg_parser.add_argument("--shm-queue-packets", type=int, default=512)
+    main(arg_parser.parse_args())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# Count wakeups (context switches) per thread of running processes.
+# Usage: python3 utils/count_wakeups.py <seconds> <pid> [<pid> ...]
+# e.g. measure idle maskcam processes: pgrep -f maskcam_run | xargs python3 utils/count_wakeups.py 10
+# Or compare, in idle GLib loops, the former 100 ms polling timer
+# (glib_cb_restart) with utils.glib_watch_interrupt, then the inference
+# output branches following OutputConsumers with the former 500 ms poll or
+# the change pipe, and how soon a new consumer is seen (needs only GLib):
+#   python3 utils/count_wakeups.py --compare <seconds>
+
+import os
+import sys
+import time
+import multiprocessing as mp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+POLL_INTERVAL = 100  # ms, as the former streaming and inference loops
+CONSUMERS_POLL_INTERVAL = 500  # ms, as the former inference output branches
+
+
+def read_switches(pid):
+    # Returns {tid: (thread name, voluntary + involuntary switches)}
+    switches = {}
+    task_dir = f"/proc/{pid}/task"
+    for tid in os.listdir(task_dir):
+        try:
+            with open(f"{task_dir}/{tid}/status") as f:
+                fields = dict(line.split(":", 1) for line in f if ":" in line)
+        except FileNotFoundError:
+            continue  # Thread ended
+        total = int(fields["voluntary_ctxt_switches"]) + int(fields["nonvoluntary_ctxt_switches"])
+        switches[tid] = (fields["Name"].strip(), total)
+    return switches
+
+
+def count(seconds, pids):
+    # Returns {pid: {tid: (thread name, wakeups/s)}}
+    before = {pid: read_switches(pid) for pid in pids}
+    time.sleep(seconds)
+    rates = {}
+    for pid in pids:
+        rates[pid] = {}
+        for tid, (name, total) in read_switches(pid).items():
+            rates[pid][tid] = (name, (total - before[pid].get(tid, (name, 0))[1]) / seconds)
+    return rates
+
+
+def main(seconds, pids):
+    for pid, threads in count(seconds, pids).items():
+        print(f"PID {pid}:")
+        for tid, (name, rate) in sorted(threads.items()):
+            print(f"  thread {tid:>7} {name:<16} {rate:8.1f} wakeups/s")
+        print(f"  total {sum(rate for _, rate in threads.values()):.1f} wakeups/s")
+
+
+def idle_loop(mode, e_interrupt, consumers=None, e_seen=None):
+    from gi.repository import GLib
+    from maskcam.utils import glib_watch_interrupt
+
+    # Stand-in for OutputBranches.update (no GStreamer needed)
+    def cb_update():
+        if consumers.active_ports():
+            e_seen.set()
+        return True
+
+    def cb_consumers_changed(fd, condition):
+        consumers.clear_changed()
+        return cb_update()
+
+    if mode == "timer":
+        # Former loop: iterate, re-arming a timer to check the interrupt
+        def glib_cb_restart(t_restart):
+            GLib.timeout_add(t_restart, glib_cb_restart, t_restart)
+
+        g_context = GLib.MainContext.default()
+        GLib.timeout_add(POLL_INTERVAL, glib_cb_restart, POLL_INTERVAL)
+        while not e_interrupt.is_set():
+            g_context.iteration(True)
+    else:
+        if mode == "outputs-poll":
+            GLib.timeout_add(CONSUMERS_POLL_INTERVAL, cb_update)
+        elif mode == "outputs-watch":
+            GLib.io_add_watch(consumers.fileno(), GLib.PRIORITY_DEFAULT, GLib.IOCondition.IN, cb_consumers_changed)
+        g_loop = GLib.MainLoop()
+        close_interrupt_watch = glib_watch_interrupt(e_interrupt, g_loop.quit)
+        g_loop.run()
+        close_interrupt_watch()
+
+
+def compare(seconds):
+    from maskcam.outputs import OutputConsumers
+
+    for mode in ("timer", "watch", "outputs-poll", "outputs-watch"):
+        e_interrupt = mp.Event()
+        consumers = OutputConsumers([5400])
+        e_seen = mp.Event()
+        process = mp.Process(target=idle_loop, args=(mode, e_interrupt, consumers, e_seen))
+        process.start()
+        time.sleep(1)  # Startup
+        threads = count(seconds, [process.pid])[process.pid]
+        seen = ""
+        if mode.startswith("outputs"):
+            t_added = time.monotonic()
+            consumers.set(5400, 1)
+            e_seen.wait(5)
+            seen = f", consumer seen in {1000 * (time.monotonic() - t_added):.1f} ms"
+        t_stop = time.monotonic()
+        e_interrupt.set()
+        process.join()
+        print(
+            f"{mode:<13} {sum(rate for _, rate in threads.values()):6.1f} wakeups/s"
+            f" ({len(threads)} threads), stopped in {1000 * (time.monotonic() - t_stop):.0f} ms{seen}"
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--compare":
+        compare(float(sys.argv[2]))
+    elif len(sys.argv) >= 3:
+        main(float(sys.argv[1]), sys.argv[2:])
+    else:
+        print("Usage: python3 utils/count_wakeups.py <seconds> <pid> [<pid> ...]")
+        print("       python3 utils/count_wakeups.py --compare <seconds>")
+        sys.exit(1)
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# Fake ESP32 GPS on a pseudo-terminal, to run save_serial and live tagging without the device.
+# Usage: python3 utils/fake_gps_serial.py [rate_hz] [seconds]
+# then, in another terminal: MASKCAM_SERIAL_PORT=<printed pty> python3 maskcam_run.py
+#                        or: python3 -m maskcam.save_serial <printed pty>
+
+import os
+import sys
+import time
+import tty
+from datetime import datetime
+
+SPEED = 16.7  # m/s, ~60 km/h
+START_LAT = 6.9
+START_LON = 79.86
+
+
+def main(rate_hz, seconds):
+    master, slave = os.openpty()
+    tty.setraw(slave)  # No echo or newline translation, like a real serial port
+    print(f"Fake GPS on {os.ttyname(slave)} at {rate_hz} Hz", flush=True)
+
+    t_start = time.monotonic()
+    n_fixes = 0
+    while seconds is None or time.monotonic() - t_start < seconds:
+        distance = n_fixes * SPEED / rate_hz
+        lat = START_LAT + distance / 111_320
+        lon = START_LON + 0.3 * distance / 111_320
+        now = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+        os.write(master, f"GPS: {lat:.6f}, {lon:.6f} @ {now}\r\n".encode())
+        n_fixes += 1
+        time.sleep(max(t_start + n_fixes / rate_hz - time.monotonic(), 0))
+    print(f"Sent {n_fixes} fixes")
+
+
+if __name__ == "__main__":
+    rate = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else None
+    main(rate, duration)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# Average CPU usage and power draw over a period, with the output state
+# reported by maskcam (status endpoint), to compare idle and active outputs.
+# Usage: python3 utils/measure_power.py [--seconds 60] [--status http://127.0.0.1:8090/status]
+# e.g. with output-on-demand=1, measure with no RTSP client attached (and no
+# file-save segment), then again while playing the RTSP stream.
+# Power is read from the Jetson INA3221 monitors (sysfs), if present.
+
+import glob
+import json
+import time
+import argparse
+import urllib.request
+
+SAMPLE_INTERVAL = 0.5  # seconds
+
+# L4T 32 (ina3221x driver): in_power<N>_input in mW, named by rail_name_<N>
+INA3221X_GLOB = "/sys/bus/i2c/drivers/ina3221x/*/iio:device*/in_power[0-9]_input"
+# Later kernels (ina3221 hwmon driver): in<N>_input in mV, curr<N>_input in mA, in<N>_label
+INA3221_GLOB = "/sys/bus/i2c/drivers/ina3221/*/hwmon/hwmon*/in[0-9]_input"
+
+
+def read_int(path):
+    with open(path) as f:
+        return int(f.read().strip())
+
+
+def find_rails():
+    # Returns {rail name: function returning mW}
+    rails = {}
+    for path in sorted(glob.glob(INA3221X_GLOB)):
+        channel = path[-len("0_input") : -len("_input")]
+        try:
+            with open(path.replace(f"in_power{channel}_input", f"rail_name_{channel}")) as f:
+                name = f.read().strip()
+        except OSError:
+            name = f"rail{channel}"
+        rails[name] = lambda path=path: read_int(path)
+    for path in sorted(glob.glob(INA3221_GLOB)):
+        channel = path[-len("0_input") : -len("_input")]
+        base = path[: -len(f"in{channel}_input")]
+        try:
+            with open(f"{base}in{channel}_label") as f:
+                name = f.read().strip()
+        except OSError:
+            continue  # Channel not connected
+        current_path = f"{base}curr{channel}_input"
+        rails[name] = lambda path=path, current_path=current_path: (
+            read_int(path) * read_int(current_path) // 1000
+        )
+    return rails
+
+
+def cpu_times():
+    # (busy, total) jiffies of all CPUs
+    with open("/proc/stat") as f:
+        values = [int(value) for value in f.readline().split()[1:]]
+    idle = values[3] + values[4]  # idle + iowait
+    total = sum(values[:8])  # guest times are already in user/nice
+    return total - idle, total
+
+
+def get_outputs(status_url):
+    # Output state from the maskcam status endpoint, None if not available
+    try:
+        with urllib.request.urlopen(status_url, timeout=2) as response:
+            status = json.loads(response.read().decode())
+    except (OSError, ValueError):
+        return None
+    inference = status.get("inference", {})
+    return {
+        "encoding": inference.get("output_encoding"),
+        "ports": inference.get("output_ports"),
+        "consumers": status.get("outputs"),
+    }
+
+
+def main(args):
+    rails = find_rails()
+    if not rails:
+        print("No power monitors found, measuring CPU only")
+    print(f"Outputs at start: {get_outputs(args.status)}")
+
+    busy_start, total_start = cpu_times()
+    power_sums = {name: 0 for name in rails}
+    n_samples = 0
+    t_end = time.monotonic() + args.seconds
+    while time.monotonic() < t_end:
+        time.sleep(SAMPLE_INTERVAL)
+        for name, read_power in rails.items():
+            power_sums[name] += read_power()
+        n_samples += 1
+    busy_end, total_end = cpu_times()
+
+    print(f"Outputs at end:   {get_outputs(args.status)}")
+    print(f"CPU: {100 * (busy_end - busy_start) / max(total_end - total_start, 1):.1f} % (all cores)")
+    for name, power_sum in power_sums.items():
+        print(f"{name:<16} {power_sum / max(n_samples, 1):7.0f} mW")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="CPU and power draw over a period")
+    arg_parser.add_argument("--seconds", type=float, default=60)
+    arg_parser.add_argument("--status", default="http://127.0.0.1:8090/status", help="maskcam status URL")
+    main(arg_parser.parse_args())